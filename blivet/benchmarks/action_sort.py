@@ -0,0 +1,85 @@
+#!/usr/bin/python
+#
+# Cost of DeviceTree.pruneActions and sortActions on 10000 synthetic actions.
+#
+# Each of 2500 disks gets its old format destroyed and a new partition with
+# a filesystem and a device on top of that created, which is roughly what
+# clearing and laying out a large number of disks produces. The first 500
+# actions are also sorted with the pairwise algorithm sortActions used to
+# run, to compare the timing and to check that the order is the same.
+#
+# Run as: PYTHONPATH=. python benchmarks/action_sort.py
+
+import time
+
+from blivet.devicetree import DeviceTree
+from blivet.devices import StorageDevice
+from blivet.deviceaction import ActionDestroyFormat, ActionCreateDevice
+from blivet.deviceaction import ActionCreateFormat
+from blivet.formats import getFormat
+
+DISKS = 2500
+REFERENCE_ACTIONS = 500
+
+def build_actions():
+    actions = []
+    for i in range(DISKS):
+        disk = StorageDevice("sd%04d" % i, exists=True)
+        part = StorageDevice("sd%04d1" % i, parents=[disk])
+        top = StorageDevice("top%04d" % i, parents=[part])
+        actions.append(ActionDestroyFormat(disk))
+        actions.append(ActionCreateDevice(part))
+        actions.append(ActionCreateFormat(part, getFormat("ext4")))
+        actions.append(ActionCreateDevice(top))
+
+    # register them in an order that needs sorting
+    return actions[::-1]
+
+def pairwise_sort(actions):
+    """ The algorithm sortActions used before. """
+    edges = []
+    for (i, action) in enumerate(actions):
+        for (j, _action) in enumerate(actions):
+            if i != j and (action.type > _action.type or
+                           _action.requires(action)):
+                edges.append((i, j))
+
+    incoming = dict((i, 0) for i in range(len(actions)))
+    for (parent, child) in edges:
+        incoming[child] += 1
+
+    order = []
+    roots = [i for i in range(len(actions)) if incoming[i] == 0]
+    while roots:
+        root = roots.pop()
+        order.append(root)
+        for (parent, child) in [e for e in edges if e[0] == root]:
+            incoming[child] -= 1
+            if incoming[child] == 0:
+                roots.append(child)
+
+    return [actions[i] for i in order]
+
+def timed(label, func, *args):
+    start = time.time()
+    result = func(*args)
+    print("%-36s %8.3fs" % (label, time.time() - start))
+    return result
+
+def main():
+    actions = build_actions()
+    tree = DeviceTree()
+    tree._actions = actions[:]
+    timed("pruneActions (%d actions)" % len(actions), tree.pruneActions)
+    timed("sortActions (%d actions)" % len(actions), tree.sortActions)
+
+    subset = actions[:REFERENCE_ACTIONS]
+    tree._actions = subset[:]
+    timed("sortActions (%d actions)" % len(subset), tree.sortActions)
+    reference = timed("pairwise sort (%d actions)" % len(subset),
+                      pairwise_sort, subset)
+    if [a.id for a in reference] != [a.id for a in tree._actions]:
+        print("ORDER MISMATCH")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+#
+# Cost of Blivet.clearPartitions on 2000 disks, each carrying a formatted
+# device, and of the tree queries it is made of. Writing the new disklabels
+# needs real disks, so that part is left out.
+#
+# Run as: PYTHONPATH=. python benchmarks/clear_partitions.py
+
+import time
+
+from pykickstart.constants import CLEARPART_TYPE_ALL
+
+from blivet import Blivet
+from blivet.devices import DiskDevice, StorageDevice
+from blivet.flags import flags
+from blivet.formats import getFormat
+
+DISKS = 2000
+
+def build_storage():
+    storage = Blivet()
+    storage.config.clearPartType = CLEARPART_TYPE_ALL
+    storage.initializeDisk = lambda disk: None
+
+    tree = storage.devicetree
+    for i in range(DISKS):
+        disk = DiskDevice("sd%04d" % i, size=1024, exists=True)
+        disk.format = getFormat("lvmpv", device=disk.path, exists=True)
+        tree._addDevice(disk)
+        data = StorageDevice("data%04d" % i, parents=[disk], size=1024,
+                             exists=True)
+        data.format = getFormat("ext4", device=data.path, exists=True)
+        tree._addDevice(data)
+
+    return storage
+
+def queries(tree):
+    for disk in tree.getDevicesByType("disk"):
+        tree.getChildren(disk)
+        tree.getDependentDevices(disk)
+        tree.leaves
+
+def timed(label, func, *args):
+    start = time.time()
+    result = func(*args)
+    print("%-36s %8.3fs" % (label, time.time() - start))
+    return result
+
+def main():
+    # disks without media would be skipped
+    flags.testing = True
+
+    storage = timed("build (%d disks)" % DISKS, build_storage)
+    timed("children, dependents and leaves", queries, storage.devicetree)
+    timed("clearPartitions", storage.clearPartitions)
+    print("%d actions" % len(storage.devicetree._actions))
+
+if __name__ == "__main__":
+    main()
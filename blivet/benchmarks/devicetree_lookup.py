@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#
+# Lookup cost of DeviceTree.getDeviceBy* on a synthetic 5000 device tree.
+#
+# The tree consists of 1000 disks with four partitions each. Every partition
+# has a uuid, a sysfs path and a labeled filesystem. The indexed lookups are
+# compared with the linear scan DeviceTree used before it had lookup tables.
+#
+# Run as: PYTHONPATH=. python benchmarks/devicetree_lookup.py
+
+import random
+import time
+
+from blivet.devicetree import DeviceTree
+from blivet.devices import StorageDevice
+from blivet.formats import getFormat
+
+DISKS = 1000
+PARTS_PER_DISK = 4
+LOOKUPS = 20000
+
+def build_tree():
+    tree = DeviceTree()
+    for i in range(DISKS):
+        name = "sd%04d" % i
+        disk = StorageDevice(name, exists=True,
+                             sysfsPath="/devices/virtual/block/%s" % name)
+        tree._addDevice(disk)
+        for j in range(1, PARTS_PER_DISK + 1):
+            pname = "%s%d" % (name, j)
+            part = StorageDevice(pname, parents=[disk], exists=True,
+                                 uuid="uuid-%s" % pname,
+                                 sysfsPath="%s/%s" % (disk.sysfsPath, pname))
+            part.format = getFormat("ext4", uuid="fs-%s" % pname,
+                                    label="label-%s" % pname,
+                                    device=part.path, exists=True)
+            tree._addDevice(part)
+
+    return tree
+
+def linear_name(tree, name):
+    for device in tree._devices[:]:
+        if not getattr(device, "complete", True):
+            continue
+
+        if device.name == name:
+            return device
+
+def linear_uuid(tree, uuid):
+    for device in tree._devices[:]:
+        if not getattr(device, "complete", True):
+            continue
+
+        if device.uuid == uuid or device.format.uuid == uuid:
+            return device
+
+def run(label, func, keys):
+    start = time.time()
+    for key in keys:
+        func(key)
+    elapsed = time.time() - start
+    print("%-28s %8.2f us/lookup" % (label, elapsed * 1000000 / len(keys)))
+
+def main():
+    start = time.time()
+    tree = build_tree()
+    print("built tree with %d devices in %.2fs"
+          % (len(tree._devices), time.time() - start))
+
+    names = [d.name for d in tree._devices]
+    rand = random.Random(42)
+    keys = [rand.choice(names) for i in range(LOOKUPS)]
+    parts = [d.name for d in tree._devices if d.parents]
+    uuids = ["fs-%s" % rand.choice(parts) for i in range(LOOKUPS)]
+    labels = ["label-%s" % rand.choice(parts) for i in range(LOOKUPS)]
+    paths = ["/dev/%s" % k for k in keys]
+    missing = ["nonexistent%d" % i for i in range(LOOKUPS)]
+
+    run("getDeviceByName", tree.getDeviceByName, keys)
+    run("getDeviceByName (miss)", tree.getDeviceByName, missing)
+    run("getDeviceByPath", tree.getDeviceByPath, paths)
+    run("getDeviceByUuid", tree.getDeviceByUuid, uuids)
+    run("getDeviceByLabel", tree.getDeviceByLabel, labels)
+
+    # the linear scans are slow enough that a tenth of the lookups will do
+    run("linear scan by name", lambda k: linear_name(tree, k),
+        keys[:LOOKUPS / 10])
+    run("linear scan by uuid", lambda k: linear_uuid(tree, k),
+        uuids[:LOOKUPS / 10])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+#
+# Micro-benchmarks for blivet.size.Size: parsing, arithmetic, comparisons
+# and formatting, in the proportions the size tests and the partitioning
+# code use them.
+#
+# Run as: PYTHONPATH=. python benchmarks/size.py
+
+import timeit
+
+SETUP = """
+from blivet.size import Size
+a = Size(bytes=58929971)
+b = Size(bytes=4096)
+sizes = [Size(bytes=i * 1048576) for i in range(1000)]
+"""
+
+BENCHMARKS = [("Size(bytes=...)", "Size(bytes=58929971)", 100000),
+              ("Size(spec='56.19 MiB')", "Size(spec='56.19 MiB')", 20000),
+              ("Size(spec='640 kilobytes')", "Size(spec='640 kilobytes')",
+               20000),
+              ("a + b", "a + b", 100000),
+              ("a - b", "a - b", 100000),
+              ("a * 3", "a * 3", 100000),
+              ("a / b", "a / b", 100000),
+              ("a < b", "a < b", 100000),
+              ("sum(1000 sizes)", "sum(sizes)", 100),
+              ("max(1000 sizes)", "max(sizes)", 100),
+              ("a.convertTo('MiB')", "a.convertTo('MiB')", 20000),
+              ("a.humanReadable()", "a.humanReadable()", 20000),
+              ("str(a)", "str(a)", 20000)]
+
+def main():
+    for (label, stmt, number) in BENCHMARKS:
+        timer = timeit.Timer(stmt, SETUP)
+        best = min(timer.repeat(repeat=3, number=number))
+        print("%-30s %8.3f usec" % (label, best * 1000000.0 / number))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+#
+# Cost of a log_method_call with the blivet logger below DEBUG, at DEBUG,
+# and with method calls being counted, compared to the inspect.stack() call it
+# used to make every time.
+#
+# Run as: PYTHONPATH=. python benchmarks/storage_log.py
+
+import inspect
+import logging
+import timeit
+
+from blivet import storage_log
+
+CALLS = 20000
+
+class Device(object):
+    name = "sda1"
+
+    def setup(self, orig=False):
+        storage_log.log_method_call(self, self.name, orig=orig)
+
+def nested(depth, func):
+    if depth:
+        return nested(depth - 1, func)
+    return func()
+
+def timed(label, func):
+    # run 30 frames deep, about what populate and processActions do
+    best = min(timeit.repeat(lambda: nested(30, func), repeat=3,
+                             number=CALLS))
+    print("%-36s %8.2f usec" % (label, best * 1000000.0 / CALLS))
+
+def main():
+    device = Device()
+    log = storage_log.log
+    log.setLevel(logging.INFO)
+    timed("inspect.stack()", inspect.stack)
+    timed("log_method_call, not at DEBUG", device.setup)
+
+    log.setLevel(logging.DEBUG)
+    timed("log_method_call, at DEBUG", device.setup)
+
+    log.setLevel(logging.INFO)
+    storage_log.enable_method_stats()
+    timed("log_method_call, counting", device.setup)
+    storage_log.disable_method_stats()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Cost of reading the size, label and UUID of 500 ext4 filesystems from
+# their superblocks, compared to running dumpe2fs on some of them (when it
+# is installed).
+#
+# The filesystems are 64MiB sparse image files made by mke2fs, or just the
+# first 4KiB of one if mke2fs is not installed.
+#
+# Run as: PYTHONPATH=. python benchmarks/superblock.py
+
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from blivet import util
+from blivet.devicelibs.superblock import read_superblock
+
+FILESYSTEMS = 500
+TOOL_RUNS = 20
+
+def make_image(path):
+    if util.find_program_in_path("mke2fs"):
+        with open(path, "w") as f:
+            f.truncate(64 * 1024 * 1024)
+        util.run_program(["mke2fs", "-q", "-F", "-t", "ext4", "-L", "bench",
+                          path])
+        return
+
+    buf = bytearray(4096)
+    buf[1028:1032] = struct.pack("<I", 16384)
+    buf[1048:1052] = struct.pack("<I", 2)
+    buf[1080:1084] = struct.pack("<HH", 0xEF53, 1)
+    buf[1144:1149] = "bench"
+    with open(path, "w") as f:
+        f.write(buf)
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        first = os.path.join(tmpdir, "fs0.img")
+        make_image(first)
+        paths = [first]
+        for i in range(1, FILESYSTEMS):
+            paths.append(os.path.join(tmpdir, "fs%d.img" % i))
+            os.link(first, paths[-1])
+
+        start = time.time()
+        superblocks = [read_superblock(p, "ext4") for p in paths]
+        elapsed = time.time() - start
+        print("%-36s %8.3fs" % ("read %d superblocks" % len(paths), elapsed))
+        if None in superblocks:
+            print("PARSE FAILED")
+
+        if util.find_program_in_path("dumpe2fs"):
+            start = time.time()
+            for path in paths[:TOOL_RUNS]:
+                util.capture_output(["dumpe2fs", "-h", path])
+            elapsed = (time.time() - start) * FILESYSTEMS / TOOL_RUNS
+            print("%-36s %8.3fs" % ("dumpe2fs, projected to %d" % FILESYSTEMS,
+                                    elapsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -2010,6 +2010,20 @@ class Blivet(object):
         log.debug("finished Blivet copy")
         return new
 
+    def snapshot(self):
+        """ Return a snapshot of the device tree and roots for restore.
+
+            This is a cheap alternative to copy for undoing trial changes,
+            since nothing but partition tables gets copied.
+        """
+        return (self.devicetree.snapshot(self.roots), self.roots[:])
+
+    def restore(self, snapshot):
+        """ Undo all changes to the device tree and roots since snapshot. """
+        (tree_snapshot, roots) = snapshot
+        self.devicetree.restore(tree_snapshot)
+        self.roots = roots[:]
+
     def getActiveMounts(self):
         """ Reflect active mounts in the appropriate devices' formats. """
         log.info("collecting information about active mounts")
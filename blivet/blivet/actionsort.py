@@ -0,0 +1,184 @@
+# actionsort.py
+# Pruning and ordering of DeviceTree's action list.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" Pruning and ordering of device actions.
+
+    Comparing every action with every other action gets expensive when
+    thousands of actions are registered, eg: when clearing hundreds of
+    disks. The functions in here only compare actions that can affect each
+    other:
+
+        - an action can only obsolete actions on the same device
+        - an action can only require actions on its device's ancestors, on
+          their descendants (eg: the other partitions on a disk) or on its
+          own descendants
+
+    Actions of a higher type (destroy, then resize, then create) always
+    come before actions of a lower type.
+
+    action_waves splits a sorted action list into waves of actions on
+    unrelated devices for DeviceTree.processActions to run concurrently.
+"""
+
+import tsort
+
+import logging
+log = logging.getLogger("blivet")
+
+def prune_actions(actions):
+    """ Return actions without the ones obsoleted by other actions.
+
+        The actions are compared in the same order DeviceTree always
+        compared them, starting with the last registered action.
+    """
+    by_device = {}
+    for action in actions:
+        by_device.setdefault(action.device.id, []).append(action)
+
+    pruned = set()
+    for action in reversed(actions):
+        if id(action) in pruned:
+            log.debug("action %d already pruned" % action.id)
+            continue
+
+        bucket = by_device[action.device.id]
+        for obsolete in bucket[:]:
+            if action.obsoletes(obsolete):
+                log.info("removing obsolete action %d (%d)"
+                         % (obsolete.id, action.id))
+                bucket.remove(obsolete)
+                pruned.add(id(obsolete))
+
+    return [a for a in actions if id(a) not in pruned]
+
+def _relation_keys(device):
+    """ Return the ids of device and all of its ancestors. """
+    keys = set()
+    devices = [device]
+    while devices:
+        device = devices.pop()
+        if device.id not in keys:
+            keys.add(device.id)
+            devices.extend(device.parents)
+
+    return keys
+
+def action_requirements(actions):
+    """ Return a list with the indices of the actions each action requires.
+
+        The list has one sorted list of indices into actions per action.
+    """
+    keys = [_relation_keys(a.device) for a in actions]
+    buckets = {}
+    for (idx, action_keys) in enumerate(keys):
+        for key in action_keys:
+            buckets.setdefault(key, []).append(idx)
+
+    requirements = []
+    for (idx, action) in enumerate(actions):
+        related = set()
+        for key in keys[idx]:
+            related.update(buckets[key])
+
+        related.discard(idx)
+        requirements.append(sorted(i for i in related
+                                        if action.requires(actions[i])))
+
+    return requirements
+
+def sort_actions(actions):
+    """ Return actions sorted so that no action comes before one it requires.
+
+        The order is the one a topological sort of all of the actions gives
+        when every action has an edge to each action of a lower type and to
+        each action that requires it. Since the type edges connect all of
+        the actions of one type to all of the actions of the next, the
+        actions are sorted one type at a time instead, and only the edges
+        between related actions are built.
+
+        Raises tsort.CyclicGraphError if there is no such order.
+    """
+    requirements = action_requirements(actions)
+    order = []
+    for action_type in sorted(set(a.type for a in actions), reverse=True):
+        members = [i for (i, a) in enumerate(actions) if a.type == action_type]
+        edges = []
+        for child in members:
+            for parent in requirements[child]:
+                if actions[parent].type == action_type:
+                    edges.append((parent, child))
+                elif actions[parent].type < action_type:
+                    # the type ordering puts the child first
+                    raise tsort.CyclicGraphError("graph contains cycles")
+
+        # the children of each action are visited in ascending order
+        edges.sort()
+        graph = tsort.create_graph(members, edges)
+        order.extend(tsort.tsort(graph))
+
+    return [actions[i] for i in order]
+
+def action_waves(actions):
+    """ Split sorted actions into waves of actions that can run concurrently.
+
+        Actions on related devices (see action_requirements) keep their
+        relative order and never share a wave, so each set of related
+        actions is worked through one action per wave. All actions of a
+        type are done before the first action of the next type starts.
+
+        Returns a list of lists of actions, each in the order of actions.
+    """
+    # group the actions into sets of related devices
+    owner = {}
+    def find(key):
+        while owner[key] != key:
+            owner[key] = owner[owner[key]]
+            key = owner[key]
+        return key
+
+    action_keys = []
+    for action in actions:
+        keys = _relation_keys(action.device)
+        action_keys.append(keys)
+        for key in keys:
+            owner.setdefault(key, key)
+
+        keys = list(keys)
+        for key in keys[1:]:
+            owner[find(key)] = find(keys[0])
+
+    waves = []
+    last_wave = {}      # group -> index of its last action's wave
+    barrier = 0         # first wave the current action type may use
+    action_type = None
+    for (action, keys) in zip(actions, action_keys):
+        if action.type != action_type:
+            action_type = action.type
+            barrier = len(waves)
+
+        group = find(next(iter(keys)))
+        idx = max(last_wave.get(group, -1) + 1, barrier)
+        if idx == len(waves):
+            waves.append([])
+
+        waves[idx].append(action)
+        last_wave[group] = idx
+
+    return waves
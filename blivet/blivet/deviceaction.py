@@ -31,6 +31,7 @@ from formats import getFormat
 from errors import *
 from parted import partitionFlag, PARTITION_LBA
 from flags import flags
+import partedpool
 
 from i18n import _
 
@@ -319,6 +320,7 @@ class ActionDestroyDevice(DeviceAction):
 
         # Make sure libparted does not keep cached info for this device
         # and returns it when we create a new device with the same name
+        partedpool.pool.release(self.device.path)
         if self.device.partedDevice:
             try:
                 self.device.partedDevice.removeFromCache()
@@ -0,0 +1,362 @@
+# deviceindex.py
+# Lookup tables for the devices in a DeviceTree.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" Hash-based lookup tables for DeviceTree.
+
+    A DeviceIndex maps the attributes DeviceTree looks devices up by (name,
+    path, uuid, format uuid, format label, sysfs path and id) to the devices
+    carrying them, so that the getDeviceBy* methods do not have to scan the
+    whole device list.
+
+    Devices and formats report changes to the attributes the tables are
+    built from via attribute_changed(), which updates every index the
+    device is a member of. Device paths that are not derived from the
+    device's name (see Device._volatilePath) are not indexed; lookups check
+    those devices directly.
+
+    An index also maps each device to the devices that have it as a parent.
+    Devices report changes to their parents, their number of children and
+    anything else their ancestry or leaf status depends on via
+    topology_changed(), which bumps a global generation number. Results
+    derived from the device graph, like a device's ancestors or a tree's
+    leaves, can be cached along with the generation they were computed in
+    and reused until it changes.
+"""
+
+import copy
+import threading
+import weakref
+
+# all live indexes, notified when an indexed attribute changes
+_indexes = weakref.WeakSet()
+
+# bumped whenever a device's place in the device graph may have changed
+_generation = 0
+_generation_lock = threading.Lock()
+
+def attribute_changed(obj):
+    """ Let all indexes know that an indexed attribute of obj has changed.
+
+        obj can be either a Device or a DeviceFormat instance.
+    """
+    for index in list(_indexes):
+        index.update(obj)
+
+def topology_changed(device=None):
+    """ Let all indexes know that device's parents or children changed. """
+    _bump()
+    if device is not None:
+        for index in list(_indexes):
+            index.reparent(device)
+
+def generation():
+    """ Return the current generation of the device graph. """
+    return _generation
+
+def _bump():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+def _notifying(name):
+    method = getattr(list, name)
+    def wrapper(self, *args):
+        result = method(self, *args)
+        topology_changed(self.owner)
+        return result
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+class ParentList(list):
+    """ A device's list of parents.
+
+        Changes to the list are reported via topology_changed(). Copies and
+        pickles of a ParentList are plain lists.
+    """
+    __slots__ = ["owner"]
+
+    def __init__(self, owner, parents=()):
+        list.__init__(self, parents)
+        self.owner = owner
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def copy(self):
+        """ Return a new ParentList of the same owner and parents. """
+        return ParentList(self.owner, self)
+
+for _name in ("append", "extend", "insert", "remove", "pop", "sort",
+              "reverse", "__setitem__", "__delitem__", "__setslice__",
+              "__delslice__", "__iadd__", "__imul__"):
+    setattr(ParentList, _name, _notifying(_name))
+
+def _format(device):
+    return getattr(device, "format", None)
+
+def _device_path(device):
+    if getattr(device, "_volatilePath", False):
+        return None
+
+    return device.path
+
+def _format_uuid(device):
+    return getattr(_format(device), "uuid", None)
+
+def _format_label(device):
+    return getattr(_format(device), "label", None)
+
+# table name -> function returning the device's key for that table
+_keyfuncs = {"name": lambda d: d.name,
+             "path": _device_path,
+             "uuid": lambda d: getattr(d, "uuid", None),
+             "formatUuid": _format_uuid,
+             "label": _format_label,
+             "sysfsPath": lambda d: getattr(d, "sysfsPath", None),
+             "id": lambda d: d.id}
+
+class _Entry(object):
+    """ A device's membership record in a DeviceIndex. """
+    __slots__ = ["device", "format", "seq", "hidden", "keys", "parents"]
+
+    def __init__(self, device, seq, hidden):
+        self.device = device
+        self.format = None
+        self.seq = seq
+        self.hidden = hidden
+        self.keys = {}
+        self.parents = ()
+
+class DeviceIndex(object):
+    """ Lookup tables mapping device attributes to devices.
+
+        Lookups return devices in the order DeviceTree would have found them
+        by scanning its device list: visible devices in the order they were
+        added, followed by hidden devices in the order they were hidden.
+    """
+    tables = _keyfuncs.keys()
+
+    def __init__(self):
+        self._tables = dict((t, {}) for t in self.tables)
+        self._entries = {}      # id(device) -> _Entry
+        self._formats = {}      # id(format) -> set of id(device)
+        self._volatile = set()  # ids of devices with unindexed paths
+        self._children = {}     # id(parent) -> list of child entries
+        self._seq = 0
+        _indexes.add(self)
+
+    def __deepcopy__(self, memo):
+        new = self.__class__()
+        memo[id(self)] = new
+        for entry in sorted(self._entries.values(), key=lambda e: e.seq):
+            device = copy.deepcopy(entry.device, memo)
+            new._add(device, entry.seq, entry.hidden)
+
+        new._seq = self._seq
+        return new
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, device):
+        """ True if device is in the index and not hidden. """
+        entry = self._entries.get(id(device))
+        return entry is not None and not entry.hidden
+
+    def add(self, device, hidden=False):
+        """ Add device to the index, after all devices already in it. """
+        if id(device) in self._entries:
+            raise ValueError("device is already indexed")
+
+        self._seq += 1
+        self._add(device, self._seq, hidden)
+
+    def remove(self, device):
+        """ Remove device from the index. """
+        entry = self._entries.pop(id(device), None)
+        if entry is None:
+            raise ValueError("device is not indexed")
+
+        self._unindex(entry)
+        self._unlink(entry)
+        self._volatile.discard(id(device))
+        _bump()
+
+    def hide(self, device):
+        """ Mark device as hidden, after all devices already hidden. """
+        self.remove(device)
+        self.add(device, hidden=True)
+
+    def unhide(self, device):
+        """ Mark device as visible again, after all other visible devices. """
+        self.remove(device)
+        self.add(device)
+
+    def clear(self):
+        for table in self._tables.values():
+            table.clear()
+
+        self._entries.clear()
+        self._formats.clear()
+        self._volatile.clear()
+        self._children.clear()
+        _bump()
+
+    def update(self, obj):
+        """ Rebuild the keys of obj, which is a device or a format.
+
+            If a device's name changes, all indexed devices on top of it are
+            updated as well since their names and paths can be derived from
+            it (eg: lvs and their vg).
+        """
+        entry = self._entries.get(id(obj))
+        if entry is not None:
+            old_name = entry.keys.get("name")
+            self._unindex(entry)
+            self._index(entry)
+            if entry.keys.get("name") != old_name:
+                for child in list(self._children.get(id(obj), [])):
+                    self.update(child.device)
+
+        for device_id in list(self._formats.get(id(obj), [])):
+            entry = self._entries[device_id]
+            self._unindex(entry)
+            self._index(entry)
+
+    def reparent(self, device):
+        """ Update the children tables after device's parents changed. """
+        entry = self._entries.get(id(device))
+        if entry is not None and \
+           entry.parents != tuple(id(p) for p in device.parents):
+            self._unlink(entry)
+            self._link(entry)
+
+    def children(self, device, hidden=False):
+        """ Return a list of the devices that have device as a parent. """
+        entries = self._children.get(id(device), [])
+        return self._ordered([e for e in entries if hidden or not e.hidden])
+
+    def descendants(self, devices):
+        """ Return a list of all visible devices on top of any of devices.
+
+            The devices themselves are only included if they are on top of
+            one of the others.
+        """
+        found = {}
+        pending = list(devices)
+        while pending:
+            for child in self._children.get(id(pending.pop()), []):
+                if child.hidden or id(child) in found:
+                    continue
+
+                found[id(child)] = child
+                pending.append(child.device)
+
+        return self._ordered(found.values())
+
+    def ordered(self, devices):
+        """ Return the indexed ones of devices in lookup order. """
+        entries = [self._entries.get(id(d)) for d in devices]
+        return self._ordered([e for e in entries if e is not None])
+
+    def lookup(self, table, key, hidden=False):
+        """ Return a list of devices whose attribute table equals key. """
+        return self.find([(table, key)], hidden=hidden)
+
+    def find(self, criteria, hidden=False):
+        """ Return a list of devices matching any of the criteria.
+
+            criteria is a list of (table, key) tuples. Devices whose paths
+            are not indexed are included in the result of any path lookup,
+            so callers have to check the paths of the devices they get.
+        """
+        found = {}
+        for (table, key) in criteria:
+            for entry in self._tables[table].get(key, []):
+                found[id(entry)] = entry
+
+            if table == "path":
+                for device_id in self._volatile:
+                    entry = self._entries[device_id]
+                    found[id(entry)] = entry
+
+        return self._ordered([e for e in found.values()
+                                if hidden or not e.hidden])
+
+    def _ordered(self, entries):
+        entries = sorted(entries, key=lambda e: (e.hidden, e.seq))
+        return [e.device for e in entries]
+
+    def _add(self, device, seq, hidden):
+        entry = _Entry(device, seq, hidden)
+        self._entries[id(device)] = entry
+        self._index(entry)
+        self._link(entry)
+        if getattr(device, "_volatilePath", False):
+            self._volatile.add(id(device))
+
+        _bump()
+
+    def _link(self, entry):
+        parents = getattr(entry.device, "parents", [])
+        entry.parents = tuple(id(p) for p in parents)
+        for parent_id in set(entry.parents):
+            self._children.setdefault(parent_id, []).append(entry)
+
+    def _unlink(self, entry):
+        for parent_id in set(entry.parents):
+            children = self._children[parent_id]
+            children.remove(entry)
+            if not children:
+                del self._children[parent_id]
+
+        entry.parents = ()
+
+    def _index(self, entry):
+        device = entry.device
+        for (table, keyfunc) in _keyfuncs.items():
+            key = keyfunc(device)
+            if key is None or key == "":
+                continue
+
+            entry.keys[table] = key
+            self._tables[table].setdefault(key, []).append(entry)
+
+        entry.format = _format(device)
+        if entry.format is not None:
+            self._formats.setdefault(id(entry.format), set()).add(id(device))
+
+    def _unindex(self, entry):
+        for (table, key) in entry.keys.items():
+            entries = self._tables[table][key]
+            entries.remove(entry)
+            if not entries:
+                del self._tables[table][key]
+
+        entry.keys = {}
+        if entry.format is not None:
+            devices = self._formats[id(entry.format)]
+            devices.discard(id(entry.device))
+            if not devices:
+                del self._formats[id(entry.format)]
+
+            entry.format = None
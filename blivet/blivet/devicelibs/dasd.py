@@ -20,6 +20,8 @@
 #
 
 import os
+import re
+import threading
 from blivet.errors import DasdFormatError
 from blivet.devices import deviceNameToDiskByPath
 from blivet import util
@@ -32,6 +34,12 @@ import gettext
 _ = lambda x: gettext.ldgettext("blivet", x)
 P_ = lambda x, y, z: gettext.ldngettext("blivet", x, y, z)
 
+# number of DASDs format_dasds formats at a time by default
+DASDFMT_THREADS = 4
+
+# what dasdfmt -P prints as it goes, eg: "cyl    97 of  3338 |   2%"
+_DASDFMT_PROGRESS = re.compile(r"cyl\s+(\d+)\s+of\s+(\d+)")
+
 def get_dasd_ports():
     """ Return comma delimited string of valid DASD ports. """
     ports = []
@@ -48,23 +56,191 @@ def get_dasd_ports():
 
     return ','.join(ports)
 
-def format_dasd(dasd):
+def format_dasd(dasd, progress=None):
     """ Run dasdfmt on a DASD. Aside from one type of device noted below, this
         function _does not_ check if a DASD needs to be formatted, but rather,
         assumes the list passed needs formatting.
 
         We don't need to show or update any progress bars, since disk actions
         will be taking place all in the progress hub, which is just one big
-        progress bar.
+        progress bar. Callers that do want to can pass progress, which is
+        called with the number of cylinders done and the total number of
+        cylinders as dasdfmt reports them.
     """
+    argv = ["/sbin/dasdfmt", "-y", "-d", "cdl", "-b", "4096"]
+    callback = None
+    if progress is not None:
+        argv.append("-P")
+
+        def callback(line):
+            match = _DASDFMT_PROGRESS.search(line)
+            if match:
+                progress(int(match.group(1)), int(match.group(2)))
+
     try:
-        rc = util.run_program(["/sbin/dasdfmt", "-y", "-d", "cdl", "-b", "4096", "/dev/" + dasd])
+        rc = util.run_program(argv + ["/dev/" + dasd],
+                              output_callback=callback)
     except Exception as err:
         raise DasdFormatError(err)
 
     if rc:
         raise DasdFormatError("dasdfmt failed: %s" % rc)
 
+def get_dasd_chpids(dasd):
+    """ Return the channel paths of a DASD as a string, or None if unknown.
+
+        DASDs with the same channel paths share the bandwidth of those paths.
+    """
+    subchannel = os.path.dirname(os.path.realpath("/sys/block/%s/device" %
+                                                  (dasd,)))
+    try:
+        with open(os.path.join(subchannel, "chpids"), "r") as f:
+            chpids = [c for c in f.read().split() if int(c, 16)]
+    except (IOError, ValueError):
+        return None
+
+    return " ".join(chpids) or None
+
+class DasdFormatter(object):
+    """ Run dasdfmt on several DASDs at a time.
+
+        At most threads DASDs are formatted at a time, and at most per_path
+        of them on the same channel paths if per_path is set. The progress
+        of the dasdfmt processes is combined into one percentage for the
+        whole set, which progress is called with from the formatting
+        threads whenever it changes. A DASD that fails to format does not
+        stop the others.
+    """
+    def __init__(self, threads=None, per_path=None, progress=None):
+        if threads is None:
+            threads = DASDFMT_THREADS
+
+        self.threads = max(1, threads)
+        self.per_path = per_path
+        self.progress = progress
+
+        self._cond = threading.Condition()
+        self._fractions = {}        # dasd -> part of it formatted so far
+        self._percent = None        # progress so far
+        self._reported = None       # progress last passed to the callback
+        self._reporting = False     # a thread is running the callback
+
+    def format(self, dasds):
+        """ Format dasds, returning a dict of DasdFormatError by DASD name
+            for the ones that failed.
+        """
+        dasds = list(dasds)
+        if not dasds:
+            return {}
+
+        self._fractions = dict((d, 0.0) for d in dasds)
+        self._percent = None
+        self._reported = None
+        self._report()
+
+        queue = [(d, get_dasd_chpids(d)) for d in dasds]
+        busy = {}                   # chpids -> DASDs being formatted on them
+        errors = {}
+
+        workers = [threading.Thread(target=self._work,
+                                    args=(queue, busy, errors))
+                        for i in range(min(self.threads, len(dasds)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return errors
+
+    def _next(self, queue, busy):
+        """ Take the first DASD whose channel paths are not busy. """
+        for (i, (dasd, chpids)) in enumerate(queue):
+            if not self.per_path or chpids is None or \
+               busy.get(chpids, 0) < self.per_path:
+                del queue[i]
+                return (dasd, chpids)
+
+        return (None, None)
+
+    def _work(self, queue, busy, errors):
+        while True:
+            with self._cond:
+                (dasd, chpids) = self._next(queue, busy)
+                while dasd is None and queue:
+                    self._cond.wait()
+                    (dasd, chpids) = self._next(queue, busy)
+
+                if dasd is None:
+                    return
+
+                busy[chpids] = busy.get(chpids, 0) + 1
+
+            log.info("formatting DASD %s" % dasd)
+            try:
+                format_dasd(dasd,
+                            progress=lambda done, total, dasd=dasd:
+                                        self._update(dasd, done, total))
+            except DasdFormatError as e:
+                log.error("failed to format DASD %s: %s" % (dasd, e))
+                errors[dasd] = e
+
+            with self._cond:
+                busy[chpids] -= 1
+                self._cond.notify_all()
+
+            # failed or not, it is done
+            self._update(dasd, 1, 1)
+
+    def _update(self, dasd, done, total):
+        if not total:
+            return
+
+        with self._cond:
+            self._fractions[dasd] = min(1.0, float(done) / total)
+
+        self._report()
+
+    def _report(self):
+        """ Pass the progress on if it changed.
+
+            The callback runs without the lock held, so a slow one does not
+            hold up the workers. One thread at a time runs it, and passes on
+            whatever the others worked out meanwhile, so the percentages
+            still arrive in order.
+        """
+        with self._cond:
+            self._percent = int(100 * sum(self._fractions.values()) /
+                                len(self._fractions))
+            if self._reporting:
+                return
+            self._reporting = True
+
+        try:
+            while True:
+                with self._cond:
+                    percent = self._percent
+                    if percent == self._reported:
+                        self._reporting = False
+                        return
+                    self._reported = percent
+
+                if self.progress is not None:
+                    self.progress(percent)
+        except:
+            with self._cond:
+                self._reporting = False
+            raise
+
+def format_dasds(dasds, threads=None, per_path=None, progress=None):
+    """ Run dasdfmt on several DASDs at a time, see DasdFormatter.
+
+        Returns a dict of DasdFormatError by DASD name for the DASDs that
+        could not be formatted.
+    """
+    formatter = DasdFormatter(threads=threads, per_path=per_path,
+                              progress=progress)
+    return formatter.format(dasds)
+
 def make_dasd_list(dasds, disks):
     """ Create a list of DASDs recognized by the system. """
     if not arch.isS390():
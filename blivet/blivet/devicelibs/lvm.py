@@ -195,11 +195,313 @@ def is_valid_thin_pool_chunk_size(size, discard=False):
     else:
         return (size % LVM_THINP_MIN_CHUNK_SIZE == 0)
 
-def lvm(args):
+def lvm(args, keep_cache=False):
+    """ Run an lvm command.
+
+        Unless keep_cache is True the command is assumed to change lvm's
+        metadata, so the report cache is dropped.
+    """
+    if not keep_cache:
+        lvm_cache_invalidate()
+
     ret = util.run_program(["lvm"] + args)
     if ret:
         raise LVMError("running lvm " + " ".join(args) + " failed")
 
+# Start report cache code
+#
+# pvinfo, vginfo, lvs, lvorigin and thinlvpoolname each run lvm, which scans
+# all devices every time. lvm_cache_load collects the same data for the
+# whole system with one pvs and one lvs run so that populating the device
+# tree does not run lvm once per pv, vg and snapshot. Anything run through
+# lvm() that changes metadata drops the cache again.
+#
+# Reports are asked for with a separator that can not appear in any value,
+# so values containing spaces survive, and are parsed once into the record
+# classes below. The records of a vg are also kept by the vg's uuid and
+# metadata sequence number. The next lvm_cache_load only runs lvs for the
+# vgs whose metadata changed since, which on systems with many lvs is most
+# of the cost of a load.
+_PV_FIELDS = ["pv_uuid", "pe_start", "vg_name", "vg_uuid", "vg_size",
+              "vg_free", "vg_extent_size", "vg_extent_count", "vg_free_count",
+              "pv_count"]
+_LV_FIELDS = ["lv_name", "lv_uuid", "lv_size", "lv_attr", "segtype"]
+_VG_FIELDS = ["vg_uuid", "vg_size", "vg_free", "vg_extent_size",
+              "vg_extent_count", "vg_free_count", "pv_count"]
+
+# lvs reports one row per segment as soon as a segment field is asked for
+_SEG_FIELDS = ["segtype", "seg_start", "seg_size", "devices"]
+_LV_REPORT_FIELDS = ["vg_uuid", "lv_name", "lv_uuid", "lv_size", "lv_attr",
+                     "origin", "pool_lv"] + _SEG_FIELDS
+
+# ASCII unit separator; lvm does not allow it in names or tags
+_SEPARATOR = "\x1f"
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _str(value):
+    """ Format a record's value the way lvm reports it with --unit=k. """
+    if value is None:
+        return ""
+    elif isinstance(value, float):
+        return "%.2f" % value
+    else:
+        return str(value)
+
+class PVRecord(object):
+    """ A pv as reported by pvs. Sizes are in KiB. """
+    __slots__ = ["name", "uuid", "pe_start", "vg_name", "vg_uuid"]
+
+    def __init__(self, row):
+        self.name = row.get("LVM2_PV_NAME", "")
+        self.uuid = row.get("LVM2_PV_UUID", "")
+        self.pe_start = _float(row.get("LVM2_PE_START"))
+        self.vg_name = row.get("LVM2_VG_NAME", "")
+        self.vg_uuid = row.get("LVM2_VG_UUID", "")
+
+class VGRecord(object):
+    """ A vg and its lvs. Sizes are in KiB.
+
+        lvs is the list of the vg's LVRecords in the order lvm reported
+        them, including hidden lvs.
+    """
+    __slots__ = ["name", "uuid", "seqno", "size", "free", "extent_size",
+                 "extent_count", "free_count", "pv_count", "lvs", "_lvNames"]
+
+    def __init__(self, row):
+        self.name = row.get("LVM2_VG_NAME", "")
+        self.uuid = row.get("LVM2_VG_UUID", "")
+        self.seqno = _int(row.get("LVM2_VG_SEQNO"))
+        self.size = _float(row.get("LVM2_VG_SIZE"))
+        self.free = _float(row.get("LVM2_VG_FREE"))
+        self.extent_size = _float(row.get("LVM2_VG_EXTENT_SIZE"))
+        self.extent_count = _int(row.get("LVM2_VG_EXTENT_COUNT"))
+        self.free_count = _int(row.get("LVM2_VG_FREE_COUNT"))
+        self.pv_count = _int(row.get("LVM2_PV_COUNT"))
+        self.lvs = []
+        self._lvNames = {}
+
+    def addLV(self, lv):
+        self.lvs.append(lv)
+        self._lvNames[lv.name] = lv
+
+    def getLV(self, lv_name):
+        """ Return the LVRecord named lv_name, or None. """
+        return self._lvNames.get(lv_name)
+
+class LVRecord(object):
+    """ An lv and its segments. Sizes are in KiB. """
+    __slots__ = ["name", "uuid", "size", "attr", "origin", "pool_lv",
+                 "segments"]
+
+    def __init__(self, row):
+        self.name = row.get("LVM2_LV_NAME", "")
+        self.uuid = row.get("LVM2_LV_UUID", "")
+        self.size = _float(row.get("LVM2_LV_SIZE"))
+        self.attr = row.get("LVM2_LV_ATTR", "")
+        self.origin = row.get("LVM2_ORIGIN", "")
+        self.pool_lv = row.get("LVM2_POOL_LV", "")
+        self.segments = []
+
+    @property
+    def segtype(self):
+        """ The type of the lv's first segment, which is what lvm reports
+            as the lv's type.
+        """
+        if not self.segments:
+            return ""
+
+        return self.segments[0].segtype
+
+class SegmentRecord(object):
+    """ One segment of an lv. Sizes are in KiB. """
+    __slots__ = ["segtype", "start", "size", "devices"]
+
+    def __init__(self, row):
+        self.segtype = row.get("LVM2_SEGTYPE", "")
+        self.start = _float(row.get("LVM2_SEG_START"))
+        self.size = _float(row.get("LVM2_SEG_SIZE"))
+        devices = row.get("LVM2_DEVICES", "")
+        self.devices = devices.split(",") if devices else []
+
+# None when not loaded, else {"pvs": {dev node: PVRecord},
+# "vgs": {vg name: VGRecord}}
+_report_cache = None
+
+# (vg uuid, seqno) -> VGRecord, from the last lvm_cache_load
+_vg_records = {}
+
+def _parse_report_rows(buf):
+    """ Return a list of dicts, one per row of a --nameprefixes report
+        using _SEPARATOR.
+    """
+    rows = []
+    for line in buf.splitlines():
+        line = line.lstrip()
+        if not line.startswith("LVM2_"):
+            # eg: warnings, which end up in the same output
+            continue
+
+        row = {}
+        for field in line.split(_SEPARATOR):
+            (name, equals, value) = field.partition("=")
+            if equals:
+                row[name] = value
+
+        rows.append(row)
+
+    return rows
+
+def _report(command, fields, all=False, names=None):
+    """ Run an lvm report command and return its rows.
+
+        Arguments:
+
+            command -- "pvs", "vgs" or "lvs"
+            fields -- the fields to report
+
+        Keyword Arguments:
+
+            all -- report hidden lvs too
+            names -- only report these pvs, vgs or lvs
+
+        Raises LVMError if lvm fails.
+    """
+    args = [command]
+    if all:
+        args.append("-a")
+
+    args.extend(["--unit=k", "--nosuffix", "--nameprefixes", "--unquoted",
+                 "--noheadings", "--separator", _SEPARATOR,
+                 "-o" + ",".join(fields)])
+    args.extend(_getConfigArgs(read_only_locking=True))
+    args.extend(names or [])
+
+    (rc, buf) = util.run_program_and_capture_output(["lvm"] + args)
+    if rc:
+        raise LVMError("running lvm %s failed" % command)
+
+    return _parse_report_rows(buf)
+
+def _lv_records(rows):
+    """ Return a dict of vg uuid to a list of LVRecords for lvs rows. """
+    lvs = {}
+    records = {}
+    for row in rows:
+        key = (row.get("LVM2_VG_UUID"), row.get("LVM2_LV_UUID"))
+        lv = records.get(key)
+        if lv is None:
+            lv = records[key] = LVRecord(row)
+            lvs.setdefault(key[0], []).append(lv)
+
+        lv.segments.append(SegmentRecord(row))
+
+    return lvs
+
+def _cache_key(path):
+    # lvm and blivet do not always agree on the name of a device node
+    return os.path.realpath(path)
+
+def lvm_cache_load():
+    """ Collect pv, vg and lv data for all of the system's lvm devices. """
+    global _report_cache, _vg_records
+    lvm_cache_invalidate()
+    cache = {"pvs": {}, "vgs": {}}
+    records = {}
+    stale = []
+    try:
+        pv_rows = _report("pvs", ["pv_name", "vg_seqno"] + _PV_FIELDS)
+        for row in pv_rows:
+            pv = PVRecord(row)
+            if not pv.name:
+                continue
+
+            cache["pvs"][_cache_key(pv.name)] = pv
+            if not pv.vg_name or pv.vg_name in cache["vgs"]:
+                continue
+
+            vg = VGRecord(row)
+            key = (vg.uuid, vg.seqno)
+            if key in _vg_records:
+                vg = _vg_records[key]
+            else:
+                stale.append(vg)
+
+            cache["vgs"][vg.name] = records[key] = vg
+
+        if stale:
+            # every vg changed on the first load, so don't name them all
+            names = None
+            if len(stale) < len(records):
+                names = [vg.name for vg in stale]
+
+            lvs = _lv_records(_report("lvs", _LV_REPORT_FIELDS, all=True,
+                                      names=names))
+            for vg in stale:
+                for lv in lvs.get(vg.uuid, []):
+                    vg.addLV(lv)
+    except (LVMError, OSError) as e:
+        log.info("failed to load the lvm report cache: %s" % e)
+        return
+
+    log.debug("lvm report cache: %d pvs, %d vgs, %d reused"
+              % (len(cache["pvs"]), len(cache["vgs"]),
+                 len(records) - len(stale)))
+    _report_cache = cache
+    _vg_records = records
+
+def lvm_cache_invalidate():
+    """ Drop the cached lvm report, if any.
+
+        The records of vgs whose metadata has not changed are still reused
+        by the next load.
+    """
+    global _report_cache
+    _report_cache = None
+
+def _cache_rejects(device):
+    """ Would the current lvm filter keep lvm from seeing device? """
+    for reject in config_args_data["filterRejects"]:
+        if re.search("/%s$" % reject, device):
+            return True
+
+    return False
+
+def _cached_pv(device):
+    if _report_cache is None or _cache_rejects(device):
+        return None
+
+    return _report_cache["pvs"].get(_cache_key(device))
+
+def _cached_vg(vg_name):
+    if _report_cache is None:
+        return None
+
+    return _report_cache["vgs"].get(vg_name)
+
+def _cached_lv(vg_name, lv_name):
+    """ Return the LVRecord for an lv, or None if it is not cached.
+
+        An lv of a cached vg that lvm does not know about is returned as
+        an empty LVRecord.
+    """
+    vg = _cached_vg(vg_name)
+    if vg is None:
+        return None
+
+    return vg.getLV(lv_name) or LVRecord({})
+# End report cache code
+
 def pvcreate(device):
     # we force dataalignment=1024k since we cannot get lvm to tell us what
     # the pe_start will be in advance
@@ -253,27 +555,31 @@ def pvinfo(device):
         pvs -o pv_name,pv_mda_count,vg_name,vg_uuid --config \
             'devices { scan = "/dev" filter = ["a/loop0/", "r/.*/"] }'
     """
-    args = ["pvs",
-            "--unit=k", "--nosuffix", "--nameprefixes", "--rows",
-            "--unquoted", "--noheadings",
-            "-opv_uuid,pe_start,vg_name,vg_uuid,vg_size,vg_free,vg_extent_size,vg_extent_count,vg_free_count,pv_count"] + \
-            _getConfigArgs(read_only_locking=True) + \
-            [device]
+    cached = _cached_pv(device)
+    if cached is not None:
+        vg = _cached_vg(cached.vg_name)
+        info = {"LVM2_PV_UUID": cached.uuid,
+                "LVM2_PE_START": _str(cached.pe_start),
+                "LVM2_VG_NAME": cached.vg_name,
+                "LVM2_VG_UUID": cached.vg_uuid}
+        for field in _VG_FIELDS[1:]:
+            value = getattr(vg, field.replace("vg_", ""), None)
+            info["LVM2_" + field.upper()] = _str(value)
+
+        return info
 
-    rc = util.capture_output(["lvm"] + args)
-    _vars = rc.split()
-    info = {}
-    for var in _vars:
-        (name, equals, value) = var.partition("=")
-        if not equals:
-            continue
+    try:
+        rows = _report("pvs", _PV_FIELDS, names=[device])
+    except LVMError as e:
+        log.debug("pvinfo failed for %s: %s" % (device, e))
+        return {}
 
+    info = {}
+    for (name, value) in (rows[0].items() if rows else []):
         if "," in value:
-            val = value.strip().split(",")
-        else:
-            val = value.strip()
+            value = value.split(",")
 
-        info[name] = val
+        info[name] = value
 
     return info
 
@@ -306,7 +612,7 @@ def vgactivate(vg_name):
             [vg_name]
 
     try:
-        lvm(args)
+        lvm(args, keep_cache=True)
     except LVMError as msg:
         raise LVMError("vgactivate failed for %s: %s" % (vg_name, msg))
 
@@ -316,7 +622,7 @@ def vgdeactivate(vg_name):
             [vg_name]
 
     try:
-        lvm(args)
+        lvm(args, keep_cache=True)
     except LVMError as msg:
         raise LVMError("vgdeactivate failed for %s: %s" % (vg_name, msg))
 
@@ -339,58 +645,86 @@ def vgreduce(vg_name, pv_list, rm=False):
     except LVMError as msg:
         raise LVMError("vgreduce failed for %s: %s" % (vg_name, msg))
 
-def vginfo(vg_name):
-    args = ["vgs", "--noheadings", "--nosuffix"] + \
-            ["--units", "m"] + \
-            ["-o", "uuid,size,free,extent_size,extent_count,free_count,pv_count"] + \
-            _getConfigArgs(read_only_locking=True) + \
-            [vg_name]
+def vgrecord(vg_name):
+    """ Return a VGRecord for the named vg, without its lvs.
 
-    buf = util.capture_output(["lvm"] + args)
-    info = buf.split()
-    if len(info) != 7:
+        Raises LVMError if lvm does not know the vg.
+    """
+    cached = _cached_vg(vg_name)
+    if cached is not None:
+        return cached
+
+    try:
+        rows = _report("vgs", ["vg_name"] + _VG_FIELDS, names=[vg_name])
+    except LVMError:
+        rows = []
+
+    if len(rows) != 1:
         raise LVMError(_("vginfo failed for %s" % vg_name))
 
-    return info
+    return VGRecord(rows[0])
 
-def lvs(vg_name):
-    args = ["lvs",
-            "-a", "--unit", "k", "--nosuffix", "--nameprefixes", "--rows",
-            "--unquoted", "--noheadings",
-            "-olv_name,lv_uuid,lv_size,lv_attr,segtype"] + \
-            _getConfigArgs(read_only_locking=True) + \
-            [vg_name]
+def vginfo(vg_name):
+    """ Return a list of the named vg's uuid, size, free space and extent
+        size in MB, its extent count, free extent count and pv count.
 
-    rc = util.capture_output(["lvm"] + args)
-    _vars = rc.split()
-    info = {}
-    for var in _vars:
-        (name, equals, value) = var.partition("=")
-        if not equals:
-            continue
+        New code should use vgrecord.
+    """
+    vg = vgrecord(vg_name)
 
-        val = value.strip()
+    def _mb(kb):
+        return _str(kb / 1024 if kb is not None else None)
 
-        if name not in info:
-            info[name] = []
+    return [vg.uuid, _mb(vg.size), _mb(vg.free), _mb(vg.extent_size),
+            _str(vg.extent_count), _str(vg.free_count), _str(vg.pv_count)]
 
-        info[name].append(val)
+def lvs(vg_name):
+    """ Return a dict of lvm field names to a list of values, one for each
+        of the named vg's lvs, hidden lvs included.
+    """
+    cached = _cached_vg(vg_name)
+    if cached is not None:
+        records = cached.lvs
+    else:
+        try:
+            rows = _report("lvs", _LV_REPORT_FIELDS, all=True,
+                           names=[vg_name])
+        except LVMError as e:
+            log.debug("lvs failed for %s: %s" % (vg_name, e))
+            rows = []
 
-    return info
+        records = sum(_lv_records(rows).values(), [])
 
-def lvorigin(vg_name, lv_name):
-    args = ["lvs", "--noheadings", "-o", "origin"] + \
-            _getConfigArgs(read_only_locking=True) + \
-            ["%s/%s" % (vg_name, lv_name)]
+    info = {}
+    for lv in records:
+        for field in _LV_FIELDS:
+            value = getattr(lv, field.replace("lv_", ""))
+            info.setdefault("LVM2_" + field.upper(), []).append(_str(value))
+
+    return info
 
-    buf = util.capture_output(["lvm"] + args)
+def _lvrecord(vg_name, lv_name):
+    """ Return the LVRecord for an lv, empty if lvm does not know it. """
+    cached = _cached_lv(vg_name, lv_name)
+    if cached is not None:
+        return cached
 
     try:
-        origin = buf.splitlines()[0].strip()
-    except IndexError:
-        origin = ''
+        rows = _report("lvs", _LV_REPORT_FIELDS, all=True,
+                       names=["%s/%s" % (vg_name, lv_name)])
+    except LVMError as e:
+        log.debug("lvs failed for %s/%s: %s" % (vg_name, lv_name, e))
+        rows = []
 
-    return origin
+    for records in _lv_records(rows).values():
+        for lv in records:
+            if lv.name == lv_name:
+                return lv
+
+    return LVRecord({})
+
+def lvorigin(vg_name, lv_name):
+    return _lvrecord(vg_name, lv_name).origin
 
 def lvcreate(vg_name, lv_name, size, pvs=[]):
     args = ["lvcreate"] + \
@@ -433,7 +767,7 @@ def lvactivate(vg_name, lv_name):
             ["%s/%s" % (vg_name, lv_name)]
 
     try:
-        lvm(args)
+        lvm(args, keep_cache=True)
     except LVMError as msg:
         raise LVMError("lvactivate failed for %s: %s" % (lv_name, msg))
 
@@ -443,7 +777,7 @@ def lvdeactivate(vg_name, lv_name):
             ["%s/%s" % (vg_name, lv_name)]
 
     try:
-        lvm(args)
+        lvm(args, keep_cache=True)
     except LVMError as msg:
         raise LVMError("lvdeactivate failed for %s: %s" % (lv_name, msg))
 
@@ -477,15 +811,4 @@ def thinlvcreate(vg_name, pool_name, lv_name, size):
         raise LVMError("lvcreate failed for %s/%s: %s" % (vg_name, lv_name, msg))
 
 def thinlvpoolname(vg_name, lv_name):
-    args = ["lvs", "--noheadings", "-o", "pool_lv"] + \
-            _getConfigArgs(read_only_locking=True) + \
-            ["%s/%s" % (vg_name, lv_name)]
-
-    buf = util.capture_output(["lvm"] + args)
-
-    try:
-        pool = buf.splitlines()[0].strip()
-    except IndexError:
-        pool = ''
-
-    return pool
+    return _lvrecord(vg_name, lv_name).pool_lv
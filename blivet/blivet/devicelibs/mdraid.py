@@ -158,6 +158,8 @@ def get_member_space(size, disks, level=None):
     return space * disks
 
 def mdadm(args):
+    # the superblocks may be about to change
+    mdexamine_cache_invalidate()
     ret = util.run_program(["mdadm"] + args)
     if ret:
         raise MDRaidError("running mdadm " + " ".join(args) + " failed")
@@ -221,11 +223,14 @@ def mddeactivate(device):
     except MDRaidError as msg:
         raise MDRaidError("mddeactivate failed for %s: %s" % (device, msg))
 
-def mdexamine(device):
-    _vars = util.capture_output(["mdadm",
-                                 "--examine", "--export", device]).split()
-    _bvars = util.capture_output(["mdadm",
-                                 "--examine", "--brief", device]).split()
+def _examine_argvs(device):
+    return [["mdadm", "--examine", "--export", device],
+            ["mdadm", "--examine", "--brief", device]]
+
+def _parse_examine(export, brief):
+    """ Return a dict of the member info in mdadm --examine output. """
+    _vars = export.split()
+    _bvars = brief.split()
 
     info = {}
     if len(_bvars) > 1 and _bvars[1].startswith("/dev/md"):
@@ -250,6 +255,77 @@ def mdexamine(device):
 
     return info
 
+# Start examine cache code
+#
+# Every md member found while populating the device tree used to be examined
+# on its own, with two mdadm runs, one member after another. With many
+# members that is most of the time populate takes. mdexamine_cache_load
+# examines a batch of members concurrently and mdexamine hands out the
+# results until the cache is dropped again.
+
+# None when not loaded, else {dev node: info}
+_examine_cache = None
+
+def _examine_key(device):
+    # blivet and udev do not always agree on the name of a device node
+    return os.path.realpath(device)
+
+def mdexamine_cache_load(devices, threads=None):
+    """ Examine devices concurrently and keep the results.
+
+        Arguments:
+
+            devices -- the device nodes of the member candidates
+
+        Keyword Arguments:
+
+            threads -- how many mdadm runs to have going at once, see
+                       util.run_programs
+
+        The results are added to those of earlier calls until the cache
+        is invalidated. Devices already in the cache are not examined
+        again.
+    """
+    global _examine_cache
+    cache = _examine_cache
+    if cache is None:
+        cache = {}
+
+    devices = [d for d in set(devices) if _examine_key(d) not in cache]
+    argvs = []
+    for device in devices:
+        argvs.extend(_examine_argvs(device))
+
+    try:
+        results = util.run_programs(argvs, threads=threads)
+    except OSError as e:
+        log.info("failed to examine md members: %s" % e)
+        return
+
+    for (i, device) in enumerate(devices):
+        export = results[2 * i][1]
+        brief = results[2 * i + 1][1]
+        cache[_examine_key(device)] = _parse_examine(export, brief)
+
+    log.debug("md examine cache: %d members" % len(cache))
+    _examine_cache = cache
+
+def mdexamine_cache_invalidate():
+    """ Drop the cached mdadm --examine results, if any. """
+    global _examine_cache
+    _examine_cache = None
+
+def mdexamine(device):
+    if _examine_cache is not None:
+        cached = _examine_cache.get(_examine_key(device))
+        if cached is not None:
+            return dict(cached)
+
+    (export, brief) = [util.capture_output(argv)
+                            for argv in _examine_argvs(device)]
+    return _parse_examine(export, brief)
+# End examine cache code
+
 def md_node_from_name(name):
     named_path = "/dev/md/" + name
     try:
@@ -0,0 +1,247 @@
+# superblock.py
+# Reading filesystem and LUKS superblocks without running any tools.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" In-process superblock parsers.
+
+    Finding out the size, label or UUID of an existing filesystem usually
+    means running dumpe2fs, xfs_db, blkid or a label tool once per device.
+    The functions in here read the few KiB at the start of a device that
+    hold the superblock and decode it directly for ext2/3/4, xfs, btrfs,
+    swap, vfat and LUKS.
+
+    Anything that does not look exactly like a known superblock is
+    reported as None so the caller can fall back to the external tools.
+"""
+
+import os
+import struct
+from collections import namedtuple
+
+import logging
+log = logging.getLogger("blivet")
+
+# Everything the parsers know about a superblock. Fields that a format does
+# not record are None. Sizes are in blocks of block_size bytes.
+# reserved_blocks are the free blocks only root may use.
+SuperBlock = namedtuple("SuperBlock", ["type", "block_size", "block_count",
+                                       "free_blocks", "reserved_blocks",
+                                       "uuid", "label", "clean", "errors"])
+
+# swap signatures sit at the end of the first page, whatever its size is
+_SWAP_PAGE_SIZES = (4096, 8192, 16384, 65536)
+
+_BTRFS_OFFSET = 0x10000
+
+# reading this much covers every superblock the parsers know about
+PROBE_SIZE = _BTRFS_OFFSET + 4096
+
+def _uuid(raw):
+    """ Format 16 raw bytes the way blkid shows UUIDs. """
+    h = raw.encode("hex")
+    return "%s-%s-%s-%s-%s" % (h[:8], h[8:12], h[12:16], h[16:20], h[20:])
+
+def _string(raw):
+    """ Return a NUL padded on-disk string up to its first NUL. """
+    return raw.split("\0", 1)[0]
+
+def _ext(buf):
+    sb = buf[1024:2048]
+    if len(sb) < 1024 or struct.unpack_from("<H", sb, 0x38)[0] != 0xEF53:
+        return None
+
+    (blocks_lo, reserved_lo, free_lo, log_block_size) = \
+                                    struct.unpack_from("<III8xI", sb, 4)
+    (state,) = struct.unpack_from("<H", sb, 0x3A)
+    (compat, incompat, ro_compat) = struct.unpack_from("<III", sb, 0x5C)
+    if log_block_size > 6:
+        return None
+
+    blocks = blocks_lo
+    reserved = reserved_lo
+    free = free_lo
+    if incompat & 0x80:         # 64bit
+        (blocks_hi, reserved_hi, free_hi) = struct.unpack_from("<III", sb,
+                                                               0x150)
+        blocks |= blocks_hi << 32
+        reserved |= reserved_hi << 32
+        free |= free_hi << 32
+
+    if incompat & 0x8:          # an external journal, not a filesystem
+        return None
+
+    # tell the three apart by the features ext2 and ext3 lack, like blkid
+    if compat & 0x4:            # has_journal
+        fstype = "ext4" if incompat & ~0x16 or ro_compat & ~0x7 else "ext3"
+    else:
+        fstype = "ext4" if incompat & ~0x12 or ro_compat & ~0x7 else "ext2"
+
+    return SuperBlock(fstype, 1024 << log_block_size, blocks, free, reserved,
+                      _uuid(sb[0x68:0x78]), _string(sb[0x78:0x88]),
+                      bool(state & 0x1), bool(state & 0x2))
+
+def _xfs(buf):
+    sb = buf[:512]
+    if len(sb) < 512 or sb[:4] != "XFSB":
+        return None
+
+    (block_size, dblocks) = struct.unpack_from(">IQ", sb, 4)
+    (fdblocks,) = struct.unpack_from(">Q", sb, 144)
+    (inprogress,) = struct.unpack_from(">B", sb, 126)
+    if not block_size or inprogress:
+        return None
+
+    return SuperBlock("xfs", block_size, dblocks, fdblocks, None,
+                      _uuid(sb[32:48]), _string(sb[108:120]), None, None)
+
+def _btrfs(buf):
+    sb = buf[_BTRFS_OFFSET:_BTRFS_OFFSET + 4096]
+    if len(sb) < 4096 or sb[0x40:0x48] != "_BHRfS_M":
+        return None
+
+    (total, used) = struct.unpack_from("<QQ", sb, 0x70)
+    (sector_size,) = struct.unpack_from("<I", sb, 0x90)
+    if not sector_size:
+        return None
+
+    return SuperBlock("btrfs", sector_size, total // sector_size,
+                      (total - used) // sector_size, None, _uuid(sb[0x20:0x30]),
+                      _string(sb[0x12B:0x22B]), None, None)
+
+def _swap(buf):
+    for page_size in _SWAP_PAGE_SIZES:
+        if buf[page_size - 10:page_size] == "SWAPSPACE2":
+            break
+    else:
+        return None
+
+    # the header is in the byte order of the system that created it
+    for order in "<>":
+        (version, last_page) = struct.unpack_from(order + "II", buf, 1024)
+        if version == 1:
+            break
+    else:
+        return None
+
+    return SuperBlock("swap", page_size, last_page + 1, None, None,
+                      _uuid(buf[1036:1052]), _string(buf[1052:1068]),
+                      None, None)
+
+def _vfat(buf):
+    sb = buf[:512]
+    if len(sb) < 512 or sb[510:512] != "\x55\xaa":
+        return None
+
+    if sb[82:87] == "FAT32":
+        (volume_id,) = struct.unpack_from("<I", sb, 67)
+        label = sb[71:82]
+    elif sb[54:59] in ("FAT12", "FAT16"):
+        (volume_id,) = struct.unpack_from("<I", sb, 39)
+        label = sb[43:54]
+    else:
+        return None
+
+    (sector_size, cluster_sectors) = struct.unpack_from("<HB", sb, 11)
+    (sectors16,) = struct.unpack_from("<H", sb, 19)
+    (sectors32,) = struct.unpack_from("<I", sb, 32)
+    if sector_size not in (512, 1024, 2048, 4096) or not cluster_sectors:
+        return None
+
+    return SuperBlock("vfat", sector_size, sectors16 or sectors32, None, None,
+                      "%04X-%04X" % (volume_id >> 16, volume_id & 0xffff),
+                      label.rstrip(" \0"), None, None)
+
+def _luks(buf):
+    if buf[:6] != "LUKS\xba\xbe":
+        return None
+
+    (version,) = struct.unpack_from(">H", buf, 6)
+    if version != 1:
+        return None
+
+    (payload_offset,) = struct.unpack_from(">I", buf, 104)
+    return SuperBlock("luks", 512, payload_offset, None, None,
+                      _string(buf[168:208]), None, None, None)
+
+# parsers by format type, and how many bytes each needs from the start
+_parsers = {"ext2": (_ext, 2048),
+            "ext3": (_ext, 2048),
+            "ext4": (_ext, 2048),
+            "xfs": (_xfs, 512),
+            "btrfs": (_btrfs, PROBE_SIZE),
+            "swap": (_swap, max(_SWAP_PAGE_SIZES)),
+            "vfat": (_vfat, 512),
+            "luks": (_luks, 512)}
+
+# the order parse tries them in when it is not told the type
+_probe_order = (_luks, _xfs, _ext, _btrfs, _swap, _vfat)
+
+def supported(fstype):
+    """ Return True if there is a parser for fstype. """
+    return fstype in _parsers
+
+def _read_start(path, size):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # short reads are fine, the parsers check the lengths they need
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+def parse(buf, fstype=None):
+    """ Return a SuperBlock decoded from the start of a device, or None.
+
+        If fstype is None, every known format is tried.
+    """
+    if fstype is None:
+        parsers = _probe_order
+    elif fstype in _parsers:
+        parsers = [_parsers[fstype][0]]
+    else:
+        return None
+
+    for parser in parsers:
+        try:
+            superblock = parser(buf)
+        except struct.error:
+            superblock = None
+
+        if superblock is not None:
+            return superblock
+
+    return None
+
+def read_superblock(path, fstype=None):
+    """ Return the SuperBlock of the device at path, or None.
+
+        The device is read with a single read of just the bytes the format
+        needs, or PROBE_SIZE bytes if fstype is None. None is returned if
+        the device can not be read or holds no superblock of that type.
+    """
+    if fstype is not None and fstype not in _parsers:
+        return None
+
+    size = _parsers[fstype][1] if fstype else PROBE_SIZE
+    try:
+        buf = _read_start(path, size)
+    except (IOError, OSError) as e:
+        log.debug("failed to read superblock from %s: %s" % (path, e))
+        return None
+
+    return parse(buf, fstype)
@@ -118,6 +118,8 @@ from storage_log import log_method_call
 from udev import *
 from formats import get_device_format_class, getFormat, DeviceFormat
 from size import Size
+import deviceindex
+import partedpool
 
 from i18n import P_
 
@@ -209,6 +211,15 @@ class Device(object):
     _packages = []
     _services = []
 
+    # attributes DeviceTree's lookup tables are built from
+    _indexedAttrs = frozenset(["_name", "uuid", "sysfsPath", "_format"])
+
+    # attributes the device's ancestry and leaf status depend on
+    _topologyAttrs = frozenset(["parents", "kids"])
+
+    # True if the path is not derived from the device's name
+    _volatilePath = False
+
     def __init__(self, name, parents=None):
         """ Create a Device instance.
 
@@ -256,6 +267,16 @@ class Device(object):
 
         return new
 
+    def __setattr__(self, attr, value):
+        if attr == "parents":
+            value = deviceindex.ParentList(self, value)
+
+        object.__setattr__(self, attr, value)
+        if attr in self._indexedAttrs:
+            deviceindex.attribute_changed(self)
+        elif attr in self._topologyAttrs:
+            deviceindex.topology_changed(self)
+
     def __repr__(self):
         s = ("%(type)s instance (%(id)s) --\n"
              "  name = %(name)s  status = %(status)s"
@@ -315,15 +336,39 @@ class Device(object):
     def dependsOn(self, dep):
         """ Return True if this device depends on dep. """
         # XXX does a device depend on itself?
-        if dep in self.parents:
+        ancestors = self._ancestorSet()
+        if dep is not self and dep in ancestors:
             return True
 
-        for parent in self.parents:
-            if parent.dependsOn(dep):
-                return True
+        # logical partitions depend on their extended partition, and so does
+        # everything on top of them
+        if isinstance(dep, PartitionDevice) and dep.isExtended:
+            for ancestor in ancestors:
+                if ancestor is not self and \
+                   isinstance(ancestor, PartitionDevice) and \
+                   ancestor.isLogical and ancestor.disk == dep.disk:
+                    return True
 
         return False
 
+    def _ancestorSet(self):
+        """ Return a frozenset of this device and all devices below it.
+
+            The set is computed once per generation of the device graph.
+        """
+        generation = deviceindex.generation()
+        cached = self.__dict__.get("_ancestorCache")
+        if cached is None or cached[0] != generation:
+            ancestors = set([self])
+            for parent in self.parents:
+                if parent not in ancestors:
+                    ancestors.update(parent._ancestorSet())
+
+            cached = (generation, frozenset(ancestors))
+            object.__setattr__(self, "_ancestorCache", cached)
+
+        return cached[1]
+
     def dracutSetupArgs(self):
         return set()
 
@@ -359,10 +404,7 @@ class Device(object):
 
     @property
     def ancestors(self):
-        l = set([self])
-        for p in [d for d in self.parents if d not in l]:
-            l.update(set(p.ancestors))
-        return list(l)
+        return list(self._ancestorSet())
 
     @property
     def packages(self):
@@ -588,7 +630,7 @@ class StorageDevice(Device):
             # do not always have any media present, so parted won't be able
             # to find a device.
             try:
-                self._partedDevice = parted.Device(path=self.path)
+                self._partedDevice = partedpool.pool.getDevice(self.path)
             except (_ped.IOException, _ped.DeviceException):
                 pass
 
@@ -1092,6 +1134,9 @@ class PartitionDevice(StorageDevice):
     _resizable = True
     defaultSize = 500
 
+    # whether it is an extended partition depends on the parted partition
+    _topologyAttrs = Device._topologyAttrs | frozenset(["_partedPartition"])
+
     def __init__(self, name, format=None,
                  size=None, grow=False, maxsize=None, start=None, end=None,
                  major=None, minor=None, bootable=None,
@@ -2717,15 +2762,15 @@ class LVMLogicalVolumeDevice(DMDevice):
         super(LVMLogicalVolumeDevice, self)._preCreate()
 
         try:
-            vg_info = lvm.vginfo(self.vg.name)
+            vg_info = lvm.vgrecord(self.vg.name)
         except LVMError as lvmerr:
             msg = "Failed to get free space for the %s VG: %s" % (self.vg.name, lvmerr)
             log.error(msg)
             # nothing more can be done, we don't know the VG's free space
             return
 
-        extent_size = Size(spec=vg_info[3] + "MiB")
-        extents_free = int(vg_info[5])
+        extent_size = Size(spec="%.2f KiB" % vg_info.extent_size)
+        extents_free = vg_info.free_count
         can_use = extent_size * extents_free
 
         # self.size is in MiB
@@ -3852,6 +3897,7 @@ class FileDevice(StorageDevice):
     """
     _type = "file"
     _devDir = ""
+    _volatilePath = True    # depends on whether the parent fs is mounted
 
     def __init__(self, path, format=None, size=None,
                  exists=False, parents=None):
@@ -21,12 +21,14 @@
 #
 
 import os
+import sys
 import stat
 import block
 import re
 import shutil
 import pprint
 import copy
+from multiprocessing.pool import ThreadPool
 
 from errors import *
 from devices import *
@@ -41,10 +43,15 @@ import devicelibs.loop
 import devicelibs.edd
 from udev import *
 import util
+import sysfs
+from partedpool import pool as partedPool
 from platform import platform
-import tsort
+import actionsort
+from deviceindex import DeviceIndex
+import deviceindex
+from snapshot import Snapshot
 from flags import flags
-from storage_log import log_method_call, log_method_return
+from storage_log import log_method_call, log_method_return, timed_method
 import parted
 import _ped
 
@@ -52,6 +59,13 @@ import logging
 log = logging.getLogger("blivet")
 
 
+def _executeAction(action):
+    """ Execute action, returning sys.exc_info() if it fails. """
+    try:
+        action.execute()
+    except Exception:
+        return sys.exc_info()
+
 class DeviceTree(object):
     """ A quasi-tree that represents the devices in the system.
 
@@ -88,6 +102,17 @@ class DeviceTree(object):
 
         self._hidden = []
 
+        # lookup tables for the devices in _devices and _hidden
+        self._index = DeviceIndex()
+
+        # (graph generation, leaf candidates, whether any may have become
+        # non-leaves since), see leaves
+        self._leaves = None
+
+        # udev data of the active md arrays, collected once for each batch
+        # of devices examined by _examineMDMembers
+        self._udevMDArrays = None
+
         # indicates whether or not the tree has been fully populated
         self.populated = False
 
@@ -136,52 +161,16 @@ class DeviceTree(object):
 
     def pruneActions(self):
         """ Remove redundant/obsolete actions from the action list. """
-        for action in reversed(self._actions[:]):
-            if action not in self._actions:
-                log.debug("action %d already pruned" % action.id)
-                continue
-
-            for obsolete in self._actions[:]:
-                if action.obsoletes(obsolete):
-                    log.info("removing obsolete action %d (%d)"
-                             % (obsolete.id, action.id))
-                    self._actions.remove(obsolete)
+        self._actions = actionsort.prune_actions(self._actions)
 
     def sortActions(self):
         """ Sort actions based on dependencies. """
         if not self._actions:
             return
 
-        edges = []
-
-        # collect all ordering requirements for the actions
-        for action in self._actions:
-            action_idx = self._actions.index(action)
-            children = []
-            for _action in self._actions:
-                if _action == action:
-                    continue
-
-                # create edges based on both action type and dependencies.
-                if action.type > _action.type or _action.requires(action):
-                    children.append(_action)
-
-            for child in children:
-                child_idx = self._actions.index(child)
-                edges.append((action_idx, child_idx))
-
-        # create a graph reflecting the ordering information we have
-        graph = tsort.create_graph(range(len(self._actions)), edges)
-
-        # perform a topological sort based on the graph's contents
-        order = tsort.tsort(graph)
-
-        # now replace self._actions with a sorted version of the same list
-        actions = []
-        for idx in order:
-            actions.append(self._actions[idx])
-        self._actions = actions
+        self._actions = actionsort.sort_actions(self._actions)
 
+    @timed_method
     def processActions(self, dryRun=None):
         """ Execute all registered actions. """
         log.info("resetting parted disks...")
@@ -227,6 +216,9 @@ class DeviceTree(object):
         for action in self._actions:
             log.debug("action: %s" % action)
 
+        if not dryRun and flags.action_threads > 1:
+            self._executeActionWaves(flags.action_threads)
+
         for action in self._actions[:]:
             log.info("executing action: %s" % action)
             if not dryRun:
@@ -239,12 +231,7 @@ class DeviceTree(object):
                     action.execute()
 
                 udev_settle()
-                for device in self._devices:
-                    # make sure we catch any renumbering parted does
-                    if device.exists and isinstance(device, PartitionDevice):
-                        device.updateName()
-                        device.format.device = device.path
-
+                self._updatePartitionNames()
                 self._completed_actions.append(self._actions.pop(0))
 
         # removal of partitions makes use of originalFormat, so it has to stay
@@ -259,22 +246,73 @@ class DeviceTree(object):
             pdisk = partition.disk.format.partedDisk
             partition.partedPartition = pdisk.getPartitionByPath(partition.path)
 
+    def _updatePartitionNames(self):
+        for device in self._devices:
+            # make sure we catch any renumbering parted does
+            if device.exists and isinstance(device, PartitionDevice):
+                device.updateName()
+                device.format.device = device.path
+
+    def _executeActionWaves(self, threads):
+        """ Execute the actions, running actions on unrelated devices
+            concurrently.
+
+            The actions are executed in waves (see actionsort.action_waves),
+            waiting for udev once after each wave. If an action fails, the
+            rest of its wave is still waited for before the error is raised.
+        """
+        pool = ThreadPool(threads)
+        try:
+            for wave in actionsort.action_waves(self._actions):
+                for action in wave:
+                    log.info("executing action: %s" % action)
+
+                results = pool.map(_executeAction, wave, chunksize=1)
+                retry = [a for (a, exc_info) in zip(wave, results)
+                            if exc_info and
+                               issubclass(exc_info[0], DiskLabelCommitError)]
+                if retry:
+                    # it's likely that a previous format destroy action
+                    # triggered setup of an lvm or md device.
+                    self.teardownAll()
+                    for action in retry:
+                        results[wave.index(action)] = _executeAction(action)
+
+                udev_settle()
+                self._updatePartitionNames()
+
+                failed = None
+                for (action, exc_info) in zip(wave, results):
+                    if exc_info:
+                        failed = failed or exc_info
+                        continue
+
+                    self._actions.remove(action)
+                    self._completed_actions.append(action)
+
+                if failed:
+                    raise failed[0], failed[1], failed[2]
+        finally:
+            pool.close()
+            pool.join()
+
     def _addDevice(self, newdev):
         """ Add a device to the tree.
 
             Raise ValueError if the device's identifier is already
             in the list.
         """
-        if newdev.uuid and newdev.uuid in [d.uuid for d in self._devices] and \
+        if newdev.uuid and self._index.lookup("uuid", newdev.uuid) and \
            not isinstance(newdev, NoDevice):
             raise ValueError("device is already in tree")
 
         # make sure this device's parent devices are in the tree already
         for parent in newdev.parents:
-            if parent not in self._devices:
+            if parent not in self._index:
                 raise DeviceTreeError("parent device not in tree")
 
         self._devices.append(newdev)
+        self._index.add(newdev)
 
         # don't include "req%d" partition names
         if ((newdev.type != "partition" or
@@ -291,7 +329,7 @@ class DeviceTree(object):
 
             Only leaves may be removed.
         """
-        if dev not in self._devices:
+        if dev not in self._index:
             raise ValueError("Device '%s' not in tree" % dev.name)
 
         if not dev.isleaf and not force:
@@ -325,6 +363,7 @@ class DeviceTree(object):
                 dev.volume._removeSubVolume(dev.name)
 
         self._devices.remove(dev)
+        self._index.remove(dev)
         if dev.name in self.names and getattr(dev, "complete", True):
             self.names.remove(dev.name)
         log.info("removed %s %s (id %d) from device tree" % (dev.type,
@@ -343,7 +382,9 @@ class DeviceTree(object):
             for leaf in leaves:
                 self._removeDevice(leaf, moddisk=False)
                 devs_to_remove.remove(leaf)
-            if len(devs_to_remove) == 1 and devs_to_remove[0].isExtended:
+            if len(devs_to_remove) == 1 and \
+               isinstance(devs_to_remove[0], PartitionDevice) and \
+               devs_to_remove[0].isExtended:
                 self._removeDevice(devs_to_remove[0], force=True, moddisk=False)
                 break
 
@@ -392,6 +433,37 @@ class DeviceTree(object):
         self._actions.remove(action)
         log.info("canceled action %s", action)
 
+    def snapshot(self, objects=None):
+        """ Return a Snapshot of the tree for restore to go back to.
+
+            Keyword Arguments:
+
+                objects -- other objects whose attributes to save with it
+
+            Unlike a deep copy of the tree, a snapshot only saves the
+            attributes of the tree, its devices, their formats and the
+            actions, so taking one is cheap even for large trees.
+        """
+        objects = [self] + self._devices + self._hidden + self._actions + \
+                  list(objects or [])
+        return Snapshot(objects)
+
+    def restore(self, snapshot):
+        """ Return the tree to the state it was in when snapshot was taken.
+
+            Devices and actions added since then are dropped, and the ones
+            removed or changed since then get their old attributes back.
+        """
+        snapshot.restore()
+
+        # the attributes were put back behind the index's back
+        self._index.clear()
+        for device in self._devices:
+            self._index.add(device)
+
+        for device in self._hidden:
+            self._index.add(device, hidden=True)
+
     def findActions(self, device=None, type=None, object=None, path=None,
                     devid=None):
         """ Find all actions that match all specified parameters.
@@ -438,8 +510,6 @@ class DeviceTree(object):
 
             The list includes both direct and indirect dependents.
         """
-        dependents = []
-
         # special handling for extended partitions since the logical
         # partitions and their deps effectively depend on the extended
         logicals = []
@@ -450,18 +520,15 @@ class DeviceTree(object):
                 if part.partType and part.isLogical and part.disk == dep.disk:
                     logicals.append(part)
 
-        incomplete = [d for d in self._devices
-                            if not getattr(d, "complete", True)]
-        for device in self.devices + incomplete:
-            if device.dependsOn(dep):
-                dependents.append(device)
-            else:
-                for logical in logicals:
-                    if device.dependsOn(logical):
-                        dependents.append(device)
-                        break
+        dependents = self._index.descendants([dep] + logicals)
+        if logicals:
+            dependents = self._index.ordered(set(dependents + logicals))
 
-        return dependents
+        # incomplete devices go last
+        complete = [d for d in dependents if getattr(d, "complete", True)]
+        incomplete = [d for d in dependents
+                            if not getattr(d, "complete", True)]
+        return complete + incomplete
 
     def isIgnored(self, info):
         """ Return True if info is a device we should ignore.
@@ -528,7 +595,7 @@ class DeviceTree(object):
 
         if self.udevDeviceIsDisk(info):
             # Ignore any readonly disks
-            if util.get_sysfs_attr(info["sysfs_path"], 'ro') == '1':
+            if sysfs.get_attr(info["sysfs_path"], 'ro') == '1':
                 log.debug("Ignoring read only device %s" % name)
                 # FIXME: We have to handle this better, ie: not ignore these.
                 self.addIgnoredDisk(name)
@@ -1485,6 +1552,41 @@ class DeviceTree(object):
 
         self.handleVgLvs(vg_device)
 
+    def _examineMDMembers(self, infos):
+        """ Examine the md members among the devices in infos at once.
+
+            Arguments:
+
+                infos -- a list of udev data dicts for devices about to be
+                         added to the tree
+
+            The mdadm --examine results are then used by handleUdevFormat
+            instead of running mdadm for each member in turn. The active
+            arrays are looked up once for the whole batch.
+        """
+        self._udevMDArrays = None
+        members = ["/dev/" + info["name"].replace("!", "/") for info in infos
+                    if udev_device_get_format(info) in
+                        formats.mdraid.MDRaidMember._udevTypes]
+        if not members:
+            return
+
+        devicelibs.mdraid.mdexamine_cache_load(members)
+        self._udevMDArrays = [dev for dev in udev_get_block_devices()
+                                if udev_device_is_md(dev)]
+
+    def _getUdevMDArrays(self):
+        """ Return a list of udev data dicts for the active md arrays. """
+        if self._udevMDArrays is not None:
+            return self._udevMDArrays
+
+        return [dev for dev in udev_get_block_devices()
+                    if udev_device_is_md(dev)]
+
+    def _forgetMDMembers(self):
+        devicelibs.mdraid.mdexamine_cache_invalidate()
+        self._udevMDArrays = None
+
     def handleUdevMDMemberFormat(self, info, device):
         log_method_call(self, name=device.name, type=device.format.type)
         # either look up or create the array device
@@ -1510,10 +1612,7 @@ class DeviceTree(object):
 
             # check the list of devices udev knows about to see if the array
             # this device belongs to is already active
-            for dev in udev_get_block_devices():
-                if not udev_device_is_md(dev):
-                    continue
-
+            for dev in self._getUdevMDArrays():
                 try:
                     dev_uuid = udev_device_get_md_uuid(dev)
                     dev_level = udev_device_get_md_level(dev)
@@ -1869,6 +1968,7 @@ class DeviceTree(object):
         self._removeDevice(device, force=True, moddisk=False)
 
         self._hidden.append(device)
+        self._index.add(device, hidden=True)
         lvm.lvm_cc_addFilterRejectRegexp(device.name)
 
         if isinstance(device, DASDDevice):
@@ -1886,6 +1986,7 @@ class DeviceTree(object):
                                                             hidden.id))
                 self._hidden.remove(hidden)
                 self._devices.append(hidden)
+                self._index.unhide(hidden)
                 lvm.lvm_cc_removeFilterRejectRegexp(hidden.name)
                 for parent in hidden.parents:
                     parent.addChild()
@@ -1972,6 +2073,7 @@ class DeviceTree(object):
     def restoreConfigs(self):
         self.backupConfigs(restore=True)
 
+    @timed_method
     def populate(self, cleanupOnly=False):
         """ Locate all storage devices. """
         self.backupConfigs()
@@ -1992,6 +2094,9 @@ class DeviceTree(object):
         # this has proven useful when populating after opening a LUKS device
         udev_settle()
 
+        # anything may have written to the disks since the last populate
+        partedPool.forgetDisk()
+
         if flags.installer_mode and not flags.image_install:
             devicelibs.mpath.set_friendly_names(enabled=flags.multipath_friendly_names)
 
@@ -2024,33 +2129,51 @@ class DeviceTree(object):
 
         old_devices = {}
 
-        # Now, loop and scan for devices that have appeared since the two above
-        # blocks or since previous iterations.
-        while True:
-            devices = []
-            new_devices = udev_get_block_devices()
-
-            for new_device in new_devices:
-                if not old_devices.has_key(new_device['name']):
-                    old_devices[new_device['name']] = new_device
-                    devices.append(new_device)
-
-            if len(devices) == 0:
-                # nothing is changing -- we are finished building devices
-                break
+        # get the data for all pvs, vgs and lvs from lvm at once instead of
+        # running it for each of them
+        devicelibs.lvm.lvm_cache_load()
+        sysfs.sysfs_cache_load()
+        try:
+            # Now, loop and scan for devices that have appeared since the two
+            # above blocks or since previous iterations. Only the devices we
+            # have not seen yet get their udev data collected on each pass.
+            while True:
+                # the devices set up by the last pass may have changed what
+                # sysfs says about the others
+                sysfs.sysfs_cache_refresh()
+                devices = []
+                new_devices = udev_get_block_devices(skip=old_devices,
+                                            threads=flags.discovery_threads)
+
+                for new_device in new_devices:
+                    if not old_devices.has_key(new_device['name']):
+                        old_devices[new_device['name']] = new_device
+                        devices.append(new_device)
+
+                if len(devices) == 0:
+                    # nothing is changing -- we are finished building devices
+                    break
 
-            log.info("devices to scan: %s" % [d['name'] for d in devices])
-            for dev in devices:
-                self.addUdevDevice(dev)
+                log.info("devices to scan: %s" % [d['name'] for d in devices])
+                self._examineMDMembers(devices)
+                for dev in devices:
+                    self.addUdevDevice(dev)
+        finally:
+            devicelibs.lvm.lvm_cache_invalidate()
+            sysfs.sysfs_cache_invalidate()
+            self._forgetMDMembers()
 
         self.populated = True
+        log.debug("parted pool: %s" % partedPool.stats())
 
         # After having the complete tree we make sure that the system
         # inconsistencies are ignored or resolved.
         self._handleInconsistencies()
 
         self.teardownAll()
+        self._hideIgnoredDisks()
 
+    def _hideIgnoredDisks(self):
         def _is_ignored(disk):
             return ((self.ignoredDisks and disk.name in self.ignoredDisks) or
                     (self.exclusiveDisks and
@@ -2070,6 +2193,194 @@ class DeviceTree(object):
                 if ignored:
                     self.hide(disk)
 
+    def processUevents(self, events):
+        """ Update the tree to reflect the changes described by uevents.
+
+            Arguments:
+
+                events -- a list of udev data dicts as returned by
+                          udev_get_uevents, in the order they were received
+
+            Instead of repopulating the whole tree, only the devices the
+            events are about are probed again, along with everything built
+            on top of them (eg: a disk's partitions and the pvs, vgs and lvs
+            on those). Devices that are new to the tree are added the way
+            populate would add them.
+
+            The events can come straight from a udev monitor or from a list
+            recorded earlier. Since the tree is changed underneath them,
+            this can not be done while there are actions registered.
+        """
+        if self._actions:
+            raise DeviceTreeError("cannot process uevents with actions "
+                                  "registered")
+
+        rescan = []
+        for info in events:
+            action = udev_device_get_action(info)
+            log.info("processing uevent: %s %s" % (action,
+                                                   udev_device_get_name(info)))
+            device = self._getUeventDevice(info)
+            # the pool has the device under the path it was opened by,
+            # which for dm devices is not /dev/<DM_NAME>
+            if device is not None:
+                path = device.path
+            else:
+                path = os.path.realpath(udev_device_get_devnode(info))
+            if action == "remove":
+                # parted must not hand out the device if it shows up again
+                partedPool.release(path)
+                if device is None:
+                    continue
+
+                devices = self._removeUeventDevice(device)
+            else:
+                # the partition table may have been changed
+                partedPool.forgetDisk(path)
+                if device is not None:
+                    devices = [device]
+                else:
+                    devices = self._getUeventParents(info)
+
+            for device in devices:
+                if device not in rescan:
+                    rescan.append(device)
+
+        devicelibs.lvm.lvm_cache_load()
+        sysfs.sysfs_cache_load()
+        try:
+            self._rescanDevices(rescan)
+            self._addNewUdevDevices()
+        finally:
+            devicelibs.lvm.lvm_cache_invalidate()
+            sysfs.sysfs_cache_invalidate()
+            self._forgetMDMembers()
+
+        self._handleInconsistencies()
+        self.teardownAll()
+        self._hideIgnoredDisks()
+
+    def _getUeventDevice(self, info):
+        """ Return the device in the tree a uevent is about, if any. """
+        device = self.getDeviceBySysfsPath(udev_device_get_sysfs_path(info),
+                                           incomplete=True)
+        if device is None:
+            device = self.getDeviceByName(udev_device_get_name(info),
+                                          incomplete=True)
+
+        return device
+
+    def _getUeventParents(self, info):
+        """ Return the devices in the tree a new device is built on. """
+        sysfs_paths = udev_device_get_slaves(info)
+        if udev_device_is_partition(info):
+            sysfs_paths.append(os.path.dirname(udev_device_get_sysfs_path(info)))
+
+        parents = []
+        for sysfs_path in sysfs_paths:
+            device = self.getDeviceBySysfsPath(sysfs_path, incomplete=True)
+            if device is not None and device not in parents:
+                parents.append(device)
+
+        return parents
+
+    def _getBlockAncestors(self, device):
+        """ Return the closest ancestors of device udev knows about.
+
+            Containers like vgs have no udev data, so their parents stand
+            in for them.
+        """
+        ancestors = []
+        for parent in device.parents:
+            if parent.sysfsPath:
+                ancestors.append(parent)
+            else:
+                ancestors.extend(self._getBlockAncestors(parent))
+
+        return ancestors
+
+    def _getSharingDevices(self, devices):
+        """ Return the devices that have dependents in common with devices.
+
+            These are the other parents of anything built on top of devices,
+            eg: the other pvs of a vg on one of devices.
+        """
+        sharing = []
+        for device in devices:
+            for dep in self.getDependentDevices(device):
+                for parent in dep.parents:
+                    if parent in devices or parent in sharing or \
+                       any(parent.dependsOn(d) for d in devices):
+                        continue
+
+                    sharing.append(parent)
+
+        return sharing
+
+    def _removeUeventDevice(self, device):
+        """ Remove a device that is gone from the system.
+
+            Returns a list of the devices that have to be rescanned as a
+            result.
+        """
+        if device.parents:
+            # rescanning whatever the device was built on gets rid of it
+            # and of everything on top of it
+            return self._getBlockAncestors(device)
+
+        sharing = self._getSharingDevices([device])
+        self._removeChildrenFromTree(device)
+        self._removeDevice(device, force=True, moddisk=False)
+        if isinstance(device, DASDDevice) and device in self.dasd:
+            self.dasd.remove(device)
+
+        return sharing
+
+    def _rescanDevices(self, devices):
+        """ Drop everything on top of devices and probe them again. """
+        devices = devices + self._getSharingDevices(devices)
+        for device in devices:
+            self._removeChildrenFromTree(device)
+
+        infos = []
+        for device in devices:
+            if device not in self._index:
+                # it was on top of one of the others
+                continue
+
+            info = udev_get_block_device(device.sysfsPath)
+            if not info:
+                log.info("%s is gone, not rescanning it" % device.name)
+                continue
+
+            infos.append((device, info))
+
+        self._examineMDMembers([info for (device, info) in infos])
+        for (device, info) in infos:
+            log.info("rescanning %s" % device.name)
+            device.format = formats.DeviceFormat()
+            self.addUdevDevice(info)
+
+    def _addNewUdevDevices(self):
+        """ Add the block devices that are not in the tree yet. """
+        seen = set()
+        while True:
+            skip = set(d.name for d in self._devices + self._hidden)
+            skip.update(seen)
+            devices = [info for info in
+                            udev_get_block_devices(skip=skip,
+                                            threads=flags.discovery_threads)
+                        if info["name"] not in seen and
+                           self._getUeventDevice(info) is None]
+            if not devices:
+                break
+
+            log.info("devices to scan: %s" % [d['name'] for d in devices])
+            self._examineMDMembers(devices)
+            for info in devices:
+                seen.add(info["name"])
+                self.addUdevDevice(info)
+
     def teardownAll(self):
         """ Run teardown methods on all devices. """
         if not flags.installer_mode:
@@ -2092,19 +2403,29 @@ class DeviceTree(object):
             except DeviceError as (msg, name):
                 log.error("setup of %s failed: %s" % (device.name, msg))
 
+    def _findDevices(self, criteria, incomplete=False, hidden=False):
+        """ Return a list of devices from the lookup tables.
+
+            criteria is a list of (table, key) tuples as accepted by
+            DeviceIndex.find. The devices are in the order they appear in
+            the tree, ie: the order a scan of the device list would find
+            them in. The caller is responsible for checking that the
+            devices really match.
+        """
+        devices = self._index.find(criteria, hidden=hidden)
+        if not incomplete:
+            devices = [d for d in devices if getattr(d, "complete", True)]
+
+        return devices
+
     def getDeviceBySysfsPath(self, path, incomplete=False, hidden=False):
         if not path:
             return None
 
         found = None
-        devices = self._devices[:]
-        if hidden:
-            devices += self._hidden
-
+        devices = self._findDevices([("sysfsPath", path)],
+                                    incomplete=incomplete, hidden=hidden)
         for device in devices:
-            if not incomplete and not getattr(device, "complete", True):
-                continue
-
             if device.sysfsPath == path:
                 found = device
                 break
@@ -2117,14 +2438,9 @@ class DeviceTree(object):
             return None
 
         found = None
-        devices = self._devices[:]
-        if hidden:
-            devices += self._hidden
-
+        devices = self._findDevices([("uuid", uuid), ("formatUuid", uuid)],
+                                    incomplete=incomplete, hidden=hidden)
         for device in devices:
-            if not incomplete and not getattr(device, "complete", True):
-                continue
-
             if device.uuid == uuid:
                 found = device
                 break
@@ -2159,14 +2475,9 @@ class DeviceTree(object):
             return None
 
         found = None
-        devices = self._devices[:]
-        if hidden:
-            devices += self._hidden
-
+        devices = self._findDevices([("label", label)],
+                                    incomplete=incomplete, hidden=hidden)
         for device in devices:
-            if not incomplete and not getattr(device, "complete", True):
-                continue
-
             _label = getattr(device.format, "label", None)
             if not _label:
                 continue
@@ -2185,19 +2496,15 @@ class DeviceTree(object):
             return None
 
         found = None
-        devices = self._devices[:]
-        if hidden:
-            devices += self._hidden
-
+        lvm_name = name.replace("--","-")
+        devices = self._findDevices([("name", name), ("name", lvm_name)],
+                                    incomplete=incomplete, hidden=hidden)
         for device in devices:
-            if not incomplete and not getattr(device, "complete", True):
-                continue
-
             if device.name == name:
                 found = device
                 break
             elif (device.type == "lvmlv" or device.type == "lvmvg") and \
-                    device.name == name.replace("--","-"):
+                    device.name == lvm_name:
                 found = device
                 break
 
@@ -2214,17 +2521,13 @@ class DeviceTree(object):
         leaf = None
         other = None
 
-        devices = self._devices[:]
-        if hidden:
-            devices += self._hidden
-
+        lvm_path = path.replace("--","-")
+        devices = self._findDevices([("path", path), ("path", lvm_path)],
+                                    incomplete=incomplete, hidden=hidden)
         for device in devices:
-            if not incomplete and not getattr(device, "complete", True):
-                continue
-
             if (device.path == path or
                 ((device.type == "lvmlv" or device.type == "lvmvg") and
-                 device.path == path.replace("--","-"))):
+                 device.path == lvm_path)):
                 if device.isleaf and not leaf:
                     leaf = device
                 elif not other:
@@ -2249,12 +2552,7 @@ class DeviceTree(object):
         return [d for d in self._devices if isinstance(d, device_class)]
 
     def getDeviceByID(self, id_num, hidden=False):
-
-        devices = self._devices[:]
-        if hidden:
-            devices += self._hidden
-
-        for device in devices:
+        for device in self._index.lookup("id", id_num, hidden=hidden):
             if device.id == id_num:
                 return device
 
@@ -2262,15 +2560,17 @@ class DeviceTree(object):
     def devices(self):
         """ List of device instances """
         devices = []
+        uuids = set()
         for device in self._devices:
             if not getattr(device, "complete", True):
                 continue
 
-            if device.uuid and device.uuid in [d.uuid for d in devices] and \
+            if device.uuid and device.uuid in uuids and \
                not isinstance(device, NoDevice):
                 raise DeviceTreeError("duplicate uuids in device tree")
 
             devices.append(device)
+            uuids.add(device.uuid)
 
         return devices
 
@@ -2326,12 +2626,25 @@ class DeviceTree(object):
     @property
     def leaves(self):
         """ List of all devices upon which no other devices exist. """
-        leaves = [d for d in self._devices if d.isleaf]
-        return leaves
+        generation = deviceindex.generation()
+        if self._leaves is None or self._leaves[0] != generation:
+            # an extended partition without children is still not a leaf
+            # while it holds logical partitions, which can change without
+            # the partition itself being touched
+            candidates = [d for d in self._devices if d.kids == 0]
+            extended = any(isinstance(d, PartitionDevice) and d.isExtended
+                           for d in candidates)
+            self._leaves = (generation, candidates, extended)
+
+        (generation, candidates, extended) = self._leaves
+        if extended:
+            return [d for d in candidates if d.isleaf]
+
+        return candidates[:]
 
     def getChildren(self, device):
         """ Return a list of a device's children. """
-        return [c for c in self._devices if device in c.parents]
+        return self._index.children(device)
 
     def resolveDevice(self, devspec, blkidTab=None, cryptTab=None, options=None):
         # find device in the tree
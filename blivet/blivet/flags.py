@@ -60,6 +60,14 @@ class Flags(object):
         # meaningful when flags.installer_mode is False)
         self.include_nodev = False
 
+        # number of threads used to collect udev data for newly found block
+        # devices during DeviceTree.populate (0 means collect it serially)
+        self.discovery_threads = 0
+
+        # number of threads DeviceTree.processActions uses to execute actions
+        # on unrelated devices concurrently (0 means one action at a time)
+        self.action_threads = 0
+
         self.boot_cmdline = {}
 
         self.update_from_boot_cmdline()
@@ -32,6 +32,7 @@ from ..devicelibs.dm import dm_node_from_name
 from ..devicelibs.mdraid import md_node_from_name
 from ..udev import udev_device_get_major, udev_device_get_minor
 from ..i18n import _
+from .. import deviceindex
 
 import logging
 log = logging.getLogger("blivet")
@@ -159,6 +160,7 @@ class DeviceFormat(object):
     _check = False
     _hidden = False                     # hide devices with this formatting?
     _ksMountpoint = None
+    _indexedAttrs = frozenset(["uuid", "_label"]) # see deviceindex.py
 
     def __init__(self, *args, **kwargs):
         """ Create a DeviceFormat instance.
@@ -180,6 +182,11 @@ class DeviceFormat(object):
         #if self.__class__ is DeviceFormat:
         #    self.exists = True
 
+    def __setattr__(self, attr, value):
+        object.__setattr__(self, attr, value)
+        if attr in self._indexedAttrs:
+            deviceindex.attribute_changed(self)
+
     def __repr__(self):
         s = ("%(classname)s instance (%(id)s) --\n"
              "  type = %(type)s  name = %(name)s  status = %(status)s\n"
@@ -28,6 +28,8 @@ import parted
 import _ped
 from ..errors import *
 from .. import arch
+from .. import sysfs
+from ..partedpool import pool
 from ..flags import flags
 from ..udev import udev_settle
 from . import DeviceFormat, register_device_format
@@ -146,7 +148,7 @@ class DiskLabel(DeviceFormat):
         if not self._partedDisk:
             if self.exists:
                 try:
-                    self._partedDisk = parted.Disk(device=self.partedDevice)
+                    self._partedDisk = pool.getDisk(self.device)
                 except (_ped.DiskLabelException, _ped.IOException,
                         NotImplementedError) as e:
                     raise InvalidDiskLabelError()
@@ -191,7 +193,7 @@ class DiskLabel(DeviceFormat):
                 # do not always have any media present, so parted won't be able
                 # to find a device.
                 try:
-                    self._partedDevice = parted.Device(path=self.device)
+                    self._partedDevice = pool.getDevice(self.device)
                 except (_ped.IOException, _ped.DeviceException) as e:
                     log.error("DiskLabel.partedDevice: Parted exception: %s" % e)
             else:
@@ -279,6 +281,7 @@ class DiskLabel(DeviceFormat):
             raise DeviceFormatError("device path does not exist")
 
         self.partedDevice.clobber()
+        pool.forgetDisk(self.device)
         self.exists = False
 
     def commit(self):
@@ -290,6 +293,7 @@ class DiskLabel(DeviceFormat):
         except parted.DiskException as msg:
             raise DiskLabelCommitError(msg)
         else:
+            pool.forgetDisk(self.device)
             self.updateOrigPartedDisk()
             udev_settle()
 
@@ -302,6 +306,7 @@ class DiskLabel(DeviceFormat):
         except parted.DiskException as msg:
             raise DiskLabelCommitError(msg)
         else:
+            pool.forgetDisk(self.device)
             self.updateOrigPartedDisk()
 
     def addPartition(self, *args, **kwargs):
@@ -406,8 +411,12 @@ class DiskLabel(DeviceFormat):
 
     @property
     def free(self):
-        def read_int_from_sys(path):
-            return int(open(path).readline().strip())
+        def read_int_from_sys(name, attr):
+            value = sysfs.get_attr("/class/block/%s" % name, attr)
+            if value is None:
+                raise IOError("cannot read %s of %s from sysfs" % (attr, name))
+
+            return int(value)
 
         try:
             free = sum([f.getSize()
@@ -419,13 +428,13 @@ class DiskLabel(DeviceFormat):
             disk_name = self.device.split("/")[-1]
 
             disk_root = sys_block_root + disk_name
-            disk_length = read_int_from_sys("%s/size" % disk_root)
-            sector_size = read_int_from_sys("%s/queue/logical_block_size" % disk_root)
+            disk_length = read_int_from_sys(disk_name, "size")
+            sector_size = read_int_from_sys(disk_name,
+                                            "queue/logical_block_size")
             partition_names = [n for n in os.listdir(disk_root) if n.startswith(disk_name)]
             used_sectors = 0
             for partition_name in partition_names:
-                partition_root = sys_block_root + partition_name
-                partition_length = read_int_from_sys("%s/size" % partition_root)
+                partition_length = read_int_from_sys(partition_name, "size")
                 used_sectors += partition_length
 
             free = ((disk_length - used_sectors) * sector_size) / (1024.0 * 1024.0)
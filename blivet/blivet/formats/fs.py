@@ -32,6 +32,7 @@ from ..errors import *
 from . import DeviceFormat, register_device_format
 from .. import util
 from .. import platform
+from ..devicelibs.superblock import read_superblock
 from ..flags import flags
 from parted import fileSystemType
 from ..storage_log import log_method_call
@@ -212,13 +213,30 @@ class FS(DeviceFormat):
         if not self.exists:
             return
 
-        info = self._getFSInfo()
-        self._size = self._getExistingSize(info=info)
-        self._getMinSize(info=info)   # force calculation of minimum size
+        # the info utility only has to run if the superblock can't be read
+        superblock = self._readSuperBlock()
+        info = None
+        if superblock is None:
+            info = self._getFSInfo()
 
-    def _getMinSize(self, info=None):
+        self._size = self._getExistingSize(info=info, superblock=superblock)
+        # force calculation of minimum size
+        self._getMinSize(info=info, superblock=superblock)
+
+    def _getMinSize(self, info=None, superblock=None):
         pass
 
+    def _readSuperBlock(self):
+        """ Return this filesystem's superblock, or None.
+
+            None means the superblock can't be read without the external
+            tools, eg: because there is no parser for this filesystem type.
+        """
+        if not self.exists or not self.device:
+            return None
+
+        return read_superblock(self.device, self.mountType)
+
     def _getFSInfo(self):
         buf = ""
         if self.infofsProg and self.exists and \
@@ -231,13 +249,16 @@ class FS(DeviceFormat):
 
         return buf
 
-    def _getExistingSize(self, info=None):
+    def _getExistingSize(self, info=None, superblock=None):
         """ Determine the size of this filesystem.  Filesystem must
             exist.  Each filesystem varies, but the general procedure
             is to run the filesystem dump or info utility and read
             the block size and number of blocks for the filesystem
             and compute megabytes from that.
 
+            If the superblock could be read, it provides the block size
+            and count instead of the dump or info utility.
+
             The loop that reads the output from the infofsProg is meant
             to be simple, but take in to account variations in output.
             The general procedure:
@@ -266,6 +287,11 @@ class FS(DeviceFormat):
         """
         size = self._size
 
+        if self.exists and not size and superblock is not None and \
+           superblock.block_count:
+            size = superblock.block_count * superblock.block_size
+            return math.floor(size / 1024.0 / 1024.0)
+
         if self.exists and not size:
             if info is None:
                 info = self._getFSInfo()
@@ -641,6 +667,10 @@ class FS(DeviceFormat):
         if not os.path.exists(self.device):
             raise FSError("device does not exist")
 
+        superblock = self._readSuperBlock()
+        if superblock is not None and superblock.label is not None:
+            return superblock.label
+
         if not self._labelfs or not self._labelfs.labelApp or not self._labelfs.labelApp.reads:
             raise FSError("no application to read label for filesystem %s" % self.type)
 
@@ -910,23 +940,33 @@ class Ext2FS(FS):
         if err:
             raise FSError("failed to set UUID for %s: %s" % (self.device, err))
 
-    def _getMinSize(self, info=None):
-        """ Minimum size for this filesystem in MB. """
+    def _getMinSize(self, info=None, superblock=None):
+        """ Minimum size for this filesystem in MB.
+
+            The block size and state come from the superblock if it could
+            be read. The minimum size always comes from resize2fs, since
+            the blocks in use are not a good enough estimate of it.
+        """
         size = self._minSize
         blockSize = None
 
         if self.exists and os.path.exists(self.device):
-            if info is None:
-                # get block size
-                info = self._getFSInfo()
+            if superblock is not None:
+                blockSize = superblock.block_size
+                self.dirty = not superblock.clean
+                self.errors = superblock.errors
+            else:
+                if info is None:
+                    # get block size
+                    info = self._getFSInfo()
 
-            for line in info.splitlines():
-                if line.startswith("Block size:"):
-                    blockSize = int(line.split(" ")[-1])
+                for line in info.splitlines():
+                    if line.startswith("Block size:"):
+                        blockSize = int(line.split(" ")[-1])
 
-                if line.startswith("Filesystem state:"):
-                    self.dirty = "not clean" in line
-                    self.errors = "with errors" in line
+                    if line.startswith("Filesystem state:"):
+                        self.dirty = "not clean" in line
+                        self.errors = "with errors" in line
 
             if blockSize is None:
                 raise FSError("failed to get block size for %s filesystem "
@@ -1310,7 +1350,7 @@ class NTFS(FS):
             return True
         return False
 
-    def _getMinSize(self, info=None):
+    def _getMinSize(self, info=None, superblock=None):
         # try to determine the minimum size.
         size = self._minSize
         if self.exists and os.path.exists(self.device) and \
@@ -18,10 +18,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from udev import udev_settle
+from udev import udev_settle, udev_monitor_block_devices, udev_get_uevents
+from udev import udev_queue_is_idle
+from udev import udev_device_is_iscsi, udev_device_get_iscsi_name
+from udev import udev_device_get_iscsi_address, udev_device_get_iscsi_port
 from . import util
 from .flags import flags
 from .i18n import _
+from multiprocessing.pool import ThreadPool
 import os
 import logging
 import shutil
@@ -41,6 +45,20 @@ INITIATOR_FILE="/etc/iscsi/initiatorname.iscsi"
 
 ISCSI_MODULES=['cxgb3i', 'bnx2i', 'be2iscsi']
 
+# number of portals discovered and of nodes logged into at a time
+ISCSI_THREADS=4
+
+# seconds to wait for iscsid to listen for requests and for the disks of
+# the nodes logged into to show up
+ISCSID_TIMEOUT=5
+ISCSI_DEVICE_TIMEOUT=30
+
+# seconds without uevents, and with udev's queue empty, after which nodes
+# still without a disk are taken to have no LUNs
+ISCSI_QUIET_TIME=2
+
+ISCSID_SOCKET="@ISCSIADM_ABSTRACT_NAMESPACE"
+
 def has_iscsi():
     global ISCSID
 
@@ -56,6 +74,77 @@ def has_iscsi():
 
     return True
 
+def _iscsid_listening():
+    """ Return whether iscsid accepts requests, or None if unknown. """
+    try:
+        with open("/proc/net/unix") as f:
+            lines = f.readlines()
+    except IOError:
+        return None
+
+    return any(line.split()[-1] == ISCSID_SOCKET for line in lines[1:]
+                    if line.strip())
+
+def _wait_for_iscsid(timeout=ISCSID_TIMEOUT):
+    """ Wait until iscsid listens for iscsiadm and libiscsi requests. """
+    deadline = time.time() + timeout
+    while True:
+        listening = _iscsid_listening()
+        if listening is None:
+            # no way to tell, give it the time it always got
+            time.sleep(1)
+            return
+
+        if listening:
+            return
+
+        if time.time() >= deadline:
+            log.warning("iscsi: iscsid not listening after %d seconds" %
+                        timeout)
+            return
+
+        time.sleep(0.05)
+
+def _pool_map(func, items, threads=None):
+    """ Return [func(item) for item in items], computed by threads threads. """
+    if threads is None:
+        threads = ISCSI_THREADS
+
+    threads = min(threads, len(items))
+    if threads <= 1:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(func, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def _node_key(node):
+    return (node.name, node.address, str(node.port))
+
+class NodeLogin(object):
+    """ The outcome of logging into a node.
+
+        node -- the libiscsi node
+        rc -- True if the login succeeded
+        msg -- why it did not
+        login_time -- seconds the login took
+        devices -- names of the node's disks that showed up
+        device_time -- seconds from the start of the logins until the first
+                       of the node's disks showed up, None if none did
+    """
+    __slots__ = ["node", "rc", "msg", "login_time", "devices", "device_time"]
+
+    def __init__(self, node, rc, msg, login_time):
+        self.node = node
+        self.rc = rc
+        self.msg = msg
+        self.login_time = login_time
+        self.devices = []
+        self.device_time = None
+
 class iscsi(object):
     """ iSCSI utility class.
 
@@ -153,27 +242,112 @@ class iscsi(object):
             # an exception here means there is no ibft firmware, just return
             return
 
+        monitor = self._monitor()
+        start = time.time()
+        logins = []
         for node in found_nodes:
+            began = time.time()
             try:
                 node.login()
                 log.info("iscsi IBFT: logged into %s at %s:%s through %s" % (
                     node.name, node.address, node.port, node.iface))
                 self.ibftNodes.append(node)
+                logins.append(NodeLogin(node, True, "", time.time() - began))
             except IOError as e:
                 log.error("Could not log into ibft iscsi target %s: %s" %
                           (node.name, str(e)))
                 pass
 
-        self.stabilize()
+        self.stabilize(monitor, logins, start)
+
+    def _monitor(self):
+        """ Return a monitor for the disks about to be added, or None. """
+        try:
+            return udev_monitor_block_devices()
+        except OSError as e:
+            log.warning("iscsi: cannot monitor uevents: %s" % e)
+            return None
 
-    def stabilize(self):
-        # Wait for udev to create the devices for the just added disks
+    def stabilize(self, monitor=None, logins=None, start=None,
+                  timeout=ISCSI_DEVICE_TIMEOUT):
+        """ Wait for udev to create the devices for the just added disks.
+
+            Keyword Arguments:
+
+                monitor -- a monitor from udev_monitor_block_devices created
+                           before logging in; it is released here
+                logins -- NodeLogin instances for the logins
+                start -- when the logins started, for the device_time of
+                         the logins
+                timeout -- seconds to wait for the disks to show up
+
+            With a monitor, this waits until each node logged into has a
+            disk, and fills in the devices and device_time of the logins.
+            Nodes without LUNs never get one, so it also stops once no
+            uevents came for ISCSI_QUIET_TIME seconds and udev is idle, and
+            at the latest when timeout passes. Without a monitor, there is no telling whether the
+            events for the new disks were sent yet, so it sleeps for a while
+            first. Either way it then waits for udev to process the events.
+        """
+        if monitor is None:
+            time.sleep(2)
+        else:
+            try:
+                self._wait_for_disks(monitor, logins or [],
+                                     start or time.time(), timeout)
+            finally:
+                monitor.unref()
 
-        # It is possible when we get here the events for the new devices
-        # are not send yet, so sleep to make sure the events are fired
-        time.sleep(2)
         udev_settle()
 
+    def _wait_for_disks(self, monitor, logins, start, timeout):
+        nodes = {}
+        for login in logins:
+            if login.rc:
+                nodes.setdefault(_node_key(login.node), []).append(login)
+
+        pending = set(nodes.keys())
+        deadline = time.time() + timeout
+        quiet_since = time.time()
+        while pending:
+            now = time.time()
+            remaining = deadline - now
+            if remaining <= 0:
+                log.warning("iscsi: no disks showed up for %s" %
+                            ", ".join(sorted(k[0] for k in pending)))
+                break
+
+            quiet = quiet_since + ISCSI_QUIET_TIME - now
+            if quiet <= 0:
+                if udev_queue_is_idle():
+                    log.info("iscsi: no disks for %s, taking them to have "
+                             "no LUNs" % ", ".join(sorted(k[0]
+                                                          for k in pending)))
+                    break
+
+                # udev may still be on its way to sending the events
+                quiet = 0.1
+
+            events = udev_get_uevents(monitor, timeout=min(remaining, quiet))
+            if events:
+                quiet_since = time.time()
+
+            for info in events:
+                if info.get("ACTION") != "add" or \
+                   info.get("DEVTYPE") != "disk" or \
+                   not udev_device_is_iscsi(info):
+                    continue
+
+                key = (udev_device_get_iscsi_name(info),
+                       udev_device_get_iscsi_address(info),
+                       udev_device_get_iscsi_port(info))
+                for login in nodes.get(key, []):
+                    login.devices.append(info["name"])
+                    if login.device_time is None:
+                        login.device_time = time.time() - start
+
+                pending.discard(key)
+
     def create_interfaces(self, ifaces):
         for iface in ifaces:
             iscsi_iface_name = "iface%d" % len(self.ifaces)
@@ -238,7 +412,7 @@ class iscsi(object):
             util.run_program([iscsiuio])
         # run the daemon
         util.run_program([ISCSID])
-        time.sleep(1)
+        _wait_for_iscsid()
 
         self._startIBFT()
         self.started = True
@@ -321,12 +495,89 @@ class iscsi(object):
 
         return (rc, msg)
 
+    def discover_portals(self, portals, username=None, password=None,
+                         r_username=None, r_password=None, threads=None):
+        """
+        Discover iSCSI nodes on several targets concurrently.
+
+        portals is a list of (ipaddr, port) tuples, the credentials are used
+        for all of them and threads is the number of portals discovered at
+        a time (ISCSI_THREADS by default).
+
+        Returns a dict mapping each portal to the list of nodes discover()
+        returns for it, or to the IOError or ValueError discovering it
+        raised.
+        """
+        if not has_iscsi():
+            raise IOError, _("iSCSI not available")
+        if self._initiator == "":
+            raise ValueError, _("No initiator name set")
+
+        # start iscsid before the workers would all try to
+        self.startup()
+
+        unique = []
+        for (ipaddr, port) in portals:
+            if (ipaddr, str(port)) not in unique:
+                unique.append((ipaddr, str(port)))
+
+        def _discover(portal):
+            try:
+                return self.discover(portal[0], portal[1], username,
+                                     password, r_username, r_password)
+            except (IOError, ValueError) as e:
+                log.warning("iSCSI: could not discover %s:%s: %s" %
+                            (portal[0], portal[1], e))
+                return e
+
+        return dict(zip(unique, _pool_map(_discover, unique, threads)))
+
+    def log_into_nodes(self, nodes, username=None, password=None,
+                       r_username=None, r_password=None, threads=None,
+                       timeout=ISCSI_DEVICE_TIMEOUT):
+        """
+        Log into several nodes concurrently and wait for their disks.
+
+        The credentials are used for all of the nodes and threads is the
+        number of logins done at a time (ISCSI_THREADS by default). Once
+        the logins are done this waits up to timeout seconds for every node
+        logged into to get a disk, instead of waiting a fixed time.
+
+        Returns a list of NodeLogin instances in the order of nodes.
+        """
+        nodes = list(nodes)
+        if not nodes:
+            return []
+
+        monitor = self._monitor()
+        start = time.time()
+
+        def _login(node):
+            began = time.time()
+            (rc, msg) = self.log_into_node(node, username, password,
+                                           r_username, r_password)
+            return NodeLogin(node, rc, msg, time.time() - began)
+
+        try:
+            logins = _pool_map(_login, nodes, threads)
+        except:
+            if monitor is not None:
+                monitor.unref()
+            raise
+
+        self.stabilize(monitor, logins, start, timeout)
+        for login in logins:
+            log.debug("iSCSI: %s: login %.3fs, disks %s after %s" % (
+                      login.node.name, login.login_time,
+                      login.devices, login.device_time))
+
+        return logins
+
     # NOTE: the same credentials are used for discovery and login
     #       (unlike in UI)
     def addTarget(self, ipaddr, port="3260", user=None, pw=None,
                   user_in=None, pw_in=None, target=None, iface=None):
-        found = 0
-        logged_in = 0
+        nodes = []
 
         found_nodes = self.discover(ipaddr, port, user, pw, user_in, pw_in)
         if found_nodes == None:
@@ -344,20 +595,15 @@ class iscsi(object):
                                (node.name, node_net_iface))
                     continue
 
-            found = found + 1
-
-            (rc, msg) = self.log_into_node(node, user, pw, user_in, pw_in)
-            if rc:
-                logged_in = logged_in +1
+            nodes.append(node)
 
-        if found == 0:
+        if not nodes:
             raise IOError, _("No new iSCSI nodes discovered")
 
-        if logged_in == 0:
+        logins = self.log_into_nodes(nodes, user, pw, user_in, pw_in)
+        if not any(login.rc for login in logins):
             raise IOError, _("Could not log in to any of the discovered nodes")
 
-        self.stabilize()
-
     def write(self, root, storage):
         if not self.initiatorSet:
             return
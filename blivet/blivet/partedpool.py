@@ -0,0 +1,189 @@
+# partedpool.py
+# Shared parted devices and partition tables.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" A pool of parted objects shared by every user of a device path.
+
+    Each disk's StorageDevice and every DiskLabel created for it used to
+    get its own parted.Device, and every DiskLabel read the partition
+    table from the disk again. The pool keeps one parted.Device per path
+    and the partition table as it was last read from the disk. Callers get
+    their own copy of the table (parted.Disk.duplicate works in memory),
+    so only the first one has to wait for the disk.
+
+    The tables are forgotten whenever blivet writes to a disk and at the
+    start of every populate, since other tools may have changed them.
+    release() drops a path altogether and closes anything parted still
+    has open on it.
+
+    Paths are pooled by the device node they resolve to, so that eg:
+    /dev/mapper/mpatha and /dev/dm-0 share one entry.
+"""
+
+import os
+import threading
+
+import parted
+
+import logging
+log = logging.getLogger("blivet")
+
+class PartedPool(object):
+    """ parted.Device instances and partition tables by device path. """
+    def __init__(self):
+        self._devices = {}      # path -> parted.Device
+        self._disks = {}        # path -> parted.Disk as read from the disk
+        self._aliases = {}      # path as asked for -> path pooled under
+        self._lock = threading.Lock()
+
+    def _key(self, path):
+        """ Return the path the device at path is pooled under. """
+        key = os.path.realpath(path)
+        if not os.path.exists(key):
+            # the device is gone already, along with its symlinks
+            key = self._aliases.get(path, key)
+
+        return key
+
+    def getDevice(self, path):
+        """ Return the parted.Device for path, creating it if needed.
+
+            Raises the same exceptions parted.Device does.
+        """
+        key = self._key(path)
+        device = self._devices.get(key)
+        if device is None:
+            # two threads may both get here, but only one device is kept
+            device = parted.Device(path=path)
+            device = self._devices.setdefault(key, device)
+            self._aliases[path] = key
+
+        return device
+
+    def getDisk(self, path):
+        """ Return a new copy of the partition table on path.
+
+            The table is only read from the disk the first time, or the
+            first time after it was forgotten. Raises the same exceptions
+            parted.Disk does.
+        """
+        key = self._key(path)
+        disk = self._disks.get(key)
+        if disk is None:
+            disk = parted.Disk(device=self.getDevice(path))
+            disk = self._disks.setdefault(key, disk)
+
+        return disk.duplicate()
+
+    def forgetDisk(self, path=None):
+        """ Read the partition table of path, or all of them, again. """
+        with self._lock:
+            if path is None:
+                self._disks.clear()
+            else:
+                self._disks.pop(self._key(path), None)
+
+    def release(self, path=None):
+        """ Drop path, or every path, from the pool.
+
+            Anything parted still has open on the devices gets closed.
+            Copies of the devices held elsewhere stay usable.
+        """
+        with self._lock:
+            if path is None:
+                paths = self._devices.keys()
+                self._disks.clear()
+                self._aliases.clear()
+            else:
+                paths = [self._key(path)]
+                self._disks.pop(paths[0], None)
+                for (alias, key) in self._aliases.items():
+                    if key == paths[0]:
+                        del self._aliases[alias]
+
+            devices = [self._devices.pop(p) for p in paths
+                            if p in self._devices]
+
+        for device in devices:
+            self._close(device)
+
+    def _close(self, device):
+        try:
+            count = device.openCount
+        except Exception:
+            return
+
+        if not isinstance(count, (int, long)):
+            return
+
+        for i in range(count):
+            try:
+                device.close()
+            except Exception as e:
+                log.debug("failed to close %s: %s" % (device.path, e))
+                break
+
+    def _openFds(self):
+        """ Return the number of fds of this process open on pooled paths. """
+        targets = set(self._devices.keys())
+
+        count = 0
+        try:
+            fds = os.listdir("/proc/self/fd")
+        except OSError:
+            return None
+
+        for fd in fds:
+            try:
+                target = os.readlink("/proc/self/fd/%s" % fd)
+            except OSError:
+                continue
+
+            if target in targets:
+                count += 1
+
+        return count
+
+    def stats(self):
+        """ Return a dict describing what the pool holds.
+
+            devices -- number of parted devices
+            disks -- number of partition tables
+            partitions -- number of partitions in those tables
+            openFds -- fds this process has open on the devices, or None
+                       if that can not be found out
+            rss -- resident memory of this process in bytes, or None
+        """
+        with self._lock:
+            disks = self._disks.values()
+            stats = {"devices": len(self._devices), "disks": len(disks)}
+
+        stats["partitions"] = sum(len(d.partitions) for d in disks)
+        stats["openFds"] = self._openFds()
+        try:
+            with open("/proc/self/statm") as f:
+                pages = int(f.read().split()[1])
+            stats["rss"] = pages * os.sysconf("SC_PAGE_SIZE")
+        except (IOError, OSError, ValueError, IndexError):
+            stats["rss"] = None
+
+        return stats
+
+# the pool everything in blivet shares
+pool = PartedPool()
@@ -110,15 +110,39 @@ libudev_udev_enumerate_get_list_entry.argtypes = [ c_void_p ]
 libudev_udev_device_get_devlinks_list_entry = libudev.udev_device_get_devlinks_list_entry
 libudev_udev_device_get_devlinks_list_entry.restype = c_void_p
 libudev_udev_device_get_devlinks_list_entry.argtypes = [ c_void_p ]
+libudev_udev_device_get_action = libudev.udev_device_get_action
+libudev_udev_device_get_action.restype = c_char_p
+libudev_udev_device_get_action.argtypes = [ c_void_p ]
+
+libudev_udev_monitor_new_from_netlink = libudev.udev_monitor_new_from_netlink
+libudev_udev_monitor_new_from_netlink.restype = c_void_p
+libudev_udev_monitor_new_from_netlink.argtypes = [ c_void_p, c_char_p ]
+libudev_udev_monitor_unref = libudev.udev_monitor_unref
+libudev_udev_monitor_unref.argtypes = [ c_void_p ]
+libudev_udev_monitor_filter_add_match_subsystem_devtype = libudev.udev_monitor_filter_add_match_subsystem_devtype
+libudev_udev_monitor_filter_add_match_subsystem_devtype.restype = c_int
+libudev_udev_monitor_filter_add_match_subsystem_devtype.argtypes = [ c_void_p, c_char_p, c_char_p ]
+libudev_udev_monitor_enable_receiving = libudev.udev_monitor_enable_receiving
+libudev_udev_monitor_enable_receiving.restype = c_int
+libudev_udev_monitor_enable_receiving.argtypes = [ c_void_p ]
+libudev_udev_monitor_get_fd = libudev.udev_monitor_get_fd
+libudev_udev_monitor_get_fd.restype = c_int
+libudev_udev_monitor_get_fd.argtypes = [ c_void_p ]
+libudev_udev_monitor_receive_device = libudev.udev_monitor_receive_device
+libudev_udev_monitor_receive_device.restype = c_void_p
+libudev_udev_monitor_receive_device.argtypes = [ c_void_p ]
 
 
 class UdevDevice(dict):
 
-    def __init__(self, udev, sysfs_path):
+    def __init__(self, udev, sysfs_path, udev_device=None):
         dict.__init__(self)
 
-        # create new udev device from syspath
-        udev_device = libudev_udev_device_new_from_syspath(udev, sysfs_path)
+        # create new udev device from syspath, unless we have been handed a
+        # device, eg: one received from a monitor
+        if udev_device is None:
+            udev_device = libudev_udev_device_new_from_syspath(udev, sysfs_path)
+
         if not udev_device:
             # device does not exist
             return
@@ -168,6 +192,7 @@ class UdevDevice(dict):
         self.devtype = libudev_udev_device_get_devtype(udev_device)
         self.sysnum = libudev_udev_device_get_sysnum(udev_device)
         self.devnode = libudev_udev_device_get_devnode(udev_device)
+        self.action = libudev_udev_device_get_action(udev_device)
 
         # cleanup
         libudev_udev_device_unref(udev_device)
@@ -227,6 +252,51 @@ class Udev(object):
             if device:
                 yield device
 
+    def create_monitor(self, subsystem=None):
+        return UdevMonitor(self, subsystem=subsystem)
+
     def unref(self):
         libudev_udev_unref(self.udev)
         self.udev = None
+
+
+class UdevMonitor(object):
+    """ A netlink monitor for the uevents udev has finished processing. """
+
+    def __init__(self, udev, subsystem=None):
+        self.udev = udev
+        self.monitor = libudev_udev_monitor_new_from_netlink(udev.udev, "udev")
+        if not self.monitor:
+            raise OSError("unable to create the udev monitor")
+
+        if subsystem is not None:
+            rc = libudev_udev_monitor_filter_add_match_subsystem_devtype(
+                                            self.monitor, subsystem, None)
+            if not rc == 0:
+                self.unref()
+                raise OSError("unable to add the match subsystem")
+
+        rc = libudev_udev_monitor_enable_receiving(self.monitor)
+        if not rc == 0:
+            self.unref()
+            raise OSError("unable to enable receiving of uevents")
+
+    def fileno(self):
+        """ The monitor's file descriptor, for use with select/poll. """
+        return libudev_udev_monitor_get_fd(self.monitor)
+
+    def receive_device(self):
+        """ Return the next device with a pending uevent, or None.
+
+            The event type is available as the device's action attribute.
+        """
+        udev_device = libudev_udev_monitor_receive_device(self.monitor)
+        if not udev_device:
+            return None
+
+        return UdevDevice(self.udev.udev, None, udev_device=udev_device)
+
+    def unref(self):
+        if self.monitor:
+            libudev_udev_monitor_unref(self.monitor)
+            self.monitor = None
@@ -19,6 +19,7 @@
 #
 # Red Hat Author(s): David Cantrell <dcantrell@redhat.com>
 
+import os
 import re
 import string
 import locale
@@ -105,6 +106,43 @@ def _makeSpecs(prefix, abbr, xlate):
 
     return specs
 
+def _specFactors(units, prefixes, xlate):
+    """ Return a dict mapping each specifier to its factor.
+
+        If two prefixes share a specifier, the first one wins, which is
+        the one a scan of the prefix list would have matched.
+    """
+    factors = dict((unit, 1) for unit in units)
+    factors[""] = 1
+    for factor, prefix, abbr in prefixes:
+        for spec in _makeSpecs(prefix, abbr, xlate):
+            factors.setdefault(spec, factor)
+
+    return factors
+
+# English specifiers, lowercase
+_specFactorsASCII = _specFactors(_bytes, _prefixes, False)
+
+# The translated tables depend on the environment gettext picks the
+# language from, so they are cached per language.
+_translationVars = ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG")
+_translatedTables = {}
+
+def _translated():
+    """ Return the translated prefixes, specifiers and byte abbreviation. """
+    key = tuple(os.environ.get(var) for var in _translationVars)
+    tables = _translatedTables.get(key)
+    if tables is None:
+        prefixes = _xlated_prefixes()
+        tables = (prefixes,
+                  _specFactors(_xlated_bytes(), prefixes, True),
+                  _("B").decode("utf-8"))
+        _translatedTables[key] = tables
+
+    return tables
+
+_specRE = re.compile(r'(-?\s*[0-9.]+)\s*([^\s]*)$')
+
 def _parseSpec(spec):
     """ Parse string representation of size. """
     if not spec:
@@ -118,7 +156,7 @@ def _parseSpec(spec):
     # Match the string using only digit/space/not-space, since the
     # string might be non-English and contain non-letter characters
     # that Python doesn't understand as parts of words.
-    m = re.match(r'(-?\s*[0-9.]+)\s*([^\s]*)$', spec.strip())
+    m = _specRE.match(spec.strip())
     if not m:
         raise ValueError("invalid size specification", spec)
 
@@ -146,40 +184,50 @@ def _parseSpec(spec):
     except UnicodeDecodeError:
         pass
     else:
-        if spec_ascii in _bytes or not spec_ascii:
-            return size
-
-        for factor, prefix, abbr in _prefixes:
-            check = _makeSpecs(prefix, abbr, False)
-
-            if spec_ascii in check:
-                return size * factor
+        factor = _specFactorsASCII.get(spec_ascii)
+        if factor is not None:
+            return size * factor
 
     # No English match found, try localized size specs. Accept any utf-8
     # character and leave the result as a unicode object.
     spec_local = specifier.decode("utf-8")
-    
+
     # Use the locale-specific lowercasing
     spec_local = spec_local.lower()
 
-    if spec_local in _xlated_bytes():
-        return size
+    factor = _translated()[1].get(spec_local)
+    if factor is not None:
+        return size * factor
 
-    for factor, prefix, abbr in _xlated_prefixes():
-        check  = _makeSpecs(prefix, abbr, True)
+    raise ValueError("invalid size specification", spec)
 
-        if spec_local in check:
-            return size * factor
+# numbers of bytes a Size can be created from
+_numberTypes = (int, long, float, Decimal)
 
-    raise ValueError("invalid size specification", spec)
+# sizes below this convert to float without losing precision
+_floatExact = 2**53
+
+def _bytesOf(value):
+    """ Return the number of bytes value stands for, as a plain number. """
+    if type(value) is Size:
+        return value._bytes
 
-class Size(Decimal):
+    return value
+
+class Size(object):
     """ Common class to represent storage device and filesystem sizes.
         Can handle parsing strings such as 45MB or 6.7GB to initialize
         itself, or can be initialized with a numerical size in bytes.
         Also generates human readable strings to a specified number of
         decimal places.
+
+        A Size is a whole number of bytes and compares, hashes and
+        converts like that number. Fractions of a byte, eg: from parsing
+        "0.5 b" or dividing by 3, are dropped. Adding, subtracting,
+        multiplying or dividing a Size gives a Size, every other operation
+        gives a plain number.
     """
+    __slots__ = ("_bytes",)
 
     def __new__(cls, bytes=None,  spec=None):
         """ Initialize a new Size object.  Must pass either bytes or spec,
@@ -204,48 +252,159 @@ class Size(Decimal):
             raise SizeParamsError("only specify one parameter")
 
         if bytes is not None:
-            if type(bytes).__name__ in ["int", "long", "float", 'Decimal'] and bytes >= 0:
-                self = Decimal.__new__(cls, value=bytes)
+            bytes = _bytesOf(bytes)
+            if isinstance(bytes, _numberTypes) and \
+               not isinstance(bytes, bool) and bytes >= 0:
+                value = long(bytes)
             else:
                 raise SizeNotPositiveError("bytes= param must be >=0")
         elif spec:
-            self = Decimal.__new__(cls, value=_parseSpec(spec))
+            value = long(_parseSpec(spec))
         else:
             raise SizeParamsError("missing bytes= or spec=")
 
+        self = object.__new__(cls)
+        self._bytes = value
         return self
 
-    def __str__(self, context=None):
+    def __reduce__(self):
+        return (_size, (self._bytes,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __str__(self):
         return self.humanReadable()
 
     def __repr__(self):
         return "Size('%s')" % self
 
-    def __add__(self, other, context=None):
-        return Size(bytes=Decimal.__add__(self, other, context=context))
+    #
+    # conversions
+    #
+    def __int__(self):
+        return int(self._bytes)
+
+    def __long__(self):
+        return self._bytes
+
+    def __float__(self):
+        return float(self._bytes)
+
+    def __index__(self):
+        return self._bytes
+
+    def __trunc__(self):
+        return self._bytes
+
+    def __nonzero__(self):
+        return self._bytes != 0
+
+    def __hash__(self):
+        return hash(self._bytes)
+
+    #
+    # comparisons
+    #
+    def __eq__(self, other):
+        return self._bytes == _bytesOf(other)
+
+    def __ne__(self, other):
+        return self._bytes != _bytesOf(other)
+
+    def __lt__(self, other):
+        if other is None:
+            return False
+        return self._bytes < _bytesOf(other)
+
+    def __le__(self, other):
+        if other is None:
+            return False
+        return self._bytes <= _bytesOf(other)
+
+    def __gt__(self, other):
+        if other is None:
+            return True
+        return self._bytes > _bytesOf(other)
+
+    def __ge__(self, other):
+        if other is None:
+            return True
+        return self._bytes >= _bytesOf(other)
+
+    #
+    # arithmetic
+    #
+    def __add__(self, other):
+        return _size(self._bytes + _bytesOf(other))
 
     # needed to make sum() work with Size arguments
-    def __radd__(self, other, context=None):
-        return Size(bytes=Decimal.__radd__(self, other, context=context))
+    def __radd__(self, other):
+        return _size(other + self._bytes)
+
+    def __sub__(self, other):
+        return _size(self._bytes - _bytesOf(other))
+
+    def __rsub__(self, other):
+        return other - self._bytes
+
+    def __mul__(self, other):
+        return _size(self._bytes * _bytesOf(other))
+
+    def __rmul__(self, other):
+        return other * self._bytes
+
+    def __div__(self, other):
+        other = _bytesOf(other)
+        if isinstance(other, (int, long)):
+            # a whole number of bytes either way
+            if other == 0:
+                raise ZeroDivisionError("division by zero")
+            return _size(self._bytes // other)
+
+        return _size(self._bytes / other)
+
+    __truediv__ = __div__
+
+    def __rdiv__(self, other):
+        if isinstance(other, (int, long)):
+            other = Decimal(other)
+        return other / self._bytes
 
-    def __sub__(self, other, context=None):
-        # subtraction is implemented using __add__ and negation, so we'll
-        # be getting passed a Size
-        return Decimal.__sub__(self, other, context=context)
+    __rtruediv__ = __rdiv__
 
-    def __mul__(self, other, context=None):
-        return Size(bytes=Decimal.__mul__(self, other, context=context))
+    def __floordiv__(self, other):
+        return self._bytes // _bytesOf(other)
 
-    def __div__(self, other, context=None):
-        return Size(bytes=Decimal.__div__(self, other, context=context))
+    def __rfloordiv__(self, other):
+        return other // self._bytes
 
-    def _trimEnd(self, val):
-        """ Internal method to trim trailing zeros. """
-        val = re.sub(r'(\.\d*?)0+$', '\\1', val)
-        while val.endswith('.'):
-            val = val[:-1]
+    def __mod__(self, other):
+        return self._bytes % _bytesOf(other)
 
-        return val
+    def __rmod__(self, other):
+        return other % self._bytes
+
+    def __divmod__(self, other):
+        return divmod(self._bytes, _bytesOf(other))
+
+    def __rdivmod__(self, other):
+        return divmod(other, self._bytes)
+
+    def __pow__(self, other):
+        return self._bytes ** _bytesOf(other)
+
+    def __neg__(self):
+        return -self._bytes
+
+    def __pos__(self):
+        return self._bytes
+
+    def __abs__(self):
+        return self._bytes
 
     def convertTo(self, spec="b"):
         """ Return the size in the units indicated by the specifier.  The
@@ -259,13 +418,11 @@ class Size(Decimal):
         if spec in _bytes:
             return self
 
-        for factor, prefix, abbr in _prefixes:
-            check = _makeSpecs(prefix, abbr, False)
-
-            if spec in check:
-                return Decimal(self / Decimal(factor))
+        factor = _specFactorsASCII.get(spec)
+        if factor is None or factor == 1:
+            return None
 
-        return None
+        return Decimal(self._bytes) / Decimal(factor)
 
     def humanReadable(self, places=None, max_places=2):
         """ Return a string representation of this size with appropriate
@@ -278,25 +435,27 @@ class Size(Decimal):
         if max_places is not None and max_places < 0:
             raise SizePlacesError("max_places= must be >=0 or None")
 
-        check = self._trimEnd("%d" % self)
+        value = self._bytes
+        if value < 1000:
+            return "%d B" % value
 
-        if Decimal(check) < 1000:
-            return "%s B" % check
-
-        for factor, prefix, abbr in _xlated_prefixes():
-            newcheck = super(Size, self).__div__(Decimal(factor))
-
-            if newcheck < 1000:
+        (prefixes, specs, byte_abbr) = _translated()
+        for factor, prefix, abbr in prefixes:
+            if value < factor * 1000:
                 # nice value, use this factor, prefix and abbr
                 break
 
+        if value < _floatExact:
+            newcheck = float(value) / factor
+        else:
+            newcheck = float(Decimal(value) / Decimal(factor))
+
         # Format the value with '.' as the decimal separator
         # If necessary, substitute with a localized separator before returning
         if places is not None:
-            fmt = "%%.%df" % places
-            retval = fmt % newcheck
+            retval = "%.*f" % (places, newcheck)
         else:
-            retval = self._trimEnd("%f" % newcheck)
+            retval = ("%f" % newcheck).rstrip("0").rstrip(".")
 
         if max_places is not None:
             (whole, point, fraction) = retval.partition(".")
@@ -311,6 +470,17 @@ class Size(Decimal):
             retval = retval.replace('.', radix)
 
         if abbr:
-            return retval + " " + abbr + _("B").decode("utf-8")
+            return retval + " " + abbr + byte_abbr
         else:
             return retval + " " + prefix + P_("byte", "bytes", newcheck).decode("utf-8")
+
+_newSize = object.__new__
+
+def _size(value):
+    """ Return the result of an arithmetic operation as a Size. """
+    if value < 0:
+        raise SizeNotPositiveError("bytes= param must be >=0")
+
+    size = _newSize(Size)
+    size._bytes = value if type(value) in (int, long) else long(value)
+    return size
@@ -0,0 +1,123 @@
+# snapshot.py
+# Cheap snapshots of a device tree's state.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" Snapshots of device, format and action attributes.
+
+    A Snapshot saves the attributes of a set of objects instead of copying
+    the objects themselves, so the objects keep their identity and a trial
+    change can be undone by putting the saved attributes back. The
+    attributes are saved one level deep: lists, dicts and sets are copied,
+    everything else is shared. Devices, formats and actions referred to by
+    a saved object are saved along with it.
+
+    The only parted objects that get copied are the partition tables of
+    disklabels, which partitioning changes in place.
+"""
+
+from devices import Device, PartitionDevice
+from deviceindex import ParentList
+from deviceaction import DeviceAction
+from formats import DeviceFormat
+from formats.disklabel import DiskLabel
+
+import logging
+log = logging.getLogger("blivet")
+
+# objects whose references get followed
+_tracked = (Device, DeviceFormat, DeviceAction)
+
+# values that can neither change nor refer to anything that gets followed
+_plain = frozenset([str, unicode, int, long, float, bool, type(None)])
+
+_containers = {list: list, dict: dict, set: set, ParentList: ParentList.copy}
+
+def _copy_state(state):
+    """ Return a copy of an object's attributes, one level deep. """
+    copy = {}
+    for (attr, value) in state.items():
+        container = _containers.get(type(value))
+        copy[attr] = value if container is None else container(value)
+
+    return copy
+
+def _references(state):
+    """ Return a list of the tracked objects the values in state refer to. """
+    found = []
+    for value in state.values():
+        value_type = type(value)
+        if value_type in _plain:
+            continue
+        elif value_type is dict:
+            values = value.values()
+        elif value_type in (list, tuple, set, ParentList):
+            values = value
+        else:
+            values = [value]
+
+        found.extend(v for v in values if isinstance(v, _tracked))
+
+    return found
+
+class Snapshot(object):
+    """ The saved attributes of some objects and what they refer to. """
+    def __init__(self, objects):
+        self._states = []       # (object, attributes)
+        self._disks = []        # (disklabel, duplicate of its partedDisk)
+        seen = set()
+        pending = list(objects)
+        while pending:
+            obj = pending.pop()
+            if id(obj) in seen:
+                continue
+
+            seen.add(id(obj))
+            state = _copy_state(obj.__dict__)
+            self._states.append((obj, state))
+            pending.extend(_references(state))
+
+            if isinstance(obj, DiskLabel) and obj._partedDisk:
+                self._disks.append((obj, obj._partedDisk.duplicate()))
+
+        log.debug("saved the state of %d objects" % len(self._states))
+
+    def restore(self):
+        """ Put back the attributes of every object in the snapshot.
+
+            A snapshot can be restored any number of times.
+        """
+        for (obj, state) in self._states:
+            obj.__dict__.clear()
+            obj.__dict__.update(_copy_state(state))
+
+        for (disklabel, partedDisk) in self._disks:
+            disklabel._partedDisk = partedDisk.duplicate()
+
+        # the partitions have to be looked up again on the new partedDisks
+        labels = set(id(d) for (d, p) in self._disks)
+        for (obj, state) in self._states:
+            if not isinstance(obj, PartitionDevice) or \
+               not obj._partedPartition or \
+               id(obj.disk.format) not in labels:
+                continue
+
+            partedDisk = obj.disk.format.partedDisk
+            obj.partedPartition = partedDisk.getPartitionByPath(obj.path)
+
+        log.debug("restored the state of %d objects" % len(self._states))
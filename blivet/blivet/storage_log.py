@@ -1,23 +1,105 @@
-import inspect
+import sys
+import time
+import functools
+import threading
 import logging
 
 log = logging.getLogger("blivet")
 log.addHandler(logging.NullHandler())
 
-def function_name_and_depth():
-    IGNORED_FUNCS = ["function_name_and_depth",
-                     "log_method_call",
-                     "log_method_return"]
-    stack = inspect.stack()
+IGNORED_FUNCS = ["function_name_and_depth",
+                 "log_method_call",
+                 "log_method_return"]
+
+# per-method call counts and times, see enable_method_stats
+_stats = None           # "Class.method" -> [calls, seconds]
+_stats_lock = threading.Lock()
+
+def _frame_depth(frame):
+    depth = 0
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
 
-    for i, frame in enumerate(stack):
-        methodname = frame[3]
+    return depth
+
+def function_name_and_depth():
+    frame = sys._getframe(1)
+    while frame is not None:
+        methodname = frame.f_code.co_name
         if methodname not in IGNORED_FUNCS:
-            return (methodname, len(stack) - i)
+            return (methodname, _frame_depth(frame))
+
+        frame = frame.f_back
 
     return ("unknown function?", 0)
 
+def _stats_entry(d, methodname):
+    """ Return the stats entry of a method, _stats_lock must be held. """
+    key = "%s.%s" % (d.__class__.__name__, methodname)
+    return _stats.setdefault(key, [0, 0.0])
+
+def timed_method(func):
+    """ Add the time calls to a method take to its stats.
+
+        Meant for the few entry points worth timing, like populate and
+        processActions; the calls themselves are counted by
+        log_method_call.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if _stats is None:
+            return func(self, *args, **kwargs)
+
+        start = time.time()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            with _stats_lock:
+                if _stats is not None:
+                    _stats_entry(self, func.__name__)[1] += elapsed
+
+    return wrapper
+
+def enable_method_stats():
+    """ Start counting calls to methods that log their calls.
+
+        Calls to log_method_call get counted per class and method name in
+        every thread. Only methods wrapped in timed_method have their time
+        added up.
+    """
+    global _stats
+    with _stats_lock:
+        _stats = {}
+
+def disable_method_stats():
+    """ Stop counting and timing method calls. """
+    global _stats
+    with _stats_lock:
+        _stats = None
+
+def method_stats():
+    """ Return a dict of "Class.method" -> (calls, seconds) so far. """
+    with _stats_lock:
+        return dict((k, tuple(v)) for (k, v) in (_stats or {}).items())
+
+def log_method_stats(limit=20):
+    """ Log the limit methods that took the most time so far. """
+    stats = sorted(method_stats().items(), key=lambda s: s[1][1], reverse=True)
+    for (method, (calls, seconds)) in stats[:limit]:
+        log.info("%s: %d calls, %.3fs" % (method, calls, seconds))
+
 def log_method_call(d, *args, **kwargs):
+    if _stats is not None:
+        methodname = sys._getframe(1).f_code.co_name
+        with _stats_lock:
+            if _stats is not None:
+                _stats_entry(d, methodname)[0] += 1
+
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+
     classname = d.__class__.__name__
     (methodname, depth) = function_name_and_depth()
     spaces = depth * ' '
@@ -34,13 +116,15 @@ def log_method_call(d, *args, **kwargs):
             v = "Skipped"
         fmt_args.extend([k, v])
 
-    logging.getLogger("blivet").debug(fmt % tuple(fmt_args))
+    log.debug(fmt % tuple(fmt_args))
 
 def log_method_return(d, retval):
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+
     classname = d.__class__.__name__
     (methodname, depth) = function_name_and_depth()
     spaces = depth * ' '
     fmt = "%s%s.%s returned %s"
     fmt_args = (spaces, classname, methodname, retval)
-    logging.getLogger("blivet").debug(fmt % fmt_args)
-
+    log.debug(fmt % fmt_args)
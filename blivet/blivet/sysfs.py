@@ -0,0 +1,157 @@
+# sysfs.py
+# Cached reads of sysfs attributes.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" Per-device cache of sysfs attributes.
+
+    Device discovery looks at the same few small sysfs files of every
+    device over and over: whether it is read-only, its model, an md
+    array's state, whether it has a "range" or "start" attribute, and so
+    on. While the cache is loaded, each attribute of a device is read at
+    most once and kept in a record for the device, so asking again costs
+    no file I/O. Outside of that, every call reads sysfs directly.
+
+    DeviceTree loads the cache for each pass over the devices when it
+    populates, which makes each pass a new generation of records. The
+    record of a device is dropped when a uevent for it is received or
+    sysfs_cache_refresh is called for it.
+
+    Devices are named by their sysfs paths, with or without the leading
+    "/sys", eg: "/devices/virtual/block/dm-0" or "/class/block/sda".
+"""
+
+import os
+import threading
+
+import logging
+log = logging.getLogger("blivet")
+
+class _Record(object):
+    """ The attributes of one device read so far. """
+    __slots__ = ["values", "exists"]
+
+    def __init__(self):
+        self.values = {}        # attribute -> stripped contents, or None
+        self.exists = {}        # attribute -> True/False
+
+_SYSFS_ROOT = "/sys"
+
+_records = None                 # sysfs path -> _Record, None if not loaded
+_records_lock = threading.Lock()
+_stats = {"reads": 0, "hits": 0}
+
+def _key(sysfs_path):
+    if sysfs_path.startswith("/sys/"):
+        sysfs_path = sysfs_path[4:]
+
+    return os.path.normpath("/" + sysfs_path.lstrip("/"))
+
+def _record(key):
+    records = _records
+    if records is None:
+        return None
+
+    record = records.get(key)
+    if record is None:
+        with _records_lock:
+            record = records.setdefault(key, _Record())
+
+    return record
+
+def _read(path):
+    _stats["reads"] += 1
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+def sysfs_cache_load():
+    """ Start caching attributes, forgetting anything read before. """
+    global _records
+    _records = {}
+
+def sysfs_cache_invalidate():
+    """ Stop caching attributes. """
+    global _records
+    _records = None
+
+def sysfs_cache_refresh(sysfs_path=None):
+    """ Forget the cached attributes of one device, or of all of them.
+
+        Devices are also known by their /class/block/<name> paths, so
+        refreshing a device drops the record kept under that path too.
+    """
+    records = _records
+    if records is None:
+        return
+
+    if sysfs_path is None:
+        records.clear()
+        return
+
+    key = _key(sysfs_path)
+    for k in (key, "/class/block/%s" % os.path.basename(key)):
+        records.pop(k, None)
+
+def sysfs_cache_stats():
+    """ Return a dict of counters for the attribute lookups so far.
+
+        reads -- lookups that went to sysfs
+        hits -- lookups answered from the cache
+    """
+    return dict(_stats)
+
+def get_attr(sysfs_path, attr):
+    """ Return the stripped contents of a device's sysfs attribute.
+
+        Arguments:
+
+            sysfs_path -- the device's sysfs path
+            attr -- the attribute, relative to the device's directory,
+                    eg: "size" or "queue/logical_block_size"
+
+        Returns None if the attribute does not exist or can not be read.
+    """
+    key = _key(sysfs_path)
+    record = _record(key)
+    if record is not None and attr in record.values:
+        _stats["hits"] += 1
+        return record.values[attr]
+
+    value = _read("%s%s/%s" % (_SYSFS_ROOT, key, attr))
+    if record is not None:
+        record.values[attr] = value
+
+    return value
+
+def has_attr(sysfs_path, attr):
+    """ Return True if a device has a sysfs attribute or subdirectory. """
+    key = _key(sysfs_path)
+    record = _record(key)
+    if record is not None and attr in record.exists:
+        _stats["hits"] += 1
+        return record.exists[attr]
+
+    _stats["reads"] += 1
+    exists = os.path.exists("%s%s/%s" % (_SYSFS_ROOT, key, attr))
+    if record is not None:
+        record.exists[attr] = exists
+
+    return exists
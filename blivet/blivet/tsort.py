@@ -24,38 +24,43 @@ class CyclicGraphError(Exception):
     pass
 
 def tsort(graph):
+    """ Return the items of graph in topological order.
+
+        Runs in time linear in the number of items and edges. Items are
+        taken from a stack of nodes without incoming edges, which starts
+        out in the order of graph['items'], and the children of each item
+        are visited in the order their edges appear in graph['edges'].
+        The graph is not modified.
+    """
     order = []  # sorted list of items
 
     if not graph or not graph['items']:
         return order
 
+    incoming = graph['incoming'].copy()
+    children = dict((n, []) for n in graph['items'])
+    for (parent, child) in graph['edges']:
+        children[parent].append(child)
+
     # determine which nodes have no incoming edges
-    roots = [n for n in graph['items'] if graph['incoming'][n] == 0]
+    roots = [n for n in graph['items'] if incoming[n] == 0]
     if not roots:
         raise CyclicGraphError("no root nodes")
 
-    visited = []    # list of nodes visited, for cycle detection
     while roots:
         # remove a root, add it to the order
         root = roots.pop()
-        if root in visited:
-            raise CyclicGraphError("graph contains cycles")
-
-        visited.append(root)
-        i = graph['items'].index(root)
         order.append(root)
         # remove each edge from the root to another node
-        for (parent, child) in [e for e in graph['edges'] if e[0] == root]:
-            graph['incoming'][child] -= 1
-            graph['edges'].remove((parent, child))
+        for child in children[root]:
+            incoming[child] -= 1
             # if destination node is now a root, add it to roots
-            if graph['incoming'][child] == 0:
+            if incoming[child] == 0:
                 roots.append(child)
 
-    if len(graph['items']) != len(visited):
+    if len(graph['items']) != len(order):
         raise CyclicGraphError("graph contains cycles")
 
-
     return order
 
 def create_graph(items, edges):
@@ -23,8 +23,13 @@
 
 import os
 import re
+import select
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 import util
+import sysfs
 from errors import *
 
 import pyudev
@@ -37,14 +42,22 @@ def udev_enumerate_devices(deviceClass="block"):
     devices = global_udev.enumerate_devices(subsystem=deviceClass)
     return [path[4:] for path in devices]
 
-def udev_get_device(sysfs_path):
+def udev_get_device(sysfs_path, udev=None):
+    """ Return a dict of udev data for the device at sysfs_path.
+
+        udev is the pyudev.Udev context to use, global_udev by default.
+        Contexts must not be shared between threads.
+    """
     if not os.path.exists("/sys%s" % sysfs_path):
         log.debug("%s does not exist" % sysfs_path)
         return None
 
+    if udev is None:
+        udev = global_udev
+
     # XXX we remove the /sys part when enumerating devices,
     # so we have to prepend it when creating the device
-    dev = global_udev.create_device("/sys" + sysfs_path)
+    dev = udev.create_device("/sys" + sysfs_path)
 
     if dev:
         dev["name"] = dev.sysname
@@ -79,11 +92,99 @@ def udev_parse_uevent_file(dev):
 
     return dev
 
+# udev_settle bookkeeping
+#
+# Forking udevadm is skipped when udev's queue is empty and the kernel has
+# not sent any uevents since the last settle finished. Inside a
+# udev_settle_scope, settling is put off until the outermost scope exits.
+_UEVENT_SEQNUM = "/sys/kernel/uevent_seqnum"
+_UDEV_QUEUE_FILES = ["/run/udev/queue", "/run/udev/queue.bin"]
+
+_settle_lock = threading.Lock()
+_settle_seqnum = None       # uevent seqnum from before the last good settle
+_settle_stats = {"requested": 0, "run": 0, "skipped": 0, "deferred": 0}
+# only guards the counters, so that counting a call never waits for a settle
+_settle_stats_lock = threading.Lock()
+_settle_scope = threading.local()
+
+def _udev_uevent_seqnum():
+    try:
+        with open(_UEVENT_SEQNUM) as f:
+            return int(f.read().strip())
+    except (IOError, ValueError):
+        return None
+
+def udev_queue_is_idle():
+    """ Return True if udev has no uevents left to process. """
+    return not any(os.path.exists(f) for f in _UDEV_QUEUE_FILES)
+
+def _count_settle(counter):
+    with _settle_stats_lock:
+        _settle_stats[counter] += 1
+
 def udev_settle():
-    # wait maximal 300 seconds for udev to be done running blkid, lvm,
-    # mdadm etc. This large timeout is needed when running on machines with
-    # lots of disks, or with slow disks
-    util.run_program(["udevadm", "settle", "--timeout=300"])
+    _count_settle("requested")
+    if getattr(_settle_scope, "depth", 0):
+        _settle_scope.pending = True
+        _count_settle("deferred")
+        return
+
+    _udev_settle()
+
+def _udev_settle():
+    global _settle_seqnum
+
+    # holding the lock while settling means concurrent callers wait for
+    # the running settle and then find nothing left to do
+    with _settle_lock:
+        seqnum = _udev_uevent_seqnum()
+        if seqnum is not None and seqnum == _settle_seqnum and \
+           udev_queue_is_idle():
+            _count_settle("skipped")
+            return
+
+        _count_settle("run")
+        # wait maximal 300 seconds for udev to be done running blkid, lvm,
+        # mdadm etc. This large timeout is needed when running on machines
+        # with lots of disks, or with slow disks
+        rc = util.run_program(["udevadm", "settle", "--timeout=300"])
+        if rc == 0:
+            _settle_seqnum = seqnum
+        else:
+            _settle_seqnum = None
+
+@contextmanager
+def udev_settle_scope():
+    """ Coalesce the udev_settle calls made in a block into one.
+
+        The settle happens when the outermost scope of the thread exits, if
+        any was asked for. Only use this around code that does not need
+        udev to have caught up before the block ends, eg: a series of
+        independent device activations.
+    """
+    depth = getattr(_settle_scope, "depth", 0)
+    if depth == 0:
+        _settle_scope.pending = False
+
+    _settle_scope.depth = depth + 1
+    try:
+        yield
+    finally:
+        _settle_scope.depth = depth
+        if depth == 0 and _settle_scope.pending:
+            _settle_scope.pending = False
+            _udev_settle()
+
+def udev_settle_stats():
+    """ Return a dict of counters for the udev_settle calls made so far.
+
+        requested -- calls to udev_settle
+        run -- times udevadm settle actually ran
+        skipped -- settles skipped because there was nothing to wait for
+        deferred -- calls folded into the settle at the end of a scope
+    """
+    with _settle_stats_lock:
+        return dict(_settle_stats)
 
 def udev_trigger(subsystem=None, action="add", name=None):
     argv = ["trigger", "--action=%s" % action]
@@ -95,6 +196,42 @@ def udev_trigger(subsystem=None, action="add", name=None):
     util.run_program(["udevadm"] + argv)
     udev_settle()
 
+def udev_monitor_block_devices():
+    """ Return a pyudev.UdevMonitor for block device uevents.
+
+        Pass it to udev_get_uevents to collect the events udev has finished
+        processing since the monitor was created.
+    """
+    return global_udev.create_monitor(subsystem="block")
+
+def udev_get_uevents(monitor, timeout=0):
+    """ Return a list of udev data dicts for the pending uevents.
+
+        Waits up to timeout seconds (None means forever) for the first
+        event, then collects whatever else is already queued. Each dict
+        has the same "name" and "sysfs_path" keys udev_get_device sets and
+        the event type in "ACTION". The devices of remove events are gone
+        from sysfs, so the dicts only carry what came with the uevent.
+    """
+    events = []
+    while True:
+        (ready, _w, _x) = select.select([monitor], [], [], timeout)
+        if not ready:
+            break
+
+        dev = monitor.receive_device()
+        timeout = 0
+        if not dev:
+            continue
+
+        dev["name"] = dev.sysname
+        dev["sysfs_path"] = dev.devpath
+        sysfs.sysfs_cache_refresh(dev.devpath)
+        dev.setdefault("ACTION", dev.action)
+        events.append(dev)
+
+    return events
+
 def udev_resolve_devspec(devspec):
     if not devspec:
         return None
@@ -154,32 +291,79 @@ def udev_resolve_glob(glob):
 
     return ret
 
-def udev_get_block_devices():
+def udev_get_block_devices(skip=None, threads=None):
+    """ Return a list of udev data dicts for the system's block devices.
+
+        Keyword Arguments:
+
+            skip -- container of names of devices to leave out, eg: the
+                    devices found by an earlier call
+            threads -- number of threads to collect the devices' udev and
+                       sysfs data with; None or 0 means do it serially
+
+        The list is in udev's enumeration order either way.
+    """
     udev_settle()
-    entries = []
-    for path in udev_enumerate_block_devices():
-        entry = udev_get_block_device(path)
-        if entry:
-            if entry["name"].startswith("md"):
-                # mdraid is really braindead, when a device is stopped
-                # it is no longer usefull in anyway (and we should not
-                # probe it) yet it still sticks around, see bug rh523387
-                state = None
-                state_file = "/sys/%s/md/array_state" % entry["sysfs_path"]
-                if os.access(state_file, os.R_OK):
-                    state = open(state_file).read().strip()
-                if state == "clear":
-                    continue
-            entries.append(entry)
-    return entries
+    paths = udev_enumerate_devices(deviceClass="block")
+    if skip:
+        # udev reports names with "!" (eg: cciss) as "/"
+        paths = [p for p in paths
+                    if os.path.basename(p).replace("!", "/") not in skip]
+
+    if threads and len(paths) > 1:
+        # each thread gets its own contiguous share of the devices and its
+        # own udev context
+        threads = min(threads, len(paths))
+        chunk_size = (len(paths) + threads - 1) / threads
+        chunks = [paths[i:i + chunk_size]
+                    for i in range(0, len(paths), chunk_size)]
+        pool = ThreadPool(len(chunks))
+        try:
+            results = pool.map(_udev_get_block_device_entries, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+        entries = [e for result in results for e in result]
+    else:
+        entries = [_udev_get_block_device_entry(p) for p in paths]
+
+    return [e for e in entries if e]
+
+def _udev_get_block_device_entries(paths):
+    """ Return a list of entries for paths, using a private udev context. """
+    udev = pyudev.Udev()
+    try:
+        return [_udev_get_block_device_entry(p, udev=udev) for p in paths]
+    finally:
+        udev.unref()
+
+def _udev_get_block_device_entry(path, udev=None):
+    """ Return the udev data for one device as udev_get_block_devices wants it.
+
+        Returns None for blacklisted devices and stopped md arrays.
+    """
+    if __is_blacklisted_blockdev(os.path.basename(path)):
+        return None
+
+    entry = udev_get_block_device(path, udev=udev)
+    if entry and entry["name"].startswith("md"):
+        # mdraid is really braindead, when a device is stopped
+        # it is no longer usefull in anyway (and we should not
+        # probe it) yet it still sticks around, see bug rh523387
+        state = sysfs.get_attr(entry["sysfs_path"], "md/array_state")
+        if state == "clear":
+            return None
+
+    return entry
 
 def __is_blacklisted_blockdev(dev_name):
     """Is this a blockdev we never want for an install?"""
     if dev_name.startswith("ram") or dev_name.startswith("fd"):
         return True
 
-    if os.path.exists("/sys/class/block/%s/device/model" %(dev_name,)):
-        model = open("/sys/class/block/%s/device/model" %(dev_name,)).read()
+    model = sysfs.get_attr("/class/block/%s" % dev_name, "device/model")
+    if model:
         for bad in ("IBM *STMF KERNEL", "SCEI Flash-5", "DGC LUNZ"):
             if model.find(bad) != -1:
                 log.info("ignoring %s with model %s" %(dev_name, model))
@@ -193,8 +377,8 @@ def udev_enumerate_block_devices():
     return filter(lambda d: not __is_blacklisted_blockdev(os.path.basename(d)),
                   udev_enumerate_devices(deviceClass="block"))
 
-def udev_get_block_device(sysfs_path):
-    dev = udev_get_device(sysfs_path)
+def udev_get_block_device(sysfs_path, udev=None):
+    dev = udev_get_device(sysfs_path, udev=udev)
     if not dev or not dev.has_key("name"):
         return None
     else:
@@ -241,8 +425,7 @@ def udev_device_is_md(info):
 
     # The udev information keeps shifting around. Only md arrays have a
     # /sys/class/block/<name>/md/ subdirectory.
-    md_dir = "/sys" + udev_device_get_sysfs_path(info) + "/md"
-    return os.path.exists(md_dir)
+    return sysfs.has_attr(udev_device_get_sysfs_path(info), "md")
 
 def udev_device_is_cciss(info):
     """ Return True if the device is a CCISS device. """
@@ -323,17 +506,17 @@ def udev_device_is_disk(info):
     """ Return True is the device is a disk. """
     if udev_device_is_cdrom(info):
         return False
-    has_range = os.path.exists("/sys/%s/range" % info['sysfs_path'])
+    has_range = sysfs.has_attr(info['sysfs_path'], "range")
     return info.get("DEVTYPE") == "disk" or has_range
 
 def udev_device_is_partition(info):
-    has_start = os.path.exists("/sys/%s/start" % info['sysfs_path'])
+    has_start = sysfs.has_attr(info['sysfs_path'], "start")
     return info.get("DEVTYPE") == "partition" or has_start
 
 def udev_device_is_loop(info):
     """ Return True if the device is a configured loop device. """
     return (udev_device_get_name(info).startswith("loop") and
-            os.path.isdir("/sys/%s/loop" % info['sysfs_path']))
+            sysfs.has_attr(info['sysfs_path'], "loop"))
 
 def udev_device_get_serial(udev_info):
     """ Get the serial number/UUID from the device as reported by udev. """
@@ -373,6 +556,32 @@ def udev_device_get_by_path(info):
 def udev_device_get_sysfs_path(info):
     return info['sysfs_path']
 
+def udev_device_get_devnode(info):
+    """ Return the device node of the kernel device, eg: /dev/dm-0. """
+    devnode = info.get("DEVNAME")
+    if not devnode:
+        devnode = info["name"]
+    if not devnode.startswith("/dev/"):
+        devnode = "/dev/" + devnode
+    return devnode
+
+def udev_device_get_action(info):
+    """ Return the type of the uevent info came with, if any. """
+    return info.get("ACTION")
+
+def udev_device_get_slaves(info):
+    """ Return the sysfs paths of the devices info's device is built on. """
+    sysfs_path = info["sysfs_path"]
+    slaves_dir = "/sys%s/slaves" % sysfs_path
+    try:
+        names = os.listdir(slaves_dir)
+    except OSError:
+        return []
+
+    return [os.path.normpath("%s/slaves/%s"
+                             % (sysfs_path, os.readlink(slaves_dir + "/" + n)))
+                for n in names]
+
 def udev_device_get_major(info):
     return int(info["MAJOR"])
 
@@ -11,50 +11,130 @@ log = logging.getLogger("blivet")
 program_log = logging.getLogger("program")
 
 from threading import Lock
+from multiprocessing.pool import ThreadPool
 # this will get set to anaconda's program_log_lock in enable_installer_mode
 program_log_lock = Lock()
 
-def _run_program(argv, root='/', stdin=None, env_prune=None):
-    if env_prune is None:
-        env_prune = []
+# how many commands run_programs runs at a time by default
+PROGRAM_BATCH_THREADS = 8
 
-    def chroot():
-        if root and root != '/':
-            os.chroot(root)
+def _program_env(root, env_prune):
+    """ Return a new environment to run programs in. """
+    env = os.environ.copy()
+    env.update({"LC_ALL": "C",
+                "INSTALL_PATH": root})
+    for var in env_prune:
+        env.pop(var, None)
+
+    return env
 
+def _log_program(log_func, msg):
+    # the lock is only held per line so that programs can run concurrently
     with program_log_lock:
-        program_log.info("Running... %s" % " ".join(argv))
+        log_func(msg)
 
-        env = os.environ.copy()
-        env.update({"LC_ALL": "C",
-                    "INSTALL_PATH": root})
-        for var in env_prune:
-            env.pop(var, None)
+def _read_program_output(proc, output_callback):
+    """ Read proc's output until it ends, passing each line to output_callback
+        as soon as it is complete. Lines may also end in a carriage return,
+        the way progress output is written.
+    """
+    chunks = []
+    pending = ""
+    while True:
+        data = os.read(proc.stdout.fileno(), 4096)
+        if not data:
+            break
 
-        try:
-            proc = subprocess.Popen(argv,
-                                    stdin=stdin,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT,
-                                    close_fds=True,
-                                    preexec_fn=chroot, cwd=root, env=env)
+        chunks.append(data)
+        lines = re.split(r"[\r\n]", pending + data)
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                output_callback(line)
 
-            out = proc.communicate()[0]
-            if out:
-                for line in out.splitlines():
-                    program_log.info(line)
+    if pending:
+        output_callback(pending)
 
-        except OSError as e:
-            program_log.error("Error running %s: %s" % (argv[0], e.strerror))
-            raise
+    proc.wait()
+    return "".join(chunks)
 
-        program_log.debug("Return code: %d" % proc.returncode)
+def _run_program(argv, root='/', stdin=None, env_prune=None,
+                 output_callback=None):
+    if env_prune is None:
+        env_prune = []
+
+    def chroot():
+        os.chroot(root)
 
+    # only run python code in the child if we have to
+    preexec_fn = None
+    if root and root != '/':
+        preexec_fn = chroot
+
+    _log_program(program_log.info, "Running... %s" % " ".join(argv))
+    env = _program_env(root, env_prune)
+    try:
+        proc = subprocess.Popen(argv,
+                                stdin=stdin,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                close_fds=True,
+                                preexec_fn=preexec_fn, cwd=root, env=env)
+
+        if output_callback is None:
+            out = proc.communicate()[0]
+        else:
+            out = _read_program_output(proc, output_callback)
+    except OSError as e:
+        _log_program(program_log.error,
+                     "Error running %s: %s" % (argv[0], e.strerror))
+        raise
+
+    if out:
+        for line in out.splitlines():
+            _log_program(program_log.info, line)
+
+    _log_program(program_log.debug, "Return code: %d" % proc.returncode)
     return (proc.returncode, out)
 
 def run_program(*args, **kwargs):
     return _run_program(*args, **kwargs)[0]
 
+def run_programs(argvs, threads=None, root='/', env_prune=None):
+    """ Run independent programs concurrently.
+
+        Arguments:
+
+            argvs -- a list of argument lists, one per program
+
+        Keyword Arguments:
+
+            threads -- how many programs to run at a time, by default
+                       PROGRAM_BATCH_THREADS
+            root -- as for run_program, used for all of the programs
+            env_prune -- as for run_program, used for all of the programs
+
+        Returns a list of (returncode, output) tuples in the order of argvs.
+        If any of the programs can not be run, the OSError is raised once
+        the others are done.
+    """
+    if threads is None:
+        threads = PROGRAM_BATCH_THREADS
+
+    threads = min(threads, len(argvs))
+    if threads <= 1:
+        return [_run_program(argv, root=root, env_prune=env_prune)
+                    for argv in argvs]
+
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(lambda argv: _run_program(argv, root=root,
+                                                  env_prune=env_prune),
+                        argvs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
 def capture_output(*args, **kwargs):
     return _run_program(*args, **kwargs)[1]
 
@@ -21,6 +21,8 @@
 
 import string
 import os
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from udev import udev_settle
 from . import util
 from .i18n import _
@@ -38,6 +40,9 @@ zfcpsysfs = "/sys/bus/ccw/drivers/zfcp"
 scsidevsysfs = "/sys/bus/scsi/devices"
 zfcpconf = "/etc/zfcp.conf"
 
+# number of zFCP devices (channels) brought up at a time by onlineDevices
+ZFCP_THREADS = 4
+
 class ZFCPDevice:
     def __init__(self, devnum, wwpn, fcplun):
         self.devnum = self.sanitizeDeviceInput(devnum)
@@ -114,93 +119,17 @@ class ZFCPDevice:
 
     def onlineDevice(self):
         online = "%s/%s/online" %(zfcpsysfs, self.devnum)
-        portadd = "%s/%s/port_add" %(zfcpsysfs, self.devnum)
-        portdir = "%s/%s/%s" %(zfcpsysfs, self.devnum, self.wwpn)
-        unitadd = "%s/unit_add" %(portdir)
-        unitdir = "%s/%s" %(portdir, self.fcplun)
-        failed = "%s/failed" %(unitdir)
 
         if not os.path.exists(online):
             log.info("Freeing zFCP device %s" % (self.devnum,))
             util.run_program(["zfcp_cio_free", "-d", self.devnum])
 
-        if not os.path.exists(online):
-            raise ValueError, _(
-                "zFCP device %s not found, not even in device ignore list."
-                %(self.devnum,))
-
-        try:
-            f = open(online, "r")
-            devonline = f.readline().strip()
-            f.close()
-            if devonline != "1":
-                loggedWriteLineToFile(online, "1")
-        except IOError as e:
-            raise ValueError, _("Could not set zFCP device %(devnum)s "
-                                "online (%(e)s).") \
-                              % {'devnum': self.devnum, 'e': e}
-
-        if not os.path.exists(portdir):
-            if os.path.exists(portadd):
-                # older zfcp sysfs interface
-                try:
-                    loggedWriteLineToFile(portadd, self.wwpn)
-                    udev_settle()
-                except IOError as e:
-                    raise ValueError, _("Could not add WWPN %(wwpn)s to zFCP "
-                                        "device %(devnum)s (%(e)s).") \
-                                      % {'wwpn': self.wwpn,
-                                         'devnum': self.devnum,
-                                         'e': e}
-            else:
-                # newer zfcp sysfs interface with auto port scan
-                raise ValueError, _("WWPN %(wwpn)s not found at zFCP device "
-                                    "%(devnum)s.") % {'wwpn': self.wwpn,
-                                                      'devnum': self.devnum}
-        else:
-            if os.path.exists(portadd):
-                # older zfcp sysfs interface
-                log.info("WWPN %(wwpn)s at zFCP device %(devnum)s already "
-                         "there." % {'wwpn': self.wwpn,
-                                     'devnum': self.devnum})
-
-        if not os.path.exists(unitdir):
-            try:
-                loggedWriteLineToFile(unitadd, self.fcplun)
-                udev_settle()
-            except IOError as e:
-                raise ValueError, _("Could not add LUN %(fcplun)s to WWPN "
-                                    "%(wwpn)s on zFCP device %(devnum)s "
-                                    "(%(e)s).") \
-                                  % {'fcplun': self.fcplun, 'wwpn': self.wwpn,
-                                     'devnum': self.devnum, 'e': e}
-        else:
-            raise ValueError, _("LUN %(fcplun)s at WWPN %(wwpn)s on zFCP "
-                                "device %(devnum)s already configured.") \
-                              % {'fcplun': self.fcplun,
-                                 'wwpn': self.wwpn,
-                                 'devnum': self.devnum}
-
-        fail = "0"
-        try:
-            f = open(failed, "r")
-            fail = f.readline().strip()
-            f.close()
-        except IOError as e:
-            raise ValueError, _("Could not read failed attribute of LUN "
-                                "%(fcplun)s at WWPN %(wwpn)s on zFCP device "
-                                "%(devnum)s (%(e)s).") \
-                              % {'fcplun': self.fcplun,
-                                 'wwpn': self.wwpn,
-                                 'devnum': self.devnum,
-                                 'e': e}
-        if fail != "0":
-            self.offlineDevice()
-            raise ValueError, _("Failed LUN %(fcplun)s at WWPN %(wwpn)s on "
-                                "zFCP device %(devnum)s removed again.") \
-                              % {'fcplun': self.fcplun,
-                                 'wwpn': self.wwpn,
-                                 'devnum': self.devnum}
+        _onlineChannel(self.devnum)
+        if _addPort(self.devnum, self.wwpn):
+            udev_settle()
+        _addUnit(self.devnum, self.wwpn, self.fcplun)
+        udev_settle()
+        _checkUnit(self)
 
         return True
 
@@ -312,6 +241,195 @@ class ZFCPDevice:
 
         return True
 
+def _onlineChannel(devnum):
+    online = "%s/%s/online" %(zfcpsysfs, devnum)
+
+    if not os.path.exists(online):
+        raise ValueError, _(
+            "zFCP device %s not found, not even in device ignore list."
+            %(devnum,))
+
+    try:
+        f = open(online, "r")
+        devonline = f.readline().strip()
+        f.close()
+        if devonline != "1":
+            loggedWriteLineToFile(online, "1")
+    except IOError as e:
+        raise ValueError, _("Could not set zFCP device %(devnum)s "
+                            "online (%(e)s).") \
+                          % {'devnum': devnum, 'e': e}
+
+def _addPort(devnum, wwpn):
+    """ Make sure the port is there, returns True if it had to be added. """
+    portadd = "%s/%s/port_add" %(zfcpsysfs, devnum)
+    portdir = "%s/%s/%s" %(zfcpsysfs, devnum, wwpn)
+
+    if not os.path.exists(portdir):
+        if os.path.exists(portadd):
+            # older zfcp sysfs interface
+            try:
+                loggedWriteLineToFile(portadd, wwpn)
+                return True
+            except IOError as e:
+                raise ValueError, _("Could not add WWPN %(wwpn)s to zFCP "
+                                    "device %(devnum)s (%(e)s).") \
+                                  % {'wwpn': wwpn,
+                                     'devnum': devnum,
+                                     'e': e}
+        else:
+            # newer zfcp sysfs interface with auto port scan
+            raise ValueError, _("WWPN %(wwpn)s not found at zFCP device "
+                                "%(devnum)s.") % {'wwpn': wwpn,
+                                                  'devnum': devnum}
+    else:
+        if os.path.exists(portadd):
+            # older zfcp sysfs interface
+            log.info("WWPN %(wwpn)s at zFCP device %(devnum)s already "
+                     "there." % {'wwpn': wwpn,
+                                 'devnum': devnum})
+
+    return False
+
+def _addUnit(devnum, wwpn, fcplun):
+    portdir = "%s/%s/%s" %(zfcpsysfs, devnum, wwpn)
+    unitadd = "%s/unit_add" %(portdir)
+    unitdir = "%s/%s" %(portdir, fcplun)
+
+    if not os.path.exists(unitdir):
+        try:
+            loggedWriteLineToFile(unitadd, fcplun)
+        except IOError as e:
+            raise ValueError, _("Could not add LUN %(fcplun)s to WWPN "
+                                "%(wwpn)s on zFCP device %(devnum)s "
+                                "(%(e)s).") \
+                              % {'fcplun': fcplun, 'wwpn': wwpn,
+                                 'devnum': devnum, 'e': e}
+    else:
+        raise ValueError, _("LUN %(fcplun)s at WWPN %(wwpn)s on zFCP "
+                            "device %(devnum)s already configured.") \
+                          % {'fcplun': fcplun,
+                             'wwpn': wwpn,
+                             'devnum': devnum}
+
+def _checkUnit(device):
+    """ Take the LUN of device offline again if it failed to come up. """
+    failed = "%s/%s/%s/%s/failed" %(zfcpsysfs, device.devnum, device.wwpn,
+                                    device.fcplun)
+
+    fail = "0"
+    try:
+        f = open(failed, "r")
+        fail = f.readline().strip()
+        f.close()
+    except IOError as e:
+        raise ValueError, _("Could not read failed attribute of LUN "
+                            "%(fcplun)s at WWPN %(wwpn)s on zFCP device "
+                            "%(devnum)s (%(e)s).") \
+                          % {'fcplun': device.fcplun,
+                             'wwpn': device.wwpn,
+                             'devnum': device.devnum,
+                             'e': e}
+    if fail != "0":
+        device.offlineDevice()
+        raise ValueError, _("Failed LUN %(fcplun)s at WWPN %(wwpn)s on "
+                            "zFCP device %(devnum)s removed again.") \
+                          % {'fcplun': device.fcplun,
+                             'wwpn': device.wwpn,
+                             'devnum': device.devnum}
+
+def _onlineChannelDevices(devnum, ports):
+    """ Add the LUNs of one channel, ports maps WWPNs to lists of devices.
+
+        Returns a list of the devices whose LUNs were added and a list of
+        (device, ValueError) tuples for the others.
+    """
+    try:
+        _onlineChannel(devnum)
+    except ValueError as e:
+        return ([], [(d, e) for luns in ports.values() for d in luns])
+
+    added = []
+    errors = []
+    for (wwpn, luns) in ports.items():
+        try:
+            _addPort(devnum, wwpn)
+        except ValueError as e:
+            errors.extend((d, e) for d in luns)
+            continue
+
+        for d in luns:
+            try:
+                _addUnit(devnum, wwpn, d.fcplun)
+                added.append(d)
+            except ValueError as e:
+                errors.append((d, e))
+
+    return (added, errors)
+
+def onlineDevices(devices, threads=None):
+    """ Bring up the LUNs of many ZFCPDevices at once.
+
+        The devices are grouped by channel and WWPN. The channels are freed
+        and set online once each, by up to threads (ZFCP_THREADS by
+        default) threads at a time, and the LUNs of a port are added one
+        after another without waiting for udev in between. udev is settled
+        once when all of them are added, and only then are the LUNs checked
+        for failures.
+
+        Returns a list of the devices that were brought up and a list of
+        (device, ValueError) tuples for the ones that were not.
+    """
+    channels = OrderedDict()
+    seen = set()
+    for d in devices:
+        if str(d) in seen:
+            continue
+        seen.add(str(d))
+        channels.setdefault(d.devnum, OrderedDict()).setdefault(d.wwpn,
+                                                                []).append(d)
+
+    if not channels:
+        return ([], [])
+
+    free = [devnum for devnum in channels
+                if not os.path.exists("%s/%s/online" %(zfcpsysfs, devnum))]
+    if free:
+        log.info("Freeing zFCP devices %s" % (" ".join(free),))
+        util.run_programs([["zfcp_cio_free", "-d", devnum]
+                                for devnum in free])
+
+    if threads is None:
+        threads = ZFCP_THREADS
+
+    threads = min(threads, len(channels))
+    if threads <= 1:
+        results = [_onlineChannelDevices(devnum, ports)
+                        for (devnum, ports) in channels.items()]
+    else:
+        pool = ThreadPool(threads)
+        try:
+            results = pool.map(lambda c: _onlineChannelDevices(*c),
+                               channels.items(), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    udev_settle()
+
+    online = []
+    errors = []
+    for (added, failed) in results:
+        errors.extend(failed)
+        for d in added:
+            try:
+                _checkUnit(d)
+                online.append(d)
+            except ValueError as e:
+                errors.append((d, e))
+
+    return (online, errors)
+
 class ZFCP:
     """ ZFCP utility class.
 
@@ -344,6 +462,7 @@ class ZFCP:
         lines = map(lambda x: x.strip().lower(), f.readlines())
         f.close()
 
+        devices = []
         for line in lines:
             if line.startswith("#") or line == '':
                 continue
@@ -365,18 +484,39 @@ class ZFCP:
                 continue
 
             try:
-                self.addFCP(devnum, wwpn, fcplun)
+                devices.append(ZFCPDevice(devnum, wwpn, fcplun))
             except ValueError as e:
-                if self.intf:
-                    self.intf.messageWindow(_("Error"), str(e))
-                else:
-                    log.warning(str(e))
+                self._reportErrors([e])
+
+        errors = self.addFCPs(devices)
+        self._reportErrors([e for (d, e) in errors])
+
+    def _reportErrors(self, errors):
+        if not errors:
+            return
+
+        if self.intf:
+            self.intf.messageWindow(_("Error"),
+                                    "\n".join(str(e) for e in errors))
+        else:
+            for e in errors:
+                log.warning(str(e))
 
     def addFCP(self, devnum, wwpn, fcplun):
         d = ZFCPDevice(devnum, wwpn, fcplun)
         if d.onlineDevice():
             self.fcpdevs.add(d)
 
+    def addFCPs(self, devices):
+        """ Bring up many ZFCPDevices at once, see onlineDevices.
+
+            Returns a list of (device, ValueError) tuples for the devices
+            that could not be brought up.
+        """
+        (online, errors) = onlineDevices(devices)
+        self.fcpdevs.update(online)
+        return errors
+
     def shutdown(self):
         if self.down:
             return
@@ -396,16 +536,14 @@ class ZFCP:
         if not self.hasReadConfig:
             self.readConfig()
             self.hasReadConfig = True
-            # readConfig calls addFCP which calls onlineDevice already
+            # readConfig calls addFCPs which brings the devices up already
             return
 
         if len(self.fcpdevs) == 0:
             return
-        for d in self.fcpdevs:
-            try:
-                d.onlineDevice()
-            except ValueError as e:
-                log.warn(str(e))
+        (online, errors) = onlineDevices(self.fcpdevs)
+        for (d, e) in errors:
+            log.warn(str(e))
 
     def write(self, root):
         if len(self.fcpdevs) == 0:
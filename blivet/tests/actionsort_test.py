@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+import unittest
+import random
+
+from blivet import actionsort
+from blivet import tsort
+from blivet.deviceaction import ACTION_TYPE_DESTROY, ACTION_TYPE_RESIZE
+from blivet.deviceaction import ACTION_TYPE_CREATE
+
+class FakeDevice(object):
+    def __init__(self, id, parents=None):
+        self.id = id
+        self.parents = parents or []
+
+    def dependsOn(self, dep):
+        return any(p == dep or p.dependsOn(dep) for p in self.parents)
+
+class FakeAction(object):
+    """ Orders itself the way the real destroy/resize/create actions do. """
+    def __init__(self, id, type, device):
+        self.id = id
+        self.type = type
+        self.device = device
+
+    def requires(self, action):
+        if self.type == ACTION_TYPE_DESTROY:
+            return (action.type == ACTION_TYPE_DESTROY and
+                    action.device.dependsOn(self.device))
+        elif self.type == ACTION_TYPE_CREATE:
+            if self.device.dependsOn(action.device):
+                return True
+
+            # "partitions" are created in ascending order
+            return (action.type == ACTION_TYPE_CREATE and
+                    self.device.parents and
+                    self.device.parents == action.device.parents and
+                    self.device.id > action.device.id)
+
+        return False
+
+    def obsoletes(self, action):
+        return (self.device.id == action.device.id and
+                self.type == action.type and self.id > action.id)
+
+def reference_sort(actions):
+    """ The pairwise sort DeviceTree.sortActions used to do. """
+    edges = []
+    for (i, action) in enumerate(actions):
+        for (j, _action) in enumerate(actions):
+            if i != j and (action.type > _action.type or
+                           _action.requires(action)):
+                edges.append((i, j))
+
+    incoming = dict((i, 0) for i in range(len(actions)))
+    for (parent, child) in edges:
+        incoming[child] += 1
+
+    order = []
+    roots = [i for i in range(len(actions)) if incoming[i] == 0]
+    while roots:
+        root = roots.pop()
+        order.append(root)
+        for (parent, child) in [e for e in edges if e[0] == root]:
+            incoming[child] -= 1
+            if incoming[child] == 0:
+                roots.append(child)
+
+    return [actions[i] for i in order]
+
+class ActionSortTestCase(unittest.TestCase):
+    def _actions(self, seed):
+        rand = random.Random(seed)
+        devices = []
+        for i in range(60):
+            parents = []
+            if devices and rand.random() < 0.8:
+                count = min(len(devices), rand.choice([1, 1, 1, 2]))
+                parents = rand.sample(devices, count)
+            devices.append(FakeDevice(i, parents))
+
+        types = [ACTION_TYPE_DESTROY, ACTION_TYPE_RESIZE, ACTION_TYPE_CREATE]
+        return [FakeAction(i, rand.choice(types), rand.choice(devices))
+                    for i in range(120)]
+
+    def testSameOrder(self):
+        for seed in range(20):
+            actions = self._actions(seed)
+            self.assertEqual([a.id for a in actionsort.sort_actions(actions)],
+                             [a.id for a in reference_sort(actions)])
+
+    def testCycle(self):
+        disk = FakeDevice(0)
+        part = FakeDevice(1, [disk])
+        # a destroy that needs a create done first can not be sorted
+        destroy = FakeAction(0, ACTION_TYPE_DESTROY, disk)
+        destroy.requires = lambda action: action.device == part
+        create = FakeAction(1, ACTION_TYPE_CREATE, part)
+        self.assertRaises(tsort.CyclicGraphError,
+                          actionsort.sort_actions, [destroy, create])
+
+    def testPrune(self):
+        actions = self._actions(42)
+        expected = actions[:]
+        for action in reversed(actions):
+            if action not in expected:
+                continue
+
+            for obsolete in expected[:]:
+                if action.obsoletes(obsolete):
+                    expected.remove(obsolete)
+
+        self.assertEqual(actionsort.prune_actions(actions), expected)
+        self.assertTrue(len(expected) < len(actions))
+
+    def testWaves(self):
+        sda = FakeDevice(0)
+        sda1 = FakeDevice(1, [sda])
+        sdb = FakeDevice(2)
+        sdb1 = FakeDevice(3, [sdb])
+        sdc = FakeDevice(4)
+        # a vg on sda1 and sdc ties the two disks together
+        vg = FakeDevice(5, [sda1, sdc])
+
+        actions = [FakeAction(0, ACTION_TYPE_DESTROY, sda1),
+                   FakeAction(1, ACTION_TYPE_DESTROY, sdb1),
+                   FakeAction(2, ACTION_TYPE_DESTROY, sdc),
+                   FakeAction(3, ACTION_TYPE_CREATE, sdb1),
+                   FakeAction(4, ACTION_TYPE_CREATE, vg),
+                   FakeAction(5, ACTION_TYPE_CREATE, sda1)]
+        waves = actionsort.action_waves(actionsort.sort_actions(actions))
+        self.assertEqual([sorted(a.id for a in wave) for wave in waves],
+                         [[1, 2], [0], [3, 5], [4]])
+
+if __name__ == "__main__":
+    unittest.main()
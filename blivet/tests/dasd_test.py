@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+import unittest
+import threading
+import time
+import mock
+
+from blivet.devicelibs import dasd
+from blivet.errors import DasdFormatError
+
+STEP_TIME = 0.02
+
+class FakeDasdfmt(object):
+    """ Stands in for dasdfmt -P, printing its progress as it goes.
+
+        Records how many DASDs are formatted at a time, overall and per
+        channel path.
+    """
+    def __init__(self, cylinders, chpids, failing=()):
+        self.cylinders = cylinders
+        self.chpids = chpids
+        self.failing = failing
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+
+    def enter(self, key):
+        with self.lock:
+            self.active[key] = self.active.get(key, 0) + 1
+            self.peak[key] = max(self.peak.get(key, 0), self.active[key])
+
+    def leave(self, key):
+        with self.lock:
+            self.active[key] -= 1
+
+    def run(self, argv, output_callback=None):
+        name = argv[-1][len("/dev/"):]
+        self.enter(None)
+        self.enter(self.chpids[name])
+        try:
+            total = self.cylinders[name]
+            for done in range(0, total + 1, total / 4):
+                time.sleep(STEP_TIME)
+                if name in self.failing and done:
+                    output_callback("dasdfmt: error while formatting")
+                    return 1
+                output_callback("cyl %7d of %7d |%3d%%" %
+                                (done, total, 100 * done / total))
+            return 0
+        finally:
+            self.leave(self.chpids[name])
+            self.leave(None)
+
+class DasdFormatterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dasds = ["dasd%s" % c for c in "abcdefgh"]
+        chpids = dict((d, "%02x" % (0x40 + i % 2))
+                        for (i, d) in enumerate(self.dasds))
+        cylinders = dict((d, 3338 * (1 + i % 3))
+                            for (i, d) in enumerate(self.dasds))
+        self.dasdfmt = FakeDasdfmt(cylinders, chpids, failing=["dasdc"])
+
+        for (obj, name, value) in [
+                (dasd.util, "run_program", self.dasdfmt.run),
+                (dasd, "get_dasd_chpids", chpids.get)]:
+            patch = mock.patch.object(obj, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.progress = []
+
+    def testFormat(self):
+        start = time.time()
+        errors = dasd.format_dasds(self.dasds, threads=4,
+                                   progress=self.progress.append)
+        elapsed = time.time() - start
+
+        self.assertEqual(self.dasdfmt.peak[None], 4)
+        self.assertTrue(elapsed < 4 * 5 * STEP_TIME)
+
+        # the failed DASD does not stop the others
+        self.assertEqual(errors.keys(), ["dasdc"])
+        self.assertTrue(isinstance(errors["dasdc"], DasdFormatError))
+
+        self.assertEqual(self.progress[0], 0)
+        self.assertEqual(self.progress[-1], 100)
+        self.assertEqual(self.progress, sorted(set(self.progress)))
+        self.assertTrue(len(self.progress) > len(self.dasds))
+
+    def testPerPath(self):
+        errors = dasd.format_dasds(self.dasds, threads=8, per_path=2)
+        self.assertEqual(errors.keys(), ["dasdc"])
+        self.assertEqual(self.dasdfmt.peak[None], 4)
+        self.assertEqual(self.dasdfmt.peak["40"], 2)
+        self.assertEqual(self.dasdfmt.peak["41"], 2)
+
+    def testSerial(self):
+        formatter = dasd.DasdFormatter(threads=1,
+                                       progress=self.progress.append)
+        self.assertEqual(formatter.format([]), {})
+        self.assertEqual(formatter.format(self.dasds[:2]), {})
+        self.assertEqual(self.dasdfmt.peak[None], 1)
+        self.assertEqual(self.progress[-1], 100)
+        self.assertTrue(50 in self.progress)
+
+    def testSlowProgress(self):
+        formatter = None
+        stuck = []
+
+        def progress(percent):
+            # a redraw that takes a while and asks another thread to look
+            # at the formatter
+            time.sleep(2 * STEP_TIME)
+            other = threading.Thread(target=formatter._report)
+            other.start()
+            other.join(1)
+            stuck.append(other.is_alive())
+            self.progress.append(percent)
+
+        formatter = dasd.DasdFormatter(threads=4, progress=progress)
+        start = time.time()
+        errors = formatter.format(self.dasds)
+        elapsed = time.time() - start
+
+        self.assertEqual(errors.keys(), ["dasdc"])
+        self.assertFalse(any(stuck))
+
+        # the workers were not held up by the callback, which took more
+        # time than that when run for every step
+        self.assertEqual(self.dasdfmt.peak[None], 4)
+        self.assertTrue(elapsed < 10 * 5 * STEP_TIME)
+        self.assertTrue(len(self.progress) < 10 * 5 * STEP_TIME /
+                                             (2 * STEP_TIME))
+        self.assertEqual(self.progress[-1], 100)
+        self.assertEqual(self.progress, sorted(set(self.progress)))
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(DasdFormatterTestCase)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,413 @@
+#!/usr/bin/python
+
+import unittest
+import copy
+import mock
+
+import blivet.devicetree
+from blivet.devicetree import DeviceTree
+from blivet.errors import DeviceTreeError
+from blivet.flags import flags
+from blivet.deviceaction import ActionCreateDevice, ActionCreateFormat
+from blivet.devices import StorageDevice
+from blivet.formats import getFormat
+
+class DeviceTreeLookupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tree = DeviceTree()
+        self.disk = StorageDevice("sdx", exists=True,
+                                  sysfsPath="/devices/virtual/block/sdx")
+        self.tree._addDevice(self.disk)
+
+        self.part = StorageDevice("sdx1", parents=[self.disk], exists=True,
+                                  uuid="abcd-1234",
+                                  sysfsPath="/devices/virtual/block/sdx/sdx1")
+        self.part.format = getFormat("ext4", uuid="ffff-0000", label="data",
+                                     device=self.part.path, exists=True)
+        self.tree._addDevice(self.part)
+
+    def testLookups(self):
+        tree = self.tree
+        self.assertEqual(tree.getDeviceByName("sdx1"), self.part)
+        self.assertEqual(tree.getDeviceByPath("/dev/sdx1"), self.part)
+        self.assertEqual(tree.getDeviceByUuid("abcd-1234"), self.part)
+        self.assertEqual(tree.getDeviceByUuid("ffff-0000"), self.part)
+        self.assertEqual(tree.getDeviceByLabel("data"), self.part)
+        self.assertEqual(tree.getDeviceBySysfsPath(self.part.sysfsPath),
+                         self.part)
+        self.assertEqual(tree.getDeviceByID(self.part.id), self.part)
+
+        self.assertEqual(tree.getDeviceByName("sdy"), None)
+        self.assertEqual(tree.getDeviceByName(None), None)
+        self.assertEqual(tree.getDeviceByUuid("nope"), None)
+
+    def testPreferLeaves(self):
+        tree = self.tree
+        # a second device with the same path as the disk, but on top of it
+        tree._removeDevice(self.part)
+        other = StorageDevice("sdx", parents=[self.disk], exists=True)
+        tree._addDevice(other)
+        self.assertEqual(tree.getDeviceByPath("/dev/sdx"), other)
+        self.assertEqual(tree.getDeviceByPath("/dev/sdx", preferLeaves=False),
+                         self.disk)
+
+    def testAttributeChanges(self):
+        tree = self.tree
+        self.part._name = "sdx2"
+        self.assertEqual(tree.getDeviceByName("sdx1"), None)
+        self.assertEqual(tree.getDeviceByName("sdx2"), self.part)
+        self.assertEqual(tree.getDeviceByPath("/dev/sdx2"), self.part)
+
+        self.part.uuid = "abcd-5678"
+        self.assertEqual(tree.getDeviceByUuid("abcd-1234"), None)
+        self.assertEqual(tree.getDeviceByUuid("abcd-5678"), self.part)
+
+        self.part.sysfsPath = "/devices/virtual/block/sdx/sdx2"
+        self.assertEqual(tree.getDeviceBySysfsPath(self.part.sysfsPath),
+                         self.part)
+
+        self.part.format.label = "home"
+        self.assertEqual(tree.getDeviceByLabel("data"), None)
+        self.assertEqual(tree.getDeviceByLabel("home"), self.part)
+
+        self.part.format = getFormat("xfs", uuid="eeee-1111")
+        self.assertEqual(tree.getDeviceByUuid("ffff-0000"), None)
+        self.assertEqual(tree.getDeviceByUuid("eeee-1111"), self.part)
+        self.assertEqual(tree.getDeviceByLabel("home"), None)
+
+    def testHidden(self):
+        tree = self.tree
+        tree.hide(self.disk)
+        self.assertEqual(tree.getDeviceByName("sdx"), None)
+        self.assertEqual(tree.getDeviceByName("sdx1"), None)
+        self.assertEqual(tree.getDeviceByName("sdx", hidden=True), self.disk)
+        self.assertEqual(tree.getDeviceByUuid("ffff-0000", hidden=True),
+                         self.part)
+
+        tree.unhide(self.disk)
+        self.assertEqual(tree.getDeviceByName("sdx"), self.disk)
+        self.assertEqual(tree.getDeviceByLabel("data"), self.part)
+
+    def testRemove(self):
+        tree = self.tree
+        tree._removeDevice(self.part)
+        self.assertEqual(tree.getDeviceByName("sdx1"), None)
+        self.assertEqual(tree.getDeviceByUuid("ffff-0000"), None)
+        self.assertEqual(tree.getDeviceByID(self.part.id), None)
+
+        # changes to devices that have left the tree must not bring them back
+        self.part.uuid = "abcd-9999"
+        self.assertEqual(tree.getDeviceByUuid("abcd-9999"), None)
+
+    def testIncomplete(self):
+        tree = self.tree
+        self.part.complete = False
+        self.assertEqual(tree.getDeviceByName("sdx1"), None)
+        self.assertEqual(tree.getDeviceByName("sdx1", incomplete=True),
+                         self.part)
+
+    def testCopy(self):
+        new = copy.deepcopy(self.tree)
+        part = new.getDeviceByName("sdx1")
+        self.assertNotEqual(part, None)
+        self.assertNotEqual(part, self.part)
+
+        # the copies are indexed independently of the originals
+        part.format.label = "copy"
+        self.assertEqual(new.getDeviceByLabel("copy"), part)
+        self.assertEqual(self.tree.getDeviceByLabel("copy"), None)
+        self.assertEqual(self.tree.getDeviceByLabel("data"), self.part)
+
+class DeviceTreeSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tree = DeviceTree()
+        self.disk = StorageDevice("sdx", exists=True)
+        self.tree._addDevice(self.disk)
+
+        self.part = StorageDevice("sdx1", parents=[self.disk], exists=True)
+        self.part.format = getFormat("ext4", uuid="ffff-0000",
+                                     device=self.part.path, exists=True)
+        self.tree._addDevice(self.part)
+
+    def _change(self):
+        new = StorageDevice("sdx2", parents=[self.disk])
+        self.tree.registerAction(ActionCreateDevice(new))
+        self.tree.registerAction(ActionCreateFormat(self.part,
+                                                    getFormat("xfs")))
+        self.part._name = "renamed"
+        self.tree.names.append("renamed")
+
+    def _check(self):
+        tree = self.tree
+        self.assertEqual(tree.devices, [self.disk, self.part])
+        self.assertEqual(tree._actions, [])
+        self.assertEqual(tree.names, ["sdx", "sdx1"])
+        self.assertEqual(self.disk.kids, 1)
+        self.assertEqual(self.part.format.type, "ext4")
+        self.assertEqual(tree.getDeviceByName("sdx1"), self.part)
+        self.assertEqual(tree.getDeviceByUuid("ffff-0000"), self.part)
+        self.assertEqual(tree.getDeviceByName("sdx2"), None)
+        self.assertEqual(tree.getDeviceByName("renamed"), None)
+        self.assertEqual(tree.getChildren(self.disk), [self.part])
+        self.assertEqual(tree.leaves, [self.part])
+
+    def testRestore(self):
+        snapshot = self.tree.snapshot()
+        self._change()
+        self.assertEqual(self.tree.getDeviceByName("renamed"), self.part)
+        self.tree.restore(snapshot)
+        self._check()
+
+        # the same snapshot can be restored again
+        self._change()
+        self.tree.restore(snapshot)
+        self._check()
+
+class DeviceTreeTopologyTestCase(unittest.TestCase):
+    """ sda and sdb back md, which carries fs. sdc is unused. """
+    def setUp(self):
+        self.tree = DeviceTree()
+        self.sda = StorageDevice("sda", exists=True)
+        self.sdb = StorageDevice("sdb", exists=True)
+        self.sdc = StorageDevice("sdc", exists=True)
+        self.md = StorageDevice("md0", parents=[self.sda, self.sdb],
+                                exists=True)
+        self.fs = StorageDevice("fs", parents=[self.md], exists=True)
+        for device in (self.sda, self.sdb, self.sdc, self.md, self.fs):
+            self.tree._addDevice(device)
+
+    def testQueries(self):
+        tree = self.tree
+        self.assertEqual(tree.getChildren(self.sda), [self.md])
+        self.assertEqual(tree.getChildren(self.fs), [])
+        self.assertEqual(tree.leaves, [self.sdc, self.fs])
+        self.assertEqual(tree.getDependentDevices(self.sdb),
+                         [self.md, self.fs])
+        self.assertEqual(set(self.fs.ancestors),
+                         set([self.fs, self.md, self.sda, self.sdb]))
+        self.assertTrue(self.fs.dependsOn(self.sda))
+        self.assertFalse(self.fs.dependsOn(self.fs))
+        self.assertFalse(self.sda.dependsOn(self.fs))
+
+    def testParentChanges(self):
+        tree = self.tree
+        self.assertTrue(self.fs.dependsOn(self.sdb))
+
+        # lists of parents are changed in place all over the place
+        self.md.parents.remove(self.sdb)
+        self.sdb.removeChild()
+        self.md.parents.append(self.sdc)
+        self.sdc.addChild()
+        self.assertFalse(self.fs.dependsOn(self.sdb))
+        self.assertTrue(self.fs.dependsOn(self.sdc))
+        self.assertEqual(tree.getChildren(self.sdb), [])
+        self.assertEqual(tree.getChildren(self.sdc), [self.md])
+        self.assertEqual(tree.leaves, [self.sdb, self.fs])
+        self.assertEqual(tree.getDependentDevices(self.sdc),
+                         [self.md, self.fs])
+
+        self.fs.parents = [self.sda]
+        self.assertEqual(tree.getChildren(self.md), [])
+        self.assertEqual(tree.getChildren(self.sda), [self.md, self.fs])
+        self.assertFalse(self.fs.dependsOn(self.md))
+
+    def testRemoveAndHide(self):
+        tree = self.tree
+        tree._removeDevice(self.fs)
+        self.assertEqual(tree.getChildren(self.md), [])
+        self.assertEqual(tree.leaves, [self.sdc, self.md])
+
+        tree._addDevice(self.fs)
+        tree.hide(self.md)
+        self.assertEqual(tree.getChildren(self.sda), [])
+        self.assertEqual(tree.getDependentDevices(self.sda), [])
+        self.assertEqual(tree.leaves, [self.sda, self.sdb, self.sdc])
+
+    def testCopy(self):
+        tree = copy.deepcopy(self.tree)
+        (sda, sdb, sdc, md, fs) = tree.devices
+        self.assertEqual(tree.getChildren(sda), [md])
+        self.assertEqual(tree.getDependentDevices(sdb), [md, fs])
+        self.assertEqual(tree.leaves, [sdc, fs])
+
+        md.parents.remove(sdb)
+        self.assertEqual(tree.getChildren(sdb), [])
+        self.assertEqual(self.tree.getChildren(self.sdb), [self.md])
+
+class DeviceTreeUeventTestCase(unittest.TestCase):
+    """ Replay recorded uevents against a small tree.
+
+        sda1 and sdb both back "vg", which carries "lv".
+    """
+    def setUp(self):
+        self.tree = DeviceTree()
+        self.sda = self._add("sda", "/devices/virtual/block/sda")
+        self.sda1 = self._add("sda1", "/devices/virtual/block/sda/sda1",
+                              parents=[self.sda])
+        self.sdb = self._add("sdb", "/devices/virtual/block/sdb")
+        self.vg = self._add("vg", "", parents=[self.sda1, self.sdb])
+        self.lv = self._add("lv", "", parents=[self.vg])
+
+        self.scanned = []
+        self.udev_devices = []
+        patches = [mock.patch.object(blivet.devicetree, name, new)
+                    for (name, new) in
+                        [("udev_get_block_device", self._udev_data),
+                         ("udev_get_block_devices", self._udev_devices),
+                         ("udev_device_get_slaves", lambda info: []),
+                         ("udev_device_is_partition", lambda info: False)]]
+        patches.append(mock.patch.object(self.tree, "addUdevDevice",
+                                         self.scanned.append))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _add(self, name, sysfsPath, parents=None):
+        device = StorageDevice(name, parents=parents, exists=True,
+                               sysfsPath=sysfsPath)
+        device.format = getFormat("ext4", device=device.path, exists=True)
+        self.tree._addDevice(device)
+        return device
+
+    def _udev_data(self, sysfs_path):
+        return {"name": sysfs_path.split("/")[-1], "sysfs_path": sysfs_path}
+
+    def _udev_devices(self, skip=None, threads=None):
+        return [d for d in self.udev_devices if d["name"] not in (skip or ())]
+
+    def _event(self, action, name, sysfs_path):
+        return {"ACTION": action, "name": name, "sysfs_path": sysfs_path}
+
+    def _scanned(self):
+        return [info["name"] for info in self.scanned]
+
+    def testChange(self):
+        tree = self.tree
+        tree.processUevents([self._event("change", "sda1",
+                                         self.sda1.sysfsPath)])
+
+        # the vg is gone along with its lv, both of its pvs got rescanned
+        self.assertEqual(self._scanned(), ["sda1", "sdb"])
+        self.assertEqual(tree.getDeviceByName("vg"), None)
+        self.assertEqual(tree.getDeviceByName("lv"), None)
+        self.assertEqual(tree.getDeviceByName("sda"), self.sda)
+        self.assertEqual(self.sda1.format.type, None)
+        self.assertEqual(self.sda.format.type, "ext4")
+
+    def testRemove(self):
+        tree = self.tree
+        tree.processUevents([self._event("remove", "sdb",
+                                         self.sdb.sysfsPath)])
+
+        self.assertEqual(tree.getDeviceByName("sdb"), None)
+        self.assertEqual(tree.getDeviceByName("vg"), None)
+        self.assertEqual(tree.getDeviceByName("sda1"), self.sda1)
+        self.assertEqual(self._scanned(), ["sda1"])
+
+        # partitions are rescanned via their disk
+        self.scanned[:] = []
+        tree.processUevents([self._event("remove", "sda1",
+                                         self.sda1.sysfsPath)])
+        self.assertEqual(self._scanned(), ["sda"])
+        self.assertEqual(tree.getDeviceByName("sda1"), None)
+
+    def testAdd(self):
+        tree = self.tree
+        sdc = self._udev_data("/devices/virtual/block/sdc")
+        self.udev_devices = [self._udev_data(self.sda.sysfsPath), sdc]
+        tree.processUevents([self._event("add", "sdc", sdc["sysfs_path"])])
+
+        # only the new device gets scanned, the rest of the tree stays
+        self.assertEqual(self.scanned, [sdc])
+        self.assertEqual(tree.getDeviceByName("lv"), self.lv)
+
+    def testMDMembers(self):
+        tree = self.tree
+        members = []
+        for name in ("sdc", "sdd"):
+            info = self._udev_data("/devices/virtual/block/%s" % name)
+            info["ID_FS_TYPE"] = "linux_raid_member"
+            members.append(info)
+
+        self.udev_devices = [self._udev_data(self.sdb.sysfsPath)] + members
+        with mock.patch.object(blivet.devicetree.devicelibs.mdraid,
+                               "mdexamine_cache_load") as load:
+            tree.processUevents([self._event("add", "sdc", "/devices/sdc"),
+                                 self._event("add", "sdd", "/devices/sdd")])
+
+        # both members were examined in one batch before being scanned
+        self.assertEqual(self.scanned, members)
+        load.assert_called_once_with(["/dev/sdc", "/dev/sdd"])
+        self.assertEqual(tree._udevMDArrays, None)
+
+    def testPartedPool(self):
+        tree = self.tree
+        mpath = self._add("mpatha", "/devices/virtual/block/dm-0")
+        with mock.patch.object(blivet.devicetree, "partedPool") as pool:
+            event = self._event("change", "dm-0", mpath.sysfsPath)
+            event["DM_NAME"] = "mpatha"
+            event["DEVNAME"] = "/dev/dm-0"
+            tree.processUevents([event])
+
+            event = self._event("remove", "sdc", "/devices/sdc")
+            event["DEVNAME"] = "/dev/sdc"
+            tree.processUevents([event])
+
+        # known devices go by the path they were opened with
+        pool.forgetDisk.assert_called_once_with(mpath.path)
+        pool.release.assert_called_once_with("/dev/sdc")
+
+    def testActions(self):
+        self.tree._actions.append(None)
+        self.assertRaises(DeviceTreeError, self.tree.processUevents, [])
+
+class ProcessActionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tree = DeviceTree()
+        self.executed = []
+        patches = [mock.patch.object(blivet.devicetree, "udev_settle"),
+                   mock.patch.object(flags, "action_threads", 4)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _action(self, device, fail=False):
+        action = ActionCreateDevice(device)
+        def execute():
+            if fail:
+                raise RuntimeError("failed")
+            self.executed.append(device.name)
+        action.execute = execute
+        self.tree._actions.append(action)
+        return action
+
+    def testConcurrent(self):
+        disks = [StorageDevice("sd%s" % c, exists=True) for c in "abc"]
+        parts = [StorageDevice(d.name + "1", parents=[d]) for d in disks]
+        tops = [StorageDevice("top%d" % i, parents=[p])
+                    for (i, p) in enumerate(parts)]
+        for device in tops + parts:
+            self._action(device)
+
+        self.tree.processActions()
+        self.assertEqual(self.tree._actions, [])
+        self.assertEqual(len(self.tree._completed_actions), 6)
+        # every partition comes before the device on top of it
+        for (part, top) in zip(parts, tops):
+            self.assertTrue(self.executed.index(part.name) <
+                            self.executed.index(top.name))
+
+        # one settle per wave
+        self.assertEqual(blivet.devicetree.udev_settle.call_count, 2)
+
+    def testFailure(self):
+        sda = StorageDevice("sda", exists=True)
+        sdb = StorageDevice("sdb", exists=True)
+        good = self._action(StorageDevice("sda1", parents=[sda]))
+        bad = self._action(StorageDevice("sdb1", parents=[sdb]), fail=True)
+        self.assertRaises(RuntimeError, self.tree.processActions)
+        self.assertEqual(self.tree._completed_actions, [good])
+        self.assertEqual(self.tree._actions, [bad])
+
+if __name__ == "__main__":
+    unittest.main()
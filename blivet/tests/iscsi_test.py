@@ -0,0 +1,253 @@
+#!/usr/bin/python
+
+import unittest
+import threading
+import time
+import types
+import Queue
+import mock
+
+from blivet import iscsi
+
+LOGIN_TIME = 0.2
+QUIET_TIME = 0.3
+
+class FakeNode(object):
+    """ A libiscsi node whose target adds a disk once it is logged into. """
+    def __init__(self, target, name, address="10.0.0.1", port=3260,
+                 luns=1, fail=False):
+        self.target = target
+        self.name = name
+        self.address = address
+        self.port = port
+        self.iface = "default"
+        self.luns = luns
+        self.fail = fail
+        self.auth = None
+
+    def setAuth(self, authinfo):
+        self.auth = authinfo
+
+    def login(self):
+        self.target.enter()
+        try:
+            time.sleep(LOGIN_TIME)
+            if self.fail:
+                raise IOError("login failed")
+        finally:
+            self.target.leave()
+
+        for lun in range(self.luns):
+            self.target.addDisk(self, lun)
+
+class FakeTarget(object):
+    """ A stand-in for libiscsi and the iSCSI targets behind it.
+
+        It records how many requests are in progress at a time, and sends
+        an add uevent for every disk of a node logged into.
+    """
+    def __init__(self):
+        self.portals = {}
+        self.events = Queue.Queue()
+        self.active = 0
+        self.peak = 0
+        self.disks = 0
+        self.lock = threading.Lock()
+
+        self.module = types.ModuleType("libiscsi")
+        self.module.discover_sendtargets = self.discover_sendtargets
+        self.module.chapAuthInfo = mock.Mock()
+        self.module.get_firmware_initiator_name = mock.Mock(
+                                            side_effect=IOError("no ibft"))
+        self.module.discover_firmware = mock.Mock(
+                                            side_effect=IOError("no ibft"))
+
+    def enter(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+    def addPortal(self, address, names, **kwargs):
+        self.portals[address] = [FakeNode(self, name, address, **kwargs)
+                                    for name in names]
+        return self.portals[address]
+
+    def discover_sendtargets(self, address, port, authinfo):
+        self.enter()
+        try:
+            time.sleep(LOGIN_TIME)
+            if address not in self.portals:
+                raise IOError("no route to host")
+            return self.portals[address]
+        finally:
+            self.leave()
+
+    def addDisk(self, node, lun):
+        with self.lock:
+            name = "sd%s" % chr(ord("b") + self.disks)
+            self.disks += 1
+
+        self.events.put({"ACTION": "add", "DEVTYPE": "disk", "name": name,
+                         "ID_BUS": "scsi",
+                         "ID_PATH": "ip-%s:%d-iscsi-%s-lun-%d" %
+                                    (node.address, node.port, node.name, lun)})
+
+    def get_uevents(self, monitor, timeout=0):
+        try:
+            events = [self.events.get(timeout=timeout)]
+        except Queue.Empty:
+            return []
+
+        while not self.events.empty():
+            events.append(self.events.get())
+        return events
+
+class ISCSITestCase(unittest.TestCase):
+    def setUp(self):
+        self.target = FakeTarget()
+        self.monitor = mock.Mock()
+        self.settle = mock.Mock()
+        self.idle = mock.Mock(return_value=True)
+
+        for (name, value) in [("libiscsi", self.target.module),
+                              ("has_iscsi", lambda: True),
+                              ("udev_monitor_block_devices",
+                               lambda: self.monitor),
+                              ("udev_get_uevents", self.target.get_uevents),
+                              ("udev_settle", self.settle),
+                              ("udev_queue_is_idle", self.idle),
+                              ("ISCSI_QUIET_TIME", QUIET_TIME)]:
+            patch = mock.patch.object(iscsi, name, value, create=True)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.iscsi = type(iscsi.iscsi)()
+        self.iscsi.initiator = "iqn.1994-05.com.example:initiator"
+        self.iscsi.started = True
+
+    def testDiscoverPortals(self):
+        self.target.addPortal("10.0.0.1", ["iqn.2015-01.com.example:a1",
+                                           "iqn.2015-01.com.example:a2"])
+        self.target.addPortal("10.0.0.2", ["iqn.2015-01.com.example:b1"])
+
+        start = time.time()
+        result = self.iscsi.discover_portals([("10.0.0.1", 3260),
+                                              ("10.0.0.2", "3260"),
+                                              ("10.0.0.3", "3260"),
+                                              ("10.0.0.1", "3260")])
+        elapsed = time.time() - start
+
+        self.assertEqual(self.target.peak, 3)
+        self.assertTrue(elapsed < 2 * LOGIN_TIME)
+
+        self.assertEqual(sorted(result.keys()), [("10.0.0.1", "3260"),
+                                                 ("10.0.0.2", "3260"),
+                                                 ("10.0.0.3", "3260")])
+        self.assertEqual([n.name for n in result[("10.0.0.1", "3260")]],
+                         ["iqn.2015-01.com.example:a1",
+                          "iqn.2015-01.com.example:a2"])
+        self.assertEqual(len(result[("10.0.0.2", "3260")]), 1)
+        self.assertTrue(isinstance(result[("10.0.0.3", "3260")], IOError))
+        self.assertEqual(sorted(self.iscsi.discovered_targets.keys()),
+                         [("10.0.0.1", "3260"), ("10.0.0.2", "3260")])
+
+    def testLogIntoNodes(self):
+        nodes = self.target.addPortal("10.0.0.1",
+                                      ["iqn.2015-01.com.example:t%d" % i
+                                            for i in range(6)], luns=2)
+        nodes[3].fail = True
+        self.iscsi.discover("10.0.0.1")
+
+        start = time.time()
+        logins = self.iscsi.log_into_nodes(nodes, threads=3)
+        elapsed = time.time() - start
+
+        # two rounds of three logins, and no fixed sleeps
+        self.assertEqual(self.target.peak, 3)
+        self.assertTrue(elapsed < 3 * LOGIN_TIME)
+        self.assertEqual(self.monitor.unref.call_count, 1)
+        self.assertEqual(self.settle.call_count, 1)
+
+        self.assertEqual([l.node for l in logins], nodes)
+        self.assertEqual([l.rc for l in logins],
+                         [True, True, True, False, True, True])
+        self.assertEqual(logins[3].msg, "login failed")
+        self.assertEqual(logins[3].devices, [])
+        self.assertEqual(logins[3].device_time, None)
+
+        disks = set()
+        for login in logins:
+            self.assertTrue(login.login_time >= LOGIN_TIME)
+            if login.rc:
+                self.assertEqual(len(login.devices), 2)
+                self.assertTrue(login.device_time >= login.login_time)
+                disks.update(login.devices)
+        self.assertEqual(len(disks), 10)
+
+        self.assertEqual(len(self.iscsi.active_nodes()), 5)
+        self.assertFalse(nodes[3] in self.iscsi.active_nodes())
+
+    def testMissingDisks(self):
+        nodes = self.target.addPortal("10.0.0.1",
+                                      ["iqn.2015-01.com.example:t0"], luns=0)
+        self.iscsi.discover("10.0.0.1")
+
+        start = time.time()
+        logins = self.iscsi.log_into_nodes(nodes, timeout=0.3)
+        self.assertTrue(time.time() - start < LOGIN_TIME + 0.3 + 0.5)
+
+        self.assertTrue(logins[0].rc)
+        self.assertEqual(logins[0].devices, [])
+        self.assertEqual(logins[0].device_time, None)
+        self.assertEqual(self.monitor.unref.call_count, 1)
+
+    def testNoLUNs(self):
+        nodes = self.target.addPortal("10.0.0.1",
+                                      ["iqn.2015-01.com.example:t0"], luns=0)
+        nodes = nodes + self.target.addPortal("10.0.0.2",
+                                              ["iqn.2015-01.com.example:t1"])
+        self.iscsi.discover("10.0.0.1")
+        self.iscsi.discover("10.0.0.2")
+
+        # the default timeout is only for disks that are slow to show up;
+        # addTarget discovers and then logs in
+        start = time.time()
+        self.iscsi.addTarget("10.0.0.1")
+        elapsed = time.time() - start
+        self.assertTrue(elapsed >= 2 * LOGIN_TIME + QUIET_TIME)
+        self.assertTrue(elapsed < 2 * LOGIN_TIME + 2 * QUIET_TIME)
+        self.assertEqual(len(self.iscsi.active_nodes()), 1)
+
+        # a node with disks still gets them, and a busy udev is waited for
+        self.idle.side_effect = [False, False, True]
+        start = time.time()
+        logins = self.iscsi.log_into_nodes(nodes)
+        elapsed = time.time() - start
+        self.assertEqual(self.idle.call_count, 4)
+        self.assertTrue(elapsed >= LOGIN_TIME + QUIET_TIME + 0.2)
+        self.assertTrue(elapsed < 2 * LOGIN_TIME + 2 * QUIET_TIME + 0.2)
+        self.assertEqual(logins[0].devices, [])
+        self.assertEqual(len(logins[1].devices), 1)
+
+    def testAddTarget(self):
+        self.target.addPortal("10.0.0.1", ["iqn.2015-01.com.example:a1",
+                                           "iqn.2015-01.com.example:a2"])
+        self.iscsi.addTarget("10.0.0.1")
+        self.assertEqual(self.target.peak, 2)
+        self.assertEqual(len(self.iscsi.active_nodes()), 2)
+
+        self.target.addPortal("10.0.0.2", ["iqn.2015-01.com.example:b1"],
+                              fail=True)
+        self.assertRaises(IOError, self.iscsi.addTarget, "10.0.0.2")
+        self.assertRaises(IOError, self.iscsi.addTarget, "10.0.0.2",
+                          target="iqn.2015-01.com.example:other")
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ISCSITestCase)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+
+import unittest
+import mock
+
+import blivet.devicelibs.lvm as lvm
+
+def _report(rows):
+    return "".join("  %s\n" % lvm._SEPARATOR.join(row) for row in rows)
+
+VG0 = ["LVM2_VG_NAME=vg0", "LVM2_VG_UUID=vg-0", "LVM2_VG_SIZE=8384512.00",
+       "LVM2_VG_FREE=4096.00", "LVM2_VG_EXTENT_SIZE=4096.00",
+       "LVM2_VG_EXTENT_COUNT=2047", "LVM2_VG_FREE_COUNT=1", "LVM2_PV_COUNT=2"]
+VG1 = ["LVM2_VG_NAME=vg1", "LVM2_VG_UUID=vg-1", "LVM2_VG_SIZE=4190208.00",
+       "LVM2_VG_FREE=4190208.00", "LVM2_VG_EXTENT_SIZE=4096.00",
+       "LVM2_VG_EXTENT_COUNT=1023", "LVM2_VG_FREE_COUNT=1023",
+       "LVM2_PV_COUNT=1"]
+
+def _pvs_report(vg1_seqno=1):
+    return _report([
+        ["LVM2_PV_NAME=/dev/sda2", "LVM2_VG_SEQNO=7", "LVM2_PV_UUID=pv-a",
+         "LVM2_PE_START=1024.00"] + VG0,
+        ["LVM2_PV_NAME=/dev/mapper/a disk", "LVM2_VG_SEQNO=7",
+         "LVM2_PV_UUID=pv-b", "LVM2_PE_START=1024.00"] + VG0,
+        ["LVM2_PV_NAME=/dev/sdc", "LVM2_VG_SEQNO=%d" % vg1_seqno,
+         "LVM2_PV_UUID=pv-c", "LVM2_PE_START=1024.00"] + VG1])
+
+LVS_REPORT = "  WARNING: this line is not part of the report\n" + _report([
+    ["LVM2_VG_UUID=vg-0", "LVM2_LV_NAME=root", "LVM2_LV_UUID=lv-r",
+     "LVM2_LV_SIZE=4194304.00", "LVM2_LV_ATTR=owi-a-----", "LVM2_ORIGIN=",
+     "LVM2_POOL_LV=", "LVM2_SEGTYPE=linear", "LVM2_SEG_START=0.00",
+     "LVM2_SEG_SIZE=4190208.00", "LVM2_DEVICES=/dev/sda2(0)"],
+    ["LVM2_VG_UUID=vg-0", "LVM2_LV_NAME=root", "LVM2_LV_UUID=lv-r",
+     "LVM2_LV_SIZE=4194304.00", "LVM2_LV_ATTR=owi-a-----", "LVM2_ORIGIN=",
+     "LVM2_POOL_LV=", "LVM2_SEGTYPE=striped", "LVM2_SEG_START=4190208.00",
+     "LVM2_SEG_SIZE=4096.00",
+     "LVM2_DEVICES=/dev/sda2(1023),/dev/mapper/a disk(0)"],
+    ["LVM2_VG_UUID=vg-0", "LVM2_LV_NAME=snap", "LVM2_LV_UUID=lv-s",
+     "LVM2_LV_SIZE=4186112.00", "LVM2_LV_ATTR=swi-a-s---",
+     "LVM2_ORIGIN=root", "LVM2_POOL_LV=", "LVM2_SEGTYPE=linear",
+     "LVM2_SEG_START=0.00", "LVM2_SEG_SIZE=4186112.00",
+     "LVM2_DEVICES=/dev/mapper/a disk(1)"]])
+
+VGS_REPORT = _report([VG1])
+
+class LVMCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.pvs_report = _pvs_report()
+        patch = mock.patch.object(lvm.util, "run_program_and_capture_output",
+                                  self._run)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(lvm.lvm_cache_invalidate)
+        self.addCleanup(lvm.lvm_cc_resetFilter)
+        self.addCleanup(setattr, lvm, "_vg_records", {})
+
+        lvm.lvm_cache_load()
+
+    def _run(self, argv):
+        self.calls.append(argv)
+        if argv[1] == "pvs":
+            return (0, self.pvs_report)
+        elif argv[1] == "vgs":
+            return (0, VGS_REPORT)
+        return (0, LVS_REPORT)
+
+    def testLoad(self):
+        # one run for the pvs and vgs, one for the lvs
+        self.assertEqual([argv[1] for argv in self.calls], ["pvs", "lvs"])
+        self.assertTrue(lvm._SEPARATOR in self.calls[0])
+
+    def testCachedReads(self):
+        self.calls = []
+        info = lvm.pvinfo("/dev/mapper/a disk")
+        self.assertEqual(info["LVM2_PV_UUID"], "pv-b")
+        self.assertEqual(info["LVM2_PE_START"], "1024.00")
+        self.assertEqual(info["LVM2_VG_UUID"], "vg-0")
+        self.assertEqual(info["LVM2_VG_SIZE"], "8384512.00")
+        self.assertEqual(info["LVM2_PV_COUNT"], "2")
+
+        self.assertEqual(lvm.vginfo("vg1"),
+                         ["vg-1", "4092.00", "4092.00", "4.00",
+                          "1023", "1023", "1"])
+        self.assertEqual(lvm.vgrecord("vg0").free_count, 1)
+
+        # lvs reports a row per segment, but each lv is listed once
+        lvs = lvm.lvs("vg0")
+        self.assertEqual(lvs["LVM2_LV_NAME"], ["root", "snap"])
+        self.assertEqual(lvs["LVM2_LV_ATTR"], ["owi-a-----", "swi-a-s---"])
+        self.assertEqual(lvs["LVM2_SEGTYPE"], ["linear", "linear"])
+        self.assertFalse("LVM2_ORIGIN" in lvs)
+        self.assertEqual(lvm.lvs("vg1"), {})
+
+        root = lvm.vgrecord("vg0").getLV("root")
+        self.assertEqual([s.segtype for s in root.segments],
+                         ["linear", "striped"])
+        self.assertEqual(root.segments[1].start, 4190208.0)
+        self.assertEqual(root.segments[1].devices,
+                         ["/dev/sda2(1023)", "/dev/mapper/a disk(0)"])
+
+        self.assertEqual(lvm.lvorigin("vg0", "snap"), "root")
+        self.assertEqual(lvm.lvorigin("vg0", "root"), "")
+        self.assertEqual(lvm.lvorigin("vg0", "gone"), "")
+        self.assertEqual(lvm.thinlvpoolname("vg0", "root"), "")
+
+        self.assertEqual(self.calls, [])
+
+    def testReuse(self):
+        vg0 = lvm.vgrecord("vg0")
+        vg1 = lvm.vgrecord("vg1")
+
+        # nothing changed, so only the pvs are reported again
+        self.calls = []
+        lvm.lvm_cache_load()
+        self.assertEqual([argv[1] for argv in self.calls], ["pvs"])
+        self.assertTrue(lvm.vgrecord("vg0") is vg0)
+
+        # only the lvs of a vg whose metadata changed are reported again
+        self.calls = []
+        self.pvs_report = _pvs_report(vg1_seqno=2)
+        lvm.lvm_cache_load()
+        self.assertEqual([argv[1] for argv in self.calls], ["pvs", "lvs"])
+        self.assertEqual(self.calls[1][-1], "vg1")
+        self.assertTrue(lvm.vgrecord("vg0") is vg0)
+        self.assertFalse(lvm.vgrecord("vg1") is vg1)
+        self.assertEqual(lvm.vgrecord("vg1").seqno, 2)
+
+    def testMisses(self):
+        self.calls = []
+        lvm.pvinfo("/dev/sdd")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0][-1], "/dev/sdd")
+
+        # devices the lvm filter rejects are not served from the cache
+        lvm.lvm_cc_addFilterRejectRegexp("sda2")
+        lvm.pvinfo("/dev/sda2")
+        self.assertEqual(len(self.calls), 2)
+
+    def testUncached(self):
+        lvm.lvm_cache_invalidate()
+        self.calls = []
+
+        lvs = lvm.lvs("vg0")
+        self.assertEqual(lvs["LVM2_LV_NAME"], ["root", "snap"])
+        self.assertEqual(lvm.lvorigin("vg0", "snap"), "root")
+        self.assertEqual(lvm.vginfo("vg1"),
+                         ["vg-1", "4092.00", "4092.00", "4.00",
+                          "1023", "1023", "1"])
+        self.assertEqual([argv[1] for argv in self.calls],
+                         ["lvs", "lvs", "vgs"])
+
+    def testInvalidate(self):
+        with mock.patch.object(lvm.util, "run_program") as run_program:
+            run_program.return_value = 0
+
+            # activation leaves the metadata alone
+            self.calls = []
+            lvm.lvactivate("vg0", "root")
+            lvm.pvinfo("/dev/sdc")
+            self.assertEqual(self.calls, [])
+
+            lvm.lvremove("vg0", "snap")
+            lvm.pvinfo("/dev/sdc")
+            self.assertEqual(len(self.calls), 1)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(LVMCacheTestCase)
+
+if __name__ == "__main__":
+    unittest.main()
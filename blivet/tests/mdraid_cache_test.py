@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+import unittest
+import mock
+
+import blivet.devicelibs.mdraid as mdraid
+
+EXPORT = """\
+MD_LEVEL=raid1
+MD_DEVICES=2
+MD_NAME=localhost:home
+MD_UUID=%s
+MD_UPDATE_TIME=1388413440
+MD_DEV_UUID=%s
+MD_EVENTS=19
+"""
+
+BRIEF = """\
+ARRAY /dev/md/home  metadata=1.2 UUID=%s name=localhost:home
+"""
+
+class MDExamineCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        patch = mock.patch.object(mdraid.util, "_run_program", self._run)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(mdraid.mdexamine_cache_invalidate)
+
+    def _run(self, argv, **kwargs):
+        self.calls.append(argv)
+        device = argv[-1]
+        if device == "/dev/sdz":
+            return (1, "mdadm: cannot open /dev/sdz: No such file\n")
+        elif argv[2] == "--export":
+            return (0, EXPORT % ("md-uuid", "uuid-" + device[5:]))
+        return (0, BRIEF % "md-uuid")
+
+    def testUncached(self):
+        info = mdraid.mdexamine("/dev/sda1")
+        self.assertEqual(info["MD_UUID"], "md-uuid")
+        self.assertEqual(info["MD_DEV_UUID"], "uuid-sda1")
+        self.assertEqual(info["DEVICE"], "/dev/md/home")
+        self.assertEqual(len(self.calls), 2)
+
+    def testBatch(self):
+        devices = ["/dev/sd%s1" % c for c in "abcdefgh"]
+        mdraid.mdexamine_cache_load(devices + ["/dev/sdz"], threads=4)
+        self.assertEqual(len(self.calls), 18)
+
+        # a second batch only examines the new members
+        mdraid.mdexamine_cache_load(["/dev/sda1", "/dev/sdi1"])
+        self.assertEqual(len(self.calls), 20)
+
+        self.calls = []
+        for device in devices + ["/dev/sdi1"]:
+            info = mdraid.mdexamine(device)
+            self.assertEqual(info["MD_DEV_UUID"], "uuid-" + device[5:])
+            self.assertEqual(info["MD_LEVEL"], "raid1")
+
+        # callers get their own copy
+        info["MD_LEVEL"] = "raid0"
+        self.assertEqual(mdraid.mdexamine("/dev/sdi1")["MD_LEVEL"], "raid1")
+
+        self.assertEqual(mdraid.mdexamine("/dev/sdz"), {})
+        self.assertEqual(self.calls, [])
+
+    def testInvalidate(self):
+        mdraid.mdexamine_cache_load(["/dev/sda1"])
+
+        # anything run through mdadm() may change the superblocks
+        mdraid.mdadm(["--zero-superblock", "/dev/sdb1"])
+        self.calls = []
+        mdraid.mdexamine("/dev/sda1")
+        self.assertEqual(len(self.calls), 2)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(MDExamineCacheTestCase)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+import unittest
+import tempfile
+import os
+import mock
+
+from blivet import partedpool
+
+class FakeDevice(object):
+    def __init__(self, path):
+        self.path = path
+        self.openCount = 0
+        self.fds = []
+
+    def open(self):
+        self.fds.append(os.open(self.path, os.O_RDONLY))
+        self.openCount += 1
+
+    def close(self):
+        os.close(self.fds.pop())
+        self.openCount -= 1
+
+class FakeDisk(object):
+    def __init__(self, device, partitions=None):
+        self.device = device
+        self.partitions = partitions or ["p1", "p2"]
+
+    def duplicate(self):
+        return FakeDisk(self.device, self.partitions[:])
+
+class PartedPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.parted = mock.Mock()
+        self.parted.Device.side_effect = lambda path: FakeDevice(path)
+        self.parted.Disk.side_effect = lambda device: FakeDisk(device)
+        patch = mock.patch.object(partedpool, "parted", self.parted)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        (fd, self.path) = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+        self.pool = partedpool.PartedPool()
+
+    def testShared(self):
+        device = self.pool.getDevice(self.path)
+        self.assertTrue(self.pool.getDevice(self.path) is device)
+        self.assertEqual(self.parted.Device.call_count, 1)
+
+        # every caller gets its own copy of the table read once
+        disk = self.pool.getDisk(self.path)
+        other = self.pool.getDisk(self.path)
+        self.assertFalse(disk is other)
+        self.assertTrue(disk.device is device)
+        disk.partitions.pop()
+        self.assertEqual(other.partitions, ["p1", "p2"])
+        self.assertEqual(self.parted.Disk.call_count, 1)
+
+        self.pool.forgetDisk(self.path)
+        self.pool.getDisk(self.path)
+        self.assertEqual(self.parted.Disk.call_count, 2)
+        self.assertEqual(self.parted.Device.call_count, 1)
+
+    def testRelease(self):
+        device = self.pool.getDevice(self.path)
+        self.pool.getDisk(self.path)
+        device.open()
+        device.open()
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["devices"], 1)
+        self.assertEqual(stats["disks"], 1)
+        self.assertEqual(stats["partitions"], 2)
+        self.assertEqual(stats["openFds"], 2)
+
+        self.pool.release(self.path)
+        self.assertEqual(device.openCount, 0)
+        self.assertEqual(device.fds, [])
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["devices"], 0)
+        self.assertEqual(stats["disks"], 0)
+        self.assertEqual(stats["openFds"], 0)
+
+        self.assertFalse(self.pool.getDevice(self.path) is device)
+        self.pool.release()
+        self.assertEqual(self.pool.stats()["devices"], 0)
+
+    def testAliases(self):
+        link = self.path + ".link"
+        os.symlink(self.path, link)
+        self.addCleanup(lambda: os.path.lexists(link) and os.unlink(link))
+
+        # a symlink and the node it points to share one entry
+        device = self.pool.getDevice(link)
+        self.assertTrue(self.pool.getDevice(self.path) is device)
+        self.pool.getDisk(self.path)
+        self.pool.forgetDisk(link)
+        self.pool.getDisk(link)
+        self.assertEqual(self.parted.Disk.call_count, 2)
+        self.assertEqual(self.pool.stats()["devices"], 1)
+
+        # the link is found once it is gone too
+        os.unlink(link)
+        self.pool.release(link)
+        self.assertEqual(self.pool.stats()["devices"], 0)
+        self.assertFalse(self.pool.getDevice(self.path) is device)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(PartedPoolTestCase)
+
+if __name__ == "__main__":
+    unittest.main()
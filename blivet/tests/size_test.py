@@ -81,6 +81,47 @@ class SizeTestCase(unittest.TestCase):
         s = Size(bytes=478360371L)
         self.assertEquals(s.humanReadable(), "478.36 MB")
 
+    def testArithmetic(self):
+        a = Size(bytes=10)
+        b = Size(bytes=4)
+
+        for s in (a + b, a - b, a * 2, a / b, 1 + a, sum([a, b])):
+            self.assertTrue(isinstance(s, Size))
+
+        self.assertEquals(a + b, 14)
+        self.assertEquals(a - b, 6)
+        self.assertEquals(a / b, 2)
+        self.assertEquals(a / 3, 3)
+        self.assertEquals(a * 1.5, 15)
+        self.assertRaises(SizeNotPositiveError, lambda: b - a)
+
+        self.assertEquals(a % 3, 1)
+        self.assertEquals(-a, -10)
+        self.assertEquals(1 - a, -9)
+        self.assertFalse(isinstance(a % 3, Size))
+
+    def testWholeBytes(self):
+        self.assertEquals(Size(bytes=1.5), 1)
+        self.assertEquals(Size(spec="0.5 kb"), 500)
+        self.assertEquals(Size(spec="56.19 MiB"), 58919485)
+        self.assertEquals(Size(bytes=Size(bytes=5)), 5)
+
+        s = Size(bytes=1500)
+        self.assertEquals(int(s), 1500)
+        self.assertEquals(float(s), 1500.0)
+        self.assertEquals("%d" % s, "1500")
+        self.assertEquals(hash(s), hash(1500))
+        self.assertEquals({1500: True}[s], True)
+
+    def testPickle(self):
+        import copy
+        import pickle
+
+        s = Size(bytes=58929971L)
+        self.assertEquals(copy.deepcopy(s), s)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEquals(pickle.loads(pickle.dumps(s, protocol)), s)
+
     def testTranslated(self):
         import locale
         import os
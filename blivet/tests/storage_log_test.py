@@ -0,0 +1,80 @@
+#!/usr/bin/python
+
+import unittest
+import inspect
+import logging
+import mock
+
+from blivet import storage_log
+
+class Traced(object):
+    def method(self, value):
+        storage_log.log_method_call(self, value, passphrase="secret")
+        # what the log line used to be built from
+        return len(inspect.stack())
+
+    def recurse(self, count):
+        storage_log.log_method_call(self, count=count)
+        if count:
+            self.recurse(count - 1)
+
+    @storage_log.timed_method
+    def entry(self):
+        """ An entry point, timed but logging no calls. """
+        self.recurse(1)
+        return "done"
+
+class StorageLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: self.messages.append(record.getMessage())
+        log = storage_log.log
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+        self.addCleanup(log.setLevel, log.level)
+        self.addCleanup(storage_log.disable_method_stats)
+
+    def testDisabled(self):
+        storage_log.log.setLevel(logging.INFO)
+        with mock.patch.object(storage_log, "function_name_and_depth") as fnd:
+            Traced().method(1)
+            storage_log.log_method_return(self, 1)
+            self.assertFalse(fnd.called)
+
+        self.assertEqual(self.messages, [])
+
+    def testMessage(self):
+        storage_log.log.setLevel(logging.DEBUG)
+        depth = Traced().method(1)
+        self.assertEqual(self.messages,
+                         ["%sTraced.method: 1 ; passphrase: Skipped ;"
+                          % (" " * depth)])
+
+    def testStats(self):
+        storage_log.log.setLevel(logging.INFO)
+        storage_log.enable_method_stats()
+        Traced().recurse(2)
+        Traced().method(1)
+        stats = storage_log.method_stats()
+        self.assertEqual(sorted(stats.keys()),
+                         ["Traced.method", "Traced.recurse"])
+        self.assertEqual(stats["Traced.recurse"][0], 3)
+        self.assertEqual(stats["Traced.method"][0], 1)
+        self.assertEqual(stats["Traced.recurse"][1], 0.0)
+
+        # only timed methods are timed, without a profile hook
+        with mock.patch.object(storage_log.time, "time",
+                               side_effect=[10.0, 12.5]):
+            self.assertEqual(Traced().entry(), "done")
+        stats = storage_log.method_stats()
+        self.assertEqual(stats["Traced.entry"], (0, 2.5))
+        self.assertEqual(stats["Traced.recurse"][0], 5)
+
+        storage_log.disable_method_stats()
+        Traced().method(1)
+        Traced().entry()
+        self.assertEqual(storage_log.method_stats(), {})
+
+if __name__ == "__main__":
+    unittest.main()
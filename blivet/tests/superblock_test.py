@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+import unittest
+import struct
+import tempfile
+import os
+import mock
+
+from blivet.devicelibs import superblock
+from blivet.formats import fs
+
+UUID = "0123456789abcdef0123456789abcdef".decode("hex")
+UUID_STR = "01234567-89ab-cdef-0123-456789abcdef"
+
+def _put(buf, offset, data):
+    buf[offset:offset + len(data)] = data
+
+def ext4_image(state=1, free=1000, reserved=50):
+    buf = bytearray(4096)
+    sb = 1024
+    _put(buf, sb + 4, struct.pack("<I", 0x10000))          # blocks_count_lo
+    _put(buf, sb + 8, struct.pack("<II", reserved & 0xffffffff,
+                                  free & 0xffffffff))
+    _put(buf, sb + 24, struct.pack("<I", 2))               # 4096 byte blocks
+    _put(buf, sb + 0x38, struct.pack("<HH", 0xEF53, state))
+    _put(buf, sb + 0x5C, struct.pack("<III", 0x4, 0x2c2, 0x1))
+    _put(buf, sb + 0x68, UUID)
+    _put(buf, sb + 0x78, "root\0")
+    _put(buf, sb + 0x150, struct.pack("<III", 1, reserved >> 32, free >> 32))
+    return str(buf)
+
+class SuperBlockTestCase(unittest.TestCase):
+    def testExt(self):
+        sb = superblock.parse(ext4_image())
+        self.assertEqual(sb, superblock.SuperBlock("ext4", 4096,
+                                                   0x100010000, 1000, 50,
+                                                   UUID_STR, "root",
+                                                   True, False))
+        self.assertEqual(superblock.parse(ext4_image(), "ext2"), sb)
+        self.assertEqual(superblock.parse(ext4_image(), "xfs"), None)
+
+        sb = superblock.parse(ext4_image(state=2))
+        self.assertFalse(sb.clean)
+        self.assertTrue(sb.errors)
+
+        sb = superblock.parse(ext4_image(reserved=(3 << 32) + 7))
+        self.assertEqual(sb.reserved_blocks, (3 << 32) + 7)
+
+    def testXFS(self):
+        buf = bytearray(512)
+        _put(buf, 0, "XFSB" + struct.pack(">IQ", 4096, 262144))
+        _put(buf, 32, UUID)
+        _put(buf, 108, "data")
+        _put(buf, 144, struct.pack(">Q", 1234))
+        self.assertEqual(superblock.parse(str(buf)),
+                         superblock.SuperBlock("xfs", 4096, 262144, 1234,
+                                               None, UUID_STR, "data", None, None))
+
+    def testBTRFS(self):
+        buf = bytearray(superblock.PROBE_SIZE)
+        sb = 0x10000
+        _put(buf, sb + 0x20, UUID)
+        _put(buf, sb + 0x40, "_BHRfS_M")
+        _put(buf, sb + 0x70, struct.pack("<QQ", 4096 * 100, 4096 * 40))
+        _put(buf, sb + 0x90, struct.pack("<I", 4096))
+        _put(buf, sb + 0x12B, "pool")
+        self.assertEqual(superblock.parse(str(buf)),
+                         superblock.SuperBlock("btrfs", 4096, 100, 60,
+                                               None, UUID_STR, "pool", None, None))
+
+    def testSwap(self):
+        # made on a big endian system with 64KiB pages
+        buf = bytearray(65536)
+        _put(buf, 1024, struct.pack(">II", 1, 511))
+        _put(buf, 1036, UUID)
+        _put(buf, 1052, "swap0")
+        _put(buf, 65536 - 10, "SWAPSPACE2")
+        self.assertEqual(superblock.parse(str(buf)),
+                         superblock.SuperBlock("swap", 65536, 512, None,
+                                               None, UUID_STR, "swap0", None, None))
+
+    def testVFAT(self):
+        buf = bytearray(512)
+        _put(buf, 11, struct.pack("<HB", 512, 8))
+        _put(buf, 32, struct.pack("<I", 409600))
+        _put(buf, 67, struct.pack("<I", 0x1234abcd))
+        _put(buf, 71, "EFI        FAT32   ")
+        _put(buf, 510, "\x55\xaa")
+        self.assertEqual(superblock.parse(str(buf)),
+                         superblock.SuperBlock("vfat", 512, 409600, None,
+                                               None, "1234-ABCD", "EFI", None, None))
+
+    def testLUKS(self):
+        buf = bytearray(592)
+        _put(buf, 0, "LUKS\xba\xbe" + struct.pack(">H", 1))
+        _put(buf, 104, struct.pack(">I", 4096))
+        _put(buf, 168, UUID_STR)
+        sb = superblock.parse(str(buf))
+        self.assertEqual((sb.type, sb.uuid, sb.block_count),
+                         ("luks", UUID_STR, 4096))
+
+    def testGarbage(self):
+        self.assertEqual(superblock.parse(""), None)
+        self.assertEqual(superblock.parse("\0" * superblock.PROBE_SIZE), None)
+        self.assertEqual(superblock.read_superblock("/nonexistent"), None)
+
+class FSSuperBlockTestCase(unittest.TestCase):
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp()
+        os.write(fd, ext4_image(free=0x100000000))
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+    def testExt4(self):
+        resize2fs = "Estimated minimum size of the filesystem: 25600\n"
+        with mock.patch.object(fs.util, "capture_output") as capture_output:
+            capture_output.return_value = resize2fs
+            an_fs = fs.Ext4FS(device=self.path, exists=True)
+            an_fs.updateSizeInfo()
+            self.assertEqual(an_fs.readLabel(), "root")
+
+            # only resize2fs ran, dumpe2fs did not
+            self.assertEqual(capture_output.call_count, 1)
+            self.assertEqual(capture_output.call_args[0][0][1], "-P")
+
+        # 0x100010000 blocks of 4KiB
+        self.assertEqual(an_fs._size, 0x100010000 * 4 / 1024)
+        self.assertEqual(an_fs.minSize, 100 * 1.1)
+        self.assertFalse(an_fs.needsFSCheck)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+import unittest
+import tempfile
+import shutil
+import os
+import mock
+
+from blivet import sysfs
+
+class SysfsCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        patch = mock.patch.object(sysfs, "_SYSFS_ROOT", self.root)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(sysfs.sysfs_cache_invalidate)
+
+        self._write("devices/virtual/block/md0/md/array_state", "clean\n")
+        self._write("devices/virtual/block/md0/ro", "0\n")
+        self._write("class/block/sda/device/model", "DGC LUNZ\n")
+
+    def _write(self, path, data):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, "w") as f:
+            f.write(data)
+
+    def _reads(self):
+        return sysfs.sysfs_cache_stats()["reads"]
+
+    def testUncached(self):
+        md = "/devices/virtual/block/md0"
+        self.assertEqual(sysfs.get_attr(md, "md/array_state"), "clean")
+        self.assertEqual(sysfs.get_attr("/sys" + md, "ro"), "0")
+        self.assertEqual(sysfs.get_attr(md, "size"), None)
+        self.assertTrue(sysfs.has_attr(md, "md"))
+        self.assertFalse(sysfs.has_attr(md, "start"))
+
+        # every call goes to sysfs
+        self._write("devices/virtual/block/md0/md/array_state", "clear\n")
+        self.assertEqual(sysfs.get_attr(md, "md/array_state"), "clear")
+
+    def testCached(self):
+        md = "/devices/virtual/block/md0"
+        sysfs.sysfs_cache_load()
+        self.assertEqual(sysfs.get_attr(md, "md/array_state"), "clean")
+        self.assertEqual(sysfs.get_attr(md, "size"), None)
+        self.assertTrue(sysfs.has_attr(md, "md"))
+
+        reads = self._reads()
+        self._write("devices/virtual/block/md0/md/array_state", "clear\n")
+        self._write("devices/virtual/block/md0/size", "2048\n")
+        for i in range(3):
+            self.assertEqual(sysfs.get_attr("/sys" + md, "md/array_state"),
+                             "clean")
+            self.assertEqual(sysfs.get_attr(md + "/", "size"), None)
+            self.assertTrue(sysfs.has_attr(md, "md"))
+        self.assertEqual(self._reads(), reads)
+
+        sysfs.sysfs_cache_refresh(md)
+        self.assertEqual(sysfs.get_attr(md, "md/array_state"), "clear")
+        self.assertEqual(sysfs.get_attr(md, "size"), "2048")
+
+        sysfs.sysfs_cache_invalidate()
+        self._write("devices/virtual/block/md0/size", "4096\n")
+        self.assertEqual(sysfs.get_attr(md, "size"), "4096")
+
+    def testRefreshByName(self):
+        sysfs.sysfs_cache_load()
+        self.assertEqual(sysfs.get_attr("/class/block/sda", "device/model"),
+                         "DGC LUNZ")
+        self._write("class/block/sda/device/model", "QEMU HARDDISK\n")
+
+        # a uevent names the device by its full sysfs path
+        sysfs.sysfs_cache_refresh("/devices/pci0000:00/host0/block/sda")
+        self.assertEqual(sysfs.get_attr("/class/block/sda", "device/model"),
+                         "QEMU HARDDISK")
+
+        sysfs.sysfs_cache_refresh()
+        reads = self._reads()
+        sysfs.get_attr("/class/block/sda", "device/model")
+        self.assertEqual(self._reads(), reads + 1)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(SysfsCacheTestCase)
+
+if __name__ == "__main__":
+    unittest.main()
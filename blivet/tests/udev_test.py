@@ -100,6 +100,39 @@ class UdevTest(unittest.TestCase):
         self.assertEqual(ret, DEVS)
         blivet.udev.udev_settle = saved
 
+    def test_udev_get_block_devices(self):
+        import blivet.udev
+        blivet.udev.os = os
+        PATHS = ['/devices/virtual/block/loop%d' % i for i in range(10)]
+        saved = (blivet.udev.udev_settle, blivet.udev.udev_enumerate_devices,
+                 blivet.udev._udev_get_block_device_entry, blivet.udev.pyudev)
+        blivet.udev.udev_settle = mock.Mock()
+        blivet.udev.udev_enumerate_devices = mock.Mock(return_value=PATHS)
+        blivet.udev.pyudev = mock.Mock()
+
+        def get_entry(path, udev=None):
+            name = os.path.basename(path)
+            if name == "loop3":
+                # eg: a stopped md array
+                return None
+
+            return {"name": name, "sysfs_path": path}
+
+        blivet.udev._udev_get_block_device_entry = get_entry
+
+        expected = [get_entry(p) for p in PATHS if not p.endswith("loop3")]
+        self.assertEqual(blivet.udev.udev_get_block_devices(), expected)
+        for threads in (1, 3, 16):
+            ret = blivet.udev.udev_get_block_devices(threads=threads)
+            self.assertEqual(ret, expected)
+
+        ret = blivet.udev.udev_get_block_devices(skip=["loop0", "loop9"],
+                                                 threads=4)
+        self.assertEqual(ret, expected[1:-1])
+
+        (blivet.udev.udev_settle, blivet.udev.udev_enumerate_devices,
+         blivet.udev._udev_get_block_device_entry, blivet.udev.pyudev) = saved
+
     def test_udev_parse_uevent_file_1(self):
         import blivet.udev
         # For this one we're accessing the real uevent file (twice).
@@ -144,6 +177,68 @@ class UdevTest(unittest.TestCase):
         blivet.udev.udev_settle()
         self.assertTrue(blivet.udev.util.run_program.called)
 
+    def test_udev_settle_skip(self):
+        import blivet.udev
+        blivet.udev.util = mock.Mock()
+        blivet.udev.util.run_program.return_value = 0
+        blivet.udev._settle_seqnum = None
+        seqnum = [10]
+        idle = [True]
+        with mock.patch.object(blivet.udev, "_udev_uevent_seqnum",
+                               lambda: seqnum[0]), \
+             mock.patch.object(blivet.udev, "udev_queue_is_idle",
+                               lambda: idle[0]):
+            before = blivet.udev.udev_settle_stats()
+            blivet.udev.udev_settle()
+            # nothing happened since the last settle
+            blivet.udev.udev_settle()
+            self.assertEqual(blivet.udev.util.run_program.call_count, 1)
+
+            # new uevents or a busy queue mean we have to wait
+            seqnum[0] = 11
+            blivet.udev.udev_settle()
+            idle[0] = False
+            blivet.udev.udev_settle()
+            self.assertEqual(blivet.udev.util.run_program.call_count, 3)
+
+            # settles in a scope are folded into one at the end
+            with blivet.udev.udev_settle_scope():
+                with blivet.udev.udev_settle_scope():
+                    blivet.udev.udev_settle()
+                blivet.udev.udev_settle()
+                self.assertEqual(blivet.udev.util.run_program.call_count, 3)
+            self.assertEqual(blivet.udev.util.run_program.call_count, 4)
+
+            stats = blivet.udev.udev_settle_stats()
+            diff = dict((k, stats[k] - before[k]) for k in stats)
+            self.assertEqual(diff, {"requested": 6, "run": 4, "skipped": 1,
+                                    "deferred": 2})
+
+    def test_udev_settle_stats_threads(self):
+        import threading
+        import blivet.udev
+        blivet.udev.util = mock.Mock()
+        blivet.udev.util.run_program.return_value = 0
+
+        def settle():
+            with blivet.udev.udev_settle_scope():
+                for i in range(1000):
+                    blivet.udev.udev_settle()
+
+        with mock.patch.object(blivet.udev, "_udev_uevent_seqnum",
+                               lambda: None):
+            before = blivet.udev.udev_settle_stats()
+            threads = [threading.Thread(target=settle) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            stats = blivet.udev.udev_settle_stats()
+            diff = dict((k, stats[k] - before[k]) for k in stats)
+            self.assertEqual(diff, {"requested": 8000, "run": 8,
+                                    "skipped": 0, "deferred": 8000})
+
     def udev_trigger_test(self):
         import blivet.udev
         blivet.udev.util = mock.Mock()
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import mock
+
+from blivet import util
+
+class RunProgramTestCase(unittest.TestCase):
+    def testRunProgram(self):
+        (rc, out) = util.run_program_and_capture_output(["sh", "-c",
+                                                         "echo $LC_ALL"])
+        self.assertEqual(rc, 0)
+        self.assertEqual(out, "C\n")
+
+        self.assertEqual(util.run_program(["sh", "-c", "exit 3"]), 3)
+        self.assertRaises(OSError, util.run_program,
+                          ["/nonexistent/program"])
+
+    def testEnvironment(self):
+        env = util._program_env("/", [])
+        self.assertEqual(env["LC_ALL"], "C")
+        self.assertEqual(env["INSTALL_PATH"], "/")
+        self.assertFalse(util._program_env("/", []) is env)
+
+        with mock.patch.dict(os.environ, {"BLIVET_TEST": "1"}):
+            self.assertEqual(util._program_env("/", [])["BLIVET_TEST"], "1")
+
+            pruned = util._program_env("/", ["BLIVET_TEST"])
+            self.assertFalse("BLIVET_TEST" in pruned)
+            self.assertEqual(os.environ["BLIVET_TEST"], "1")
+
+        self.assertFalse("BLIVET_TEST" in util._program_env("/", []))
+
+    def testRunPrograms(self):
+        # the later programs finish first
+        argvs = [["sh", "-c", "sleep 0.%d; echo %d" % (9 - i, i)]
+                    for i in range(8)]
+        results = util.run_programs(argvs, threads=8)
+        self.assertEqual(results, [(0, "%d\n" % i) for i in range(8)])
+
+        self.assertEqual(util.run_programs(argvs[6:], threads=1),
+                         results[6:])
+        self.assertEqual(util.run_programs([]), [])
+
+        self.assertRaises(OSError, util.run_programs,
+                          [["true"], ["/nonexistent/program"]])
+
+    def testOutputCallback(self):
+        lines = []
+        (rc, out) = util.run_program_and_capture_output(
+                        ["sh", "-c", "printf 'a\\rb\\n\\nc'; exit 2"],
+                        output_callback=lines.append)
+        self.assertEqual(rc, 2)
+        self.assertEqual(out, "a\rb\n\nc")
+        self.assertEqual(lines, ["a", "b", "c"])
+
+if __name__ == "__main__":
+    unittest.main()
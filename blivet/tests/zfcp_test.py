@@ -0,0 +1,218 @@
+#!/usr/bin/python
+
+import unittest
+import tempfile
+import shutil
+import os
+import mock
+
+from blivet import udev
+from blivet import zfcp
+
+WWPNS = ["0x5005076300c18154", "0x5005076300c58154"]
+LUNS = ["0x40%02x000000000000" % i for i in range(8)]
+
+class FakeZFCPSysfs(object):
+    """ A zfcp sysfs tree with the older interface, and the kernel behind it.
+
+        Channels in ignored only show up once zfcp_cio_free is run for them,
+        and the LUNs in failing come up failed.
+    """
+    def __init__(self, root, channels, ignored=(), failing=()):
+        self.root = root
+        self.ignored = set(ignored)
+        self.failing = set(failing)
+        self.writes = []
+        for devnum in channels:
+            if devnum not in self.ignored:
+                self.addChannel(devnum)
+
+    def addChannel(self, devnum):
+        path = os.path.join(self.root, devnum)
+        os.makedirs(path)
+        for attr in ("online", "port_add", "port_remove"):
+            self.setAttr(os.path.join(path, attr), "0")
+
+    def setAttr(self, path, value):
+        with open(path, "w") as f:
+            f.write("%s\n" % value)
+
+    def free(self, argvs):
+        for argv in argvs:
+            if argv[-1] in self.ignored:
+                self.ignored.remove(argv[-1])
+                self.addChannel(argv[-1])
+        return [(0, "")] * len(argvs)
+
+    def write(self, path, value):
+        self.writes.append((os.path.relpath(path, self.root), value))
+        (directory, attr) = os.path.split(path)
+        if attr == "port_add":
+            port = os.path.join(directory, value)
+            os.mkdir(port)
+            self.setAttr(os.path.join(port, "unit_add"), "")
+            self.setAttr(os.path.join(port, "unit_remove"), "")
+        elif attr == "unit_add":
+            unit = os.path.join(directory, value)
+            os.mkdir(unit)
+            self.setAttr(os.path.join(unit, "failed"),
+                         "1" if value in self.failing else "0")
+        elif attr == "unit_remove":
+            shutil.rmtree(os.path.join(directory, value))
+        elif attr == "port_remove":
+            shutil.rmtree(os.path.join(directory, value))
+        else:
+            self.setAttr(path, value)
+
+    def count(self, attr):
+        return len([w for w in self.writes
+                        if os.path.basename(w[0]) == attr])
+
+class ZFCPTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.channels = ["0.0.fc00", "0.0.fc01", "0.0.fd00", "0.0.fd01"]
+        self.sysfs = FakeZFCPSysfs(self.root, self.channels,
+                                   ignored=self.channels[2:],
+                                   failing=[LUNS[3]])
+        self.settle = mock.Mock()
+        self.free = mock.Mock(side_effect=self.sysfs.free)
+
+        for (obj, name, value) in [
+                (zfcp, "zfcpsysfs", self.root),
+                (zfcp, "loggedWriteLineToFile", self.sysfs.write),
+                (zfcp, "udev_settle", self.settle),
+                (zfcp.util, "run_programs", self.free),
+                (zfcp.util, "run_program",
+                 lambda argv: self.sysfs.free([argv])[0][0]),
+                (zfcp.ZFCPDevice, "offlineSCSIDevice", mock.Mock())]:
+            patch = mock.patch.object(obj, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def devices(self, channels):
+        return [zfcp.ZFCPDevice(devnum, wwpn, lun) for devnum in channels
+                    for wwpn in WWPNS for lun in LUNS]
+
+    def testOnlineDevices(self):
+        devices = self.devices(self.channels + ["0.0.fe00"])
+        (online, errors) = zfcp.onlineDevices(devices + devices[:3])
+
+        # the missing and the ignored channels are freed in one go
+        self.assertEqual(self.free.call_count, 1)
+        self.assertEqual(self.free.call_args[0][0],
+                         [["zfcp_cio_free", "-d", devnum]
+                            for devnum in ["0.0.fd00", "0.0.fd01",
+                                           "0.0.fe00"]])
+
+        self.assertEqual(self.sysfs.count("online"), 4)
+        self.assertEqual(self.sysfs.count("port_add"), 8)
+        self.assertEqual(self.sysfs.count("unit_add"), 64)
+        self.assertEqual(self.settle.call_count, 1)
+
+        # the LUNs of a port are added back to back
+        for devnum in self.channels:
+            writes = [w for w in self.sysfs.writes if w[0].startswith(devnum)]
+            self.assertEqual(writes[0], ("%s/online" % devnum, "1"))
+            for wwpn in WWPNS:
+                units = [i for (i, w) in enumerate(writes)
+                            if w[0] == "%s/%s/unit_add" % (devnum, wwpn)]
+                self.assertEqual(units, range(units[0], units[0] + 8))
+
+        failed = [d for d in devices[:64] if d.fcplun == LUNS[3]]
+        self.assertEqual(len(online), 56)
+        self.assertEqual(online, [d for d in devices[:64]
+                                    if d not in failed])
+
+        self.assertEqual(len(errors), 16 + 8)
+        self.assertEqual([d for (d, e) in errors if d in failed], failed)
+        for (d, e) in errors:
+            self.assertTrue(isinstance(e, ValueError))
+            if d in failed:
+                self.assertTrue("removed again" in str(e))
+                self.assertFalse(os.path.exists(os.path.join(self.root,
+                                                d.devnum, d.wwpn, d.fcplun)))
+            else:
+                self.assertEqual(d.devnum, "0.0.fe00")
+                self.assertTrue("not found" in str(e))
+
+        # nothing new to bring up the second time
+        (online, errors) = zfcp.onlineDevices(online)
+        self.assertEqual(online, [])
+        self.assertEqual(len(errors), 56)
+        self.assertTrue("already configured" in str(errors[0][1]))
+
+    def testOnlineDevice(self):
+        device = zfcp.ZFCPDevice("0.0.fd00", WWPNS[0], LUNS[0])
+        self.assertTrue(device.onlineDevice())
+        self.assertEqual(self.sysfs.writes,
+                         [("0.0.fd00/online", "1"),
+                          ("0.0.fd00/port_add", WWPNS[0]),
+                          ("0.0.fd00/%s/unit_add" % WWPNS[0], LUNS[0])])
+        self.assertEqual(self.settle.call_count, 2)
+
+    def testShutdown(self):
+        devices = self.devices(["0.0.fc00"])[:2]
+        (online, errors) = zfcp.onlineDevices(devices)
+        del self.sysfs.writes[:]
+
+        def offlineSCSIDevice(device):
+            self.sysfs.writes.append(("delete", device.fcplun))
+            zfcp.udev_settle()
+
+        def settle():
+            self.sysfs.writes.append(("settle", None))
+
+        for (obj, name, value) in [
+                (zfcp.ZFCPDevice, "offlineSCSIDevice", offlineSCSIDevice),
+                (zfcp, "udev_settle", udev.udev_settle),
+                (udev, "_udev_settle", settle)]:
+            patch = mock.patch.object(obj, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        config = zfcp.ZFCP.__class__()
+        config.fcpdevs.update(online)
+        config.down = False
+        config.shutdown()
+
+        # udev is done with each SCSI device before its LUN is removed
+        removed = [i for (i, w) in enumerate(self.sysfs.writes)
+                        if w[0].endswith("unit_remove")]
+        self.assertEqual(len(removed), 2)
+        for i in removed:
+            self.assertEqual(self.sysfs.writes[i - 2][0], "delete")
+            self.assertEqual(self.sysfs.writes[i - 1], ("settle", None))
+
+    def testReadConfig(self):
+        conf = os.path.join(self.root, "zfcp.conf")
+        with open(conf, "w") as f:
+            f.write("# comment\n\n")
+            for d in self.devices(["0.0.fc00"]):
+                f.write("%s\n" % d)
+            f.write("0.0.fc01 0x1 0x2 0x3\n")
+            f.write("0.0.fc01 bogus %s\n" % LUNS[0])
+
+        patch = mock.patch.object(zfcp, "zfcpconf", conf)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        config = zfcp.ZFCP.__class__()
+        config.intf = mock.Mock()
+        config.startup()
+
+        self.assertEqual(len(config.fcpdevs), 14)
+        self.assertEqual(self.settle.call_count, 1)
+
+        # the bad line and the failed LUNs are each reported once
+        self.assertEqual(config.intf.messageWindow.call_count, 2)
+        message = config.intf.messageWindow.call_args[0][1]
+        self.assertEqual(len(message.splitlines()), 2)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ZFCPTestCase)
+
+if __name__ == "__main__":
+    unittest.main()
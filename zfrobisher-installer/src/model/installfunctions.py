@@ -27,6 +27,8 @@ from callbacks.downloadcallback import DownloadCallback
 from callbacks.installationcallback import InstallationCallback
 from callbacks.transactioncallback import TransactionCallback
 
+from packagefetcher import PackageFetcher, FetchItem, FetchError, checksumFile
+
 from distutils.version import LooseVersion
 
 from modules.grub.grub import Grub
@@ -48,6 +50,9 @@ NFS_LOCAL_REPO = '/var/kop'
 ZKVM_GPGKEY = '/etc/pki/rpm-gpg/RPM-GPG-KEY-ibm_powerkvm'
 CMD_GET_DASD_BUSID = 'lsdasd |grep %s|awk \'{print $1}\''
 
+# number of packages downloaded at a time from network repositories
+FETCH_THREADS = 4
+
 VGROOT = 'zkvm'
 LVROOT = 'root'
 LVBOOT = 'boot'
@@ -491,10 +496,13 @@ def checkSHA1(repofile, logger):
     str1 = f.read()
     f.close()
 
-    os.popen('sha1sum  /tmp/%s > %s 2>/dev/null' % (repofile, SHA1_REPO))
+    try:
+        sha1 = checksumFile('/tmp/%s' % repofile, 'sha1')
+    except (IOError, OSError), e:
+        logger.critical(str(e))
+        return False
 
-    with open(SHA1_REPO, 'rb') as f:
-        return f.read().split()[0] == str1.split()[0]
+    return sha1 == str1.split()[0]
 # checkSHA1()
 
 
@@ -520,12 +528,73 @@ def getRepodataFile(url, logger):
     repodata_file = url + '/repodata/' + d[1]
 
     logger.info('Download repodata_file')
-    os.popen('wget -P /tmp/ ' + repodata_file + ' 2>/dev/null')
+    try:
+        PackageFetcher(1, logger).fetchAll([FetchItem(repodata_file,
+                                                      '/tmp/' + d[1])])
+    except FetchError, e:
+        logger.critical(str(e))
+        raise ZKVMError("INSTALLER", "INSTALLPACKAGES", "INVALID_REPO")
 
     return d[1]
 #getRepodataFile()
 
 
+def prefetchPackages(yb, downloadCallback, logger):
+    """
+    Downloads the packages of a built transaction before yum runs it
+
+    Yum downloads one package at a time over a new connection each and then
+    checksums them all again. The packages from network repositories are
+    fetched here in transaction order, several at a time, and verified
+    while they are written. Yum then finds them already in its
+    cache. Packages from local repositories are used in place by yum and are
+    left alone.
+
+    @type  yb: yum.YumBase
+    @param yb: yum instance with the transaction built
+
+    @type  downloadCallback: DownloadCallback
+    @param downloadCallback: download progress callback
+
+    @type  logger: logging.Logger
+    @param logger: installer logger
+
+    @rtype:   None
+    @returns: Nothing
+    """
+    members = [m for m in yb.tsInfo.getMembers() if m.ts_state in ('i', 'u')]
+
+    items = []
+    packagesUrl = {}
+    for member in members:
+        po = member.po
+        url = po.remote_url
+        if url.startswith('file:') or os.path.exists(po.localPkg()):
+            continue
+
+        (csumType, csum) = po.returnIdSum()
+        # the proxy set for the repository in yum, the environment's if none
+        proxies = getattr(po.repo, 'proxy_dict', None) or None
+        items.append(FetchItem(url, po.localPkg(), csumType, csum,
+                               int(po.size), po, proxies))
+        packagesUrl[os.path.basename(url)] = url
+
+    if not items:
+        return
+
+    logger.info('Prefetching %d packages' % len(items))
+    downloadCallback.setPackagesUrl(packagesUrl)
+
+    try:
+        for item in PackageFetcher(FETCH_THREADS, logger).fetch(items):
+            downloadCallback.updateProgress(os.path.basename(item.url), 1.0,
+                                            '', '')
+    except FetchError, e:
+        # yum retries whatever is left and reports the errors it gets
+        logger.warning('Prefetching packages failed: %s' % str(e))
+# prefetchPackages()
+
+
 def upgradePackages(rootDir, callback):
     """
     Updates all packages of given repository on root directory.
@@ -655,6 +724,7 @@ def upgradePackages(rootDir, callback):
     try:
         yb.resolveDeps()
         yb.buildTransaction()
+        prefetchPackages(yb, downloadCallback, logger)
         yb.processTransaction(
             TransactionCallback(downloadCallback),
             None,
@@ -819,6 +889,7 @@ def installPackages(rootDir, callback):
     try:
         yb.resolveDeps()
         yb.buildTransaction()
+        prefetchPackages(yb, downloadCallback, logger)
         yb.processTransaction(
             TransactionCallback(downloadCallback),
             None,
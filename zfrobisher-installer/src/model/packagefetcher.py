@@ -0,0 +1,463 @@
+#!/usr/bin/python
+
+#
+# IMPORTS
+#
+import hashlib
+import httplib
+import os
+import Queue
+import socket
+import threading
+import urllib
+import urllib2
+import urlparse
+
+
+#
+# CONSTANTS
+#
+DEFAULT_THREADS = 4
+CHUNK_SIZE = 256 * 1024
+RETRIES = 2
+TIMEOUT = 60
+
+# redirects followed for a single file, like urlgrabber does
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (httplib.MOVED_PERMANENTLY, httplib.FOUND,
+                     httplib.SEE_OTHER, httplib.TEMPORARY_REDIRECT)
+
+# yum calls sha1 "sha" in older repodata
+CHECKSUM_TYPES = {
+    'sha': 'sha1',
+    'sha1': 'sha1',
+    'sha256': 'sha256',
+    'sha512': 'sha512',
+    'md5': 'md5',
+}
+
+
+#
+# CODE
+#
+class FetchError(IOError):
+    """
+    A file could not be downloaded or did not match its checksum
+    """
+# FetchError()
+
+
+def newChecksum(csumType):
+    """
+    Returns a hashlib object for a checksum type as named in repodata
+
+    @type  csumType: basestring
+    @param csumType: checksum type, ie: 'sha256'
+
+    @rtype: hashlib object
+    @returns: object to update with the file contents
+    """
+    try:
+        return hashlib.new(CHECKSUM_TYPES[csumType.lower()])
+    except KeyError:
+        raise FetchError("unknown checksum type %s" % csumType)
+# newChecksum()
+
+
+def checksumFile(path, csumType='sha1'):
+    """
+    Computes the checksum of a file without running any program
+
+    @type  path: basestring
+    @param path: path of the file
+
+    @type  csumType: basestring
+    @param csumType: checksum type, ie: 'sha1'
+
+    @rtype: basestring
+    @returns: hex digest of the file contents
+    """
+    csum = newChecksum(csumType)
+
+    with open(path, 'rb') as fd:
+        while True:
+            data = fd.read(CHUNK_SIZE)
+            if not data:
+                break
+            csum.update(data)
+
+    return csum.hexdigest()
+# checksumFile()
+
+
+def proxyFor(url, proxies=None):
+    """
+    Returns the proxy to download a URL through
+
+    @type  url: basestring
+    @param url: URL to download
+
+    @type  proxies: dict
+    @param proxies: URL scheme to proxy URL, None to take them from the
+                    environment (http_proxy, no_proxy, etc)
+
+    @rtype: basestring or None
+    @returns: proxy URL, None to connect to the server directly
+    """
+    parts = urlparse.urlsplit(url)
+    if proxies is None:
+        proxies = urllib.getproxies()
+        if proxies and urllib.proxy_bypass(parts.hostname or ''):
+            return None
+
+    return proxies.get(parts.scheme) or None
+# proxyFor()
+
+
+class FetchItem(object):
+    """
+    A file to download and what it is expected to look like
+    """
+    __slots__ = ['url', 'path', 'csumType', 'csum', 'size', 'data', 'proxies']
+
+    def __init__(self, url, path, csumType=None, csum=None, size=None,
+                 data=None, proxies=None):
+        """
+        Constructor
+
+        @type  url: basestring
+        @param url: http, https, ftp or file URL to download
+
+        @type  path: basestring
+        @param path: where to store the file
+
+        @type  csumType: basestring
+        @param csumType: checksum type, None to skip the verification
+
+        @type  csum: basestring
+        @param csum: expected hex digest
+
+        @type  size: int
+        @param size: expected size in bytes, None if unknown
+
+        @type  data: object
+        @param data: anything the caller wants back with the item
+
+        @type  proxies: dict
+        @param proxies: URL scheme to proxy URL (ie: yum's proxy_dict), None
+                        to take them from the environment
+        """
+        self.url = url
+        self.path = path
+        self.csumType = csumType
+        self.csum = csum
+        self.size = size
+        self.data = data
+        self.proxies = proxies
+    # __init__()
+# FetchItem()
+
+
+class PackageFetcher(object):
+    """
+    Downloads files with a bounded number of workers
+
+    Every worker keeps its HTTP connections open between files, so a
+    repository is not connected to again for every package. Checksums are
+    computed while the data is written, and the files are handed back in
+    the order they were asked for as soon as all files before them are
+    done. That lets the caller start on the first files while the rest
+    are still being downloaded. Files downloaded through a proxy, or
+    redirected to one or to another scheme, go through urllib2 instead.
+    """
+
+    def __init__(self, threads=DEFAULT_THREADS, logger=None):
+        """
+        Constructor
+
+        @type  threads: int
+        @param threads: number of files to download at a time
+
+        @type  logger: logging.Logger
+        @param logger: where to log retries, None for no logging
+        """
+        self.__threads = max(1, threads)
+        self.__logger = logger
+        self.__local = threading.local()
+    # __init__()
+
+    def fetch(self, items):
+        """
+        Downloads items, yielding them in order as they become available
+
+        @type  items: list
+        @param items: FetchItem objects
+
+        @rtype: generator
+        @returns: the FetchItem objects, each one once it and all the items
+                  before it are downloaded and verified. Raises FetchError if
+                  any of them can not be, after the ones before it.
+        """
+        items = list(items)
+        if not items:
+            return
+
+        pending = Queue.Queue()
+        for index in range(len(items)):
+            pending.put(index)
+
+        results = Queue.Queue()
+        stop = threading.Event()
+
+        workers = []
+        for i in range(min(self.__threads, len(items))):
+            worker = threading.Thread(target=self.__work,
+                                      args=(items, pending, results, stop))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        done = {}
+        nextIndex = 0
+        try:
+            while nextIndex < len(items):
+                while nextIndex not in done:
+                    (index, error) = results.get()
+                    done[index] = error
+
+                error = done.pop(nextIndex)
+                if error is not None:
+                    raise error
+
+                yield items[nextIndex]
+                nextIndex += 1
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+    # fetch()
+
+    def fetchAll(self, items):
+        """
+        Downloads items and waits for all of them
+
+        @type  items: list
+        @param items: FetchItem objects
+
+        @rtype: list
+        @returns: the FetchItem objects
+        """
+        return list(self.fetch(items))
+    # fetchAll()
+
+    def __work(self, items, pending, results, stop):
+        """
+        Downloads items until there are none left or fetch() is done
+
+        @rtype:   None
+        @returns: Nothing
+        """
+        self.__local.connections = {}
+        try:
+            while not stop.is_set():
+                try:
+                    index = pending.get_nowait()
+                except Queue.Empty:
+                    break
+
+                error = None
+                try:
+                    self.__fetchItem(items[index])
+                except Exception, e:
+                    error = e
+                    if not isinstance(e, FetchError):
+                        error = FetchError("%s: %s" % (items[index].url, e))
+
+                results.put((index, error))
+        finally:
+            self.__dropConnections()
+    # __work()
+
+    def __fetchItem(self, item):
+        """
+        Downloads and verifies a single item, retrying on network errors
+
+        @rtype:   None
+        @returns: Nothing
+        """
+        directory = os.path.dirname(item.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another worker may have created it meanwhile
+                if not os.path.isdir(directory):
+                    raise
+
+        for attempt in range(RETRIES):
+            try:
+                self.__download(item)
+                return
+
+            except (httplib.HTTPException, socket.error), e:
+                # the server may have closed a connection we kept open
+                self.__dropConnections()
+                if attempt == RETRIES - 1:
+                    raise FetchError("%s: %s" % (item.url, e))
+
+                if self.__logger:
+                    self.__logger.debug('Retrying %s: %s' % (item.url, e))
+    # __fetchItem()
+
+    def __download(self, item):
+        """
+        Streams item to disk, computing its checksum on the way
+
+        @rtype:   None
+        @returns: Nothing
+        """
+        scheme = urlparse.urlsplit(item.url)[0]
+
+        if scheme == 'file':
+            source = open(urllib2.url2pathname(item.url[len('file://'):]), 'rb')
+        else:
+            source = self.__open(item.url, item.proxies)
+
+        csum = None
+        if item.csumType:
+            csum = newChecksum(item.csumType)
+
+        partial = item.path + '.part'
+        size = 0
+        try:
+            try:
+                with open(partial, 'wb') as target:
+                    while True:
+                        data = source.read(CHUNK_SIZE)
+                        if not data:
+                            break
+
+                        target.write(data)
+                        size += len(data)
+                        if csum is not None:
+                            csum.update(data)
+            finally:
+                source.close()
+
+            if item.size is not None and size != item.size:
+                raise FetchError("%s: got %d bytes, expected %d" %
+                                 (item.url, size, item.size))
+
+            if csum is not None and csum.hexdigest() != item.csum:
+                raise FetchError("%s: %s checksum mismatch" %
+                                 (item.url, item.csumType))
+        except:
+            # a broken download is never left behind, retried or not
+            try:
+                os.unlink(partial)
+            except OSError:
+                pass
+            raise
+
+        os.rename(partial, item.path)
+    # __download()
+
+    def __open(self, url, proxies):
+        """
+        Opens url, following redirects
+
+        Plain http and https requests go over this worker's connection to
+        the server, anything else is left to urllib2.
+
+        @type  url: basestring
+        @param url: http, https or ftp URL
+
+        @type  proxies: dict
+        @param proxies: URL scheme to proxy URL, None for the environment
+
+        @rtype: file-like object
+        @returns: response to read the file from
+        """
+        for redirect in range(MAX_REDIRECTS + 1):
+            if urlparse.urlsplit(url)[0] not in ('http', 'https') or \
+               proxyFor(url, proxies) is not None:
+                return self.__openUrllib(url, proxies)
+
+            response = self.__openHttp(url)
+            if response.status == httplib.OK:
+                return response
+
+            response.read()
+            location = response.getheader('location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                raise FetchError("%s: HTTP %d %s" %
+                                 (url, response.status, response.reason))
+
+            url = urlparse.urljoin(url, location)
+
+        raise FetchError("%s: more than %d redirects" % (url, MAX_REDIRECTS))
+    # __open()
+
+    def __openUrllib(self, url, proxies):
+        """
+        Opens url with urllib2, through a proxy if one applies
+
+        @rtype: file-like object
+        @returns: response to read the file from
+        """
+        proxy = proxyFor(url, proxies)
+        if proxy is None:
+            handler = urllib2.ProxyHandler({})
+        else:
+            handler = urllib2.ProxyHandler({urlparse.urlsplit(url)[0]: proxy})
+
+        try:
+            return urllib2.build_opener(handler).open(url, timeout=TIMEOUT)
+        except urllib2.HTTPError, e:
+            raise FetchError("%s: HTTP %d %s" % (url, e.code, e.msg))
+        except urllib2.URLError, e:
+            # retried like the errors of this worker's own connections
+            raise socket.error(str(e.reason))
+    # __openUrllib()
+
+    def __openHttp(self, url):
+        """
+        Sends a GET for url over this worker's connection to its server
+
+        @rtype: httplib.HTTPResponse
+        @returns: the response, whatever its status
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+
+        connection = self.__local.connections.get(key)
+        if connection is None:
+            if parts.scheme == 'https':
+                connection = httplib.HTTPSConnection(parts.netloc,
+                                                     timeout=TIMEOUT)
+            else:
+                connection = httplib.HTTPConnection(parts.netloc,
+                                                    timeout=TIMEOUT)
+            self.__local.connections[key] = connection
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        connection.request('GET', path)
+        return connection.getresponse()
+    # __openHttp()
+
+    def __dropConnections(self):
+        """
+        Closes this worker's connections, the one that failed may be to the
+        server a file was redirected to
+
+        @rtype:   None
+        @returns: Nothing
+        """
+        for connection in self.__local.connections.values():
+            connection.close()
+        self.__local.connections.clear()
+    # __dropConnections()
+# PackageFetcher()
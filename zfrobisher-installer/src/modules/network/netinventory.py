@@ -0,0 +1,331 @@
+#!/usr/bin/python
+
+#
+# IMPORTS
+#
+from copy import copy
+from subprocess import Popen, PIPE
+
+import ethtool
+import os
+import re
+import select
+import socket
+import threading
+
+
+#
+# CONSTANTS AND DEFINITIONS
+#
+__all__ = [ "inventory", "NetInterface" ]
+
+SYS_CLASS_NET = '/sys/class/net'
+SYS_VIRTUAL_NET = '/sys/devices/virtual/net'
+UDEV_DATA = '/run/udev/data'
+
+# rtnetlink multicast groups of link changes and IPv4 address changes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+
+#
+# CODE
+#
+class NetInterface(object):
+    """
+    What is known about a network interface
+    """
+    __slots__ = ['name', 'index', 'mac', 'driver', 'link', 'virtual',
+                 'predictableName', 'address']
+
+    def udevName(self):
+        """
+        Returns the name the interface gets from the udev predictable rules
+
+        @rtype: basestring
+        @returns: ID_NET_NAME_PATH of the interface, or its name if it has
+                  none
+        """
+        return self.predictableName or self.name
+    # udevName()
+# NetInterface()
+
+
+def read_attr(name, attr):
+    """
+    Reads an attribute of a network interface from sysfs
+
+    @type  name: basestring
+    @param name: interface name
+
+    @type  attr: basestring
+    @param attr: attribute name, ie: 'address'
+
+    @rtype: basestring or None
+    @returns: the stripped attribute contents, None if it cannot be read
+              (ie: carrier of an interface that is down)
+    """
+    try:
+        with open(os.path.join(SYS_CLASS_NET, name, attr)) as fd:
+            return fd.read().strip()
+    except (IOError, OSError):
+        return None
+# read_attr()
+
+
+def read_udev_properties(index):
+    """
+    Reads the properties udev keeps for a network interface in its database
+
+    @type  index: basestring
+    @param index: interface index
+
+    @rtype: dict
+    @returns: property name to value, empty if udev knows nothing about it
+    """
+    properties = {}
+    try:
+        with open(os.path.join(UDEV_DATA, 'n%s' % index)) as fd:
+            lines = fd.readlines()
+    except (IOError, OSError):
+        return properties
+
+    for line in lines:
+        if line.startswith('E:') and '=' in line:
+            (key, value) = line[2:].rstrip('\n').split('=', 1)
+            properties[key] = value
+
+    return properties
+# read_udev_properties()
+
+
+def snapshot_interface(name):
+    """
+    Collects what is known about an interface without running any program
+
+    @type  name: basestring
+    @param name: interface name
+
+    @rtype: NetInterface
+    @returns: the interface
+    """
+    iface = NetInterface()
+    iface.name = name
+    iface.index = read_attr(name, 'ifindex')
+    iface.mac = read_attr(name, 'address')
+    iface.link = read_attr(name, 'carrier') == '1'
+    iface.virtual = os.path.exists(os.path.join(SYS_VIRTUAL_NET, name))
+
+    driver = os.path.join(SYS_CLASS_NET, name, 'device', 'driver')
+    if os.path.islink(driver):
+        iface.driver = os.path.basename(os.readlink(driver))
+    else:
+        iface.driver = None
+
+    iface.predictableName = None
+    if iface.index is not None:
+        properties = read_udev_properties(iface.index)
+        iface.predictableName = properties.get('ID_NET_NAME_PATH')
+
+    # the IPv4 address is not in sysfs, but an ioctl gets it without a fork
+    try:
+        iface.address = ethtool.get_ipaddr(name)
+    except (IOError, OSError):
+        iface.address = None
+    if iface.address == '0.0.0.0':
+        iface.address = None
+
+    return iface
+# snapshot_interface()
+
+
+def parse_znetconf(out):
+    """
+    Parses the unconfigured devices znetconf -u lists
+
+    @type  out: basestring
+    @param out: znetconf -u output
+
+    @rtype: dict
+    @returns: device bus ID to the type of the interface, OSA devices only
+    """
+    interfaces = {}
+    dev_str_list = re.split(r'-+', out)
+    if len(dev_str_list) <= 1:
+        return interfaces
+
+    for dev_item in dev_str_list[1].strip().split("\n"):
+        dev_parts = dev_item.split(" ")
+        if len(dev_parts) < 4:
+            continue
+        dev_type = "%s%s" % (dev_parts[2], dev_parts[3])
+        # filter the non-OSA interfaces out
+        if dev_type == "OSA(QDIO)":
+            interfaces[dev_parts[0]] = dev_type
+
+    return interfaces
+# parse_znetconf()
+
+
+class NetInventory(object):
+    """
+    Keeps what is known about the network interfaces between queries
+
+    All interfaces are read from sysfs in one pass the first time they are
+    asked for, and again once the kernel reports a link or an IPv4 address
+    change through rtnetlink. If that cannot be listened to, every query
+    reads them again.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__lock = threading.Lock()
+        self.__interfaces = None
+        self.__unconfigured = None
+        self.__socket = None
+        self.__listening = False
+    # __init__()
+
+    def __listen(self):
+        """
+        Subscribes to the rtnetlink link and address events, once
+
+        @rtype:   None
+        @returns: Nothing
+        """
+        if self.__listening:
+            return
+
+        self.__listening = True
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                 socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+            sock.setblocking(0)
+            self.__socket = sock
+        except (AttributeError, socket.error):
+            self.__socket = None
+    # __listen()
+
+    def __changed(self):
+        """
+        Drains the pending rtnetlink messages
+
+        @rtype: bool
+        @returns: True if any arrived since the last call, or if there is no
+                  telling
+        """
+        if self.__socket is None:
+            return True
+
+        changed = False
+        while True:
+            (ready, _w, _x) = select.select([self.__socket], [], [], 0)
+            if not ready:
+                return changed
+
+            # the messages only matter for having arrived; an error here
+            # means the socket buffer overran and some of them were lost
+            changed = True
+            try:
+                self.__socket.recv(65536)
+            except socket.error:
+                return True
+    # __changed()
+
+    def __check(self):
+        """
+        Forgets everything if the interfaces changed, the lock must be held
+
+        @rtype:   None
+        @returns: Nothing
+        """
+        self.__listen()
+        if self.__changed():
+            self.__interfaces = None
+            self.__unconfigured = None
+    # __check()
+
+    def refresh(self):
+        """
+        Forgets everything, so the next query reads the interfaces again
+
+        @rtype:   None
+        @returns: Nothing
+        """
+        with self.__lock:
+            self.__interfaces = None
+            self.__unconfigured = None
+    # refresh()
+
+    def interfaces(self):
+        """
+        Returns all network interfaces on the system
+
+        @rtype: list
+        @returns: copies of the NetInterface objects, ordered by index
+        """
+        with self.__lock:
+            self.__check()
+            if self.__interfaces is None:
+                try:
+                    names = [n for n in os.listdir(SYS_CLASS_NET)
+                                if os.path.isdir(os.path.join(SYS_CLASS_NET,
+                                                              n))]
+                except OSError:
+                    names = []
+
+                interfaces = [snapshot_interface(n) for n in names]
+                interfaces.sort(key=lambda i: int(i.index or 0))
+                self.__interfaces = interfaces
+
+            return [copy(i) for i in self.__interfaces]
+    # interfaces()
+
+    def interface(self, name):
+        """
+        Returns an interface by its name
+
+        @type  name: basestring
+        @param name: interface name
+
+        @rtype: NetInterface or None
+        @returns: copy of the interface, None if there is none by that name
+        """
+        for iface in self.interfaces():
+            if iface.name == name:
+                return iface
+        return None
+    # interface()
+
+    def unconfigured(self):
+        """
+        Returns the OSA devices that are not configured yet (znetconf -u)
+
+        @rtype: dict
+        @returns: device bus ID to the type of the interface
+        """
+        with self.__lock:
+            self.__check()
+            unconfigured = self.__unconfigured
+
+        if unconfigured is None:
+            proc = Popen(['znetconf', '-u'], stdout=PIPE, stderr=PIPE)
+            out, err = proc.communicate()
+            if proc.returncode != 0:
+                raise Exception(("NETWORK: Failed to list unconfigurd "
+                                 "net devices (exit code = %s):\n%s")
+                                % (proc.returncode, err))
+            unconfigured = parse_znetconf(out)
+
+            with self.__lock:
+                self.__unconfigured = unconfigured
+
+        return dict(unconfigured)
+    # unconfigured()
+# NetInventory()
+
+# the inventory shared by all Network queries
+inventory = NetInventory()
@@ -3,15 +3,16 @@
 #
 # IMPORTS
 #
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE
-from time import sleep
+from modules.network.netinventory import inventory
+from time import sleep, time
 
-import ethtool
 import fileinput
 import os
 import re
-import shlex
 import shutil
+import threading
 import uuid
 
 
@@ -19,6 +20,19 @@ import uuid
 # CONSTANTS
 #
 XML_FILE = '/opt/ibm/zkvm-installer/modules/network/kop.xml'
+IFCFG_FILE = '/etc/sysconfig/network-scripts/ifcfg-%s'
+
+# interfaces restarted at a time by applyNetworkChanges, and how long it
+# waits for them to get their link and address back
+RESTART_THREADS = 8
+READY_TIMEOUT = 30
+READY_POLL_INTERVAL = 0.1
+
+# ifcfg file contents (dict, None if there was no file) of the interfaces
+# as they were when last brought up, kept from the first time each file is
+# rewritten until the change is applied
+APPLIED_CONFIGS = {}
+APPLIED_CONFIGS_LOCK = threading.Lock()
 
 
 #
@@ -40,11 +54,8 @@ class Network:
         @rtype:   list
         @returns: list of Virtual NIC's
         """
-        proc = Popen(['ls', '/sys/devices/virtual/net'], stdout=PIPE, stderr=PIPE)
-        out, err = proc.communicate()
-        if proc.returncode != 0:
-            raise Exception("NETWORK: Failed to list virtual net devices (exit code = %s):\n%s" % (proc.returncode, err))
-        return out.rstrip().split("\n")
+        return [iface.name for iface in inventory.interfaces()
+                    if iface.virtual]
     # getVirtualNic
     getVirtualNic = staticmethod(getVirtualNic)
 
@@ -55,11 +66,11 @@ class Network:
         @rtype:   str
         @returns: NIC name from boot commad line
         """
-        proc = Popen(['cat', '/proc/cmdline'], stdout=PIPE, stderr=PIPE)
-        out, err = proc.communicate()
-        if proc.returncode != 0:
-            raise Exception("NETWORK: Failed to get cmdline from /proc/cmdlline (exit code = %s):\n%s" % (proc.returncode, err))
-        cmdLine = out.rstrip()
+        try:
+            with open('/proc/cmdline') as fd:
+                cmdLine = fd.read().rstrip()
+        except IOError, e:
+            raise Exception("NETWORK: Failed to get cmdline from /proc/cmdline:\n%s" % e)
         ifName = None
         for i in cmdLine.split(" "):
             if i.startswith("ifname"):
@@ -76,30 +87,34 @@ class Network:
         @rtype:   str
         @returns: NIC name according UDEV predictable rules.
         """
-        device = None
-        ifName = Network.getCmdLineNIC()
-        if ifName == dev:
-            device = ifName
-        else:
-            strCmd1 = "udevadm info --query=property --path=/sys/class/net/%s"
-            cmd2 = "grep ID_NET_NAME_PATH"
-            cmd1 = strCmd1 % dev
-            proc1 = Popen(cmd1.split(" "), stdout=PIPE)
-            proc2 = Popen(cmd2.split(" "), stdin=proc1.stdout, stdout=PIPE)
-            proc1.stdout.close()
-            out, err = proc2.communicate()
-            if proc2.returncode == 0:
-                # Found udev predictable NIC name
-                device = out.rstrip().split('=')[1]
-            elif proc2.returncode == 1:
-                # No udev predictable NIC name, use the same dev
-                device = dev
-            else:
-                raise Exception("NETWORK: Failed to get predictable network name from udev (exit code = %s):\n%s" % (proc2.returncode, err))
-        return device
+        iface = inventory.interface(dev)
+        if iface is None:
+            # No udev predictable NIC name, use the same dev
+            return dev
+        return Network.__interfaceName(iface, True)
     # getUdevPredictableName
     getUdevPredictableName = staticmethod(getUdevPredictableName)
 
+    def __interfaceName(iface, liveDVD):
+        """
+        Returns the name to show for an interface
+
+        @type  iface: NetInterface
+        @param iface: interface from the inventory
+
+        @type  liveDVD: boolean
+        @param liveDVD: True is running in liveDVD
+
+        @rtype:   str
+        @returns: the udev predictable name of the interface in liveDVD,
+                  unless it was named in the boot command line, or its name
+        """
+        if liveDVD and iface.name != Network.getCmdLineNIC():
+            return iface.udevName()
+        return iface.name
+    # __interfaceName()
+    __interfaceName = staticmethod(__interfaceName)
+
     def getLinkedInterfaces(liveDVD=True):
         """
         Return a list of all network interfaces on the system with active link
@@ -113,21 +128,8 @@ class Network:
         @rtype:   array
         @returns: list of NIC with active link
         """
-        interfaces = []
-        devices = ethtool.get_devices()
-        for dev in devices:
-            cmd = ['ethtool', dev]
-            proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-            out, err = proc.communicate()
-            if proc.returncode != 0:
-                raise Exception("NETWORK: Failed to execute ethtool on %s (exit code = %s):\n%s" % (dev, proc.returncode, err))
-            if out.rstrip().endswith("Link detected: yes"):
-                if liveDVD:
-                    device = Network.getUdevPredictableName(dev)
-                else:
-                    device = dev
-                interfaces.append(device)
-        return interfaces
+        return [Network.__interfaceName(iface, liveDVD)
+                    for iface in inventory.interfaces() if iface.link]
     # getLinkedInterfaces()
     getLinkedInterfaces = staticmethod(getLinkedInterfaces)
 
@@ -142,15 +144,9 @@ class Network:
         @returns: (key = ethernet interface / value = mac addresss) available
         """
         interfaces = {}
-        devices = ethtool.get_devices()
-        virtualIfaces = Network.getVirtualNic()
-        for dev in devices:
-            if dev not in virtualIfaces:
-                if liveDVD:
-                    device = Network.getUdevPredictableName(dev)
-                else:
-                    device = dev
-                interfaces[device] = ethtool.get_hwaddr(dev)
+        for iface in inventory.interfaces():
+            if not iface.virtual:
+                interfaces[Network.__interfaceName(iface, liveDVD)] = iface.mac
         return interfaces
     # getAvailableInterfaces
     getAvailableInterfaces = staticmethod(getAvailableInterfaces)
@@ -165,26 +161,7 @@ class Network:
         @rtype: dict
         @returns : (key=interface device bus ID / value=type of the interface)
         """
-        interfaces = {}
-        proc = Popen(['znetconf', '-u'], stdout=PIPE, stderr=PIPE)
-        out, err = proc.communicate()
-        if proc.returncode != 0:
-            raise Exception(("NETWORK: Failed to list unconfigurd "
-                             "net devices (exit code = %s):\n%s")
-                            % (proc.returncode, err))
-        split_str = re.compile(r'-+')
-        dev_str_list = split_str.split(out)
-        if len(dev_str_list) > 1:
-            dev_list = dev_str_list[1].strip().split("\n")
-        else:
-            return interfaces
-        for dev_item in dev_list:
-            dev_parts = dev_item.split(" ")
-            dev_type = "%s%s" % (dev_parts[2], dev_parts[3])
-            # filter the non-OSA interfaces out
-            if cmp(dev_type, "OSA(QDIO)") == 0:
-                interfaces[dev_parts[0]] = dev_type
-        return interfaces
+        return inventory.unconfigured()
     # getUnactiveInterfaces
     getUnactiveInterfaces = staticmethod(getUnactiveInterfaces)
 
@@ -219,6 +196,8 @@ class Network:
             raise Exception(("NETWORK: Failed to active net"
                              " devices %s (exit code = %s):\n%s")
                             % (busId, proc.returncode, err))
+        # the new interface and the OSA device it took must show up
+        inventory.refresh()
         eth_name = ""
         with open('/sys/bus/ccwgroup/devices/%s/if_name'
                   % (busId.split(',')[0])) as f:
@@ -256,22 +235,9 @@ class Network:
         @rtype:   array
         @returns: list of NIC with active link
         """
-        interfaces = []
-        devices = list(Network.getAvailableInterfaces(liveDVD).keys())
-        for dev in devices:
-            cmd1 = "ip address show %s" % dev
-            proc1 = Popen(shlex.split(cmd1), stdout=PIPE, stderr=PIPE)
-            cmd2 = "grep inet"
-            proc2 = Popen(shlex.split(cmd2), stdin=proc1.stdout, stdout=PIPE, stderr=PIPE)
-            proc1.stdout.close()
-            output, err = proc2.communicate()
-            if output.lstrip().startswith("inet "):
-                if liveDVD:
-                    device = Network.getUdevPredictableName(dev)
-                else:
-                    device = dev
-                interfaces.append(device)
-        return interfaces
+        return [Network.__interfaceName(iface, liveDVD)
+                    for iface in inventory.interfaces()
+                        if not iface.virtual and iface.address]
     # getActiveInterfaces
     getActiveInterfaces = staticmethod(getActiveInterfaces)
 
@@ -289,9 +255,11 @@ class Network:
         @returns: nothing
         """
         bridge = "br%s" % dev
-        ifcfgFile = "/etc/sysconfig/network-scripts/ifcfg-%s" % bridge
+        ifcfgFile = IFCFG_FILE % bridge
         if mountDir:
             ifcfgFile = mountDir + ifcfgFile
+        else:
+            Network.rememberConfigFile(bridge)
         if os.path.exists(ifcfgFile):
             os.remove(ifcfgFile)
         bridgePath = "/sys/class/net/%s" % bridge
@@ -349,9 +317,11 @@ class Network:
         """
         # remove double quotes from NIC name
         ifname = Network.removeDoubleQuotes(configFile['DEVICE'])
-        ifcfgFile = "/etc/sysconfig/network-scripts/ifcfg-%s" % ifname
+        ifcfgFile = IFCFG_FILE % ifname
         if mountDir:
             ifcfgFile = mountDir + ifcfgFile
+        else:
+            Network.rememberConfigFile(ifname)
 
         line = "# Generated by IBM zKVM installer\n"
         with open(ifcfgFile, "w") as fd:
@@ -402,6 +372,205 @@ class Network:
     # copyConfigFile()
     copyConfigFile = staticmethod(copyConfigFile)
 
+    def readConfigFile(ifname, mountDir=None):
+        """
+        Parse the ifcfg file of an interface
+
+        @type  ifname: str
+        @param ifname: interface name
+
+        @type mountDir: str
+        @param mountDir: mounted directory if is in auto mode
+
+        @rtype: dict or None
+        @returns: the variables set in the file, unquoted, or None if the
+                  interface has no ifcfg file
+        """
+        ifcfgFile = IFCFG_FILE % ifname
+        if mountDir:
+            ifcfgFile = mountDir + ifcfgFile
+
+        try:
+            with open(ifcfgFile) as fd:
+                content = fd.readlines()
+        except IOError:
+            return None
+
+        config = {}
+        for line in content:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            config[key] = Network.removeDoubleQuotes(value)
+        return config
+    # readConfigFile()
+    readConfigFile = staticmethod(readConfigFile)
+
+    def rememberConfigFile(ifname):
+        """
+        Keep the configuration an interface is running with before its ifcfg
+        file is rewritten, unless it was already kept
+
+        @type  ifname: str
+        @param ifname: interface name
+
+        @rtype: None
+        @returns: nothing
+        """
+        with APPLIED_CONFIGS_LOCK:
+            if ifname not in APPLIED_CONFIGS:
+                APPLIED_CONFIGS[ifname] = Network.readConfigFile(ifname)
+    # rememberConfigFile()
+    rememberConfigFile = staticmethod(rememberConfigFile)
+
+    def getChangedInterfaces():
+        """
+        Returns the interfaces whose ifcfg files changed since they were
+        brought up
+
+        @rtype: list
+        @returns: interface names, sorted
+        """
+        with APPLIED_CONFIGS_LOCK:
+            applied = dict(APPLIED_CONFIGS)
+
+        return sorted(ifname for (ifname, config) in applied.iteritems()
+                          if Network.readConfigFile(ifname) != config)
+    # getChangedInterfaces()
+    getChangedInterfaces = staticmethod(getChangedInterfaces)
+
+    def waitInterfaceReady(ifname, address=False, timeout=READY_TIMEOUT):
+        """
+        Wait for an interface to get its link and, if asked, an IPv4 address
+
+        @type  ifname: str
+        @param ifname: interface name
+
+        @type  address: boolean
+        @param address: True to also wait for an IPv4 address
+
+        @type  timeout: int
+        @param timeout: seconds to wait at most
+
+        @rtype: boolean
+        @returns: True if the interface is ready, False on timeout
+        """
+        deadline = time() + timeout
+        while True:
+            iface = inventory.interface(ifname)
+            if iface and iface.link and (iface.address or not address):
+                return True
+            if time() >= deadline:
+                return False
+            sleep(READY_POLL_INTERVAL)
+    # waitInterfaceReady()
+    waitInterfaceReady = staticmethod(waitInterfaceReady)
+
+    def __restartInterfaces(ifnames, timeout):
+        """
+        Bring down and up again the interfaces of a NIC and its bridge, one
+        after another, and wait for the last one brought up to be ready
+
+        @type  ifnames: list
+        @param ifnames: the NIC and/or its bridge, in that order
+
+        @type  timeout: int
+        @param timeout: seconds to wait for the interface to be ready
+
+        @rtype: None
+        @returns: nothing
+        """
+        ready = None
+        for iface in ifnames:
+            config = Network.readConfigFile(iface)
+            if config is None:
+                # the file is gone, deleteBrConfigFile already took the
+                # interface down
+                continue
+
+            proc = Popen(['ifdown', iface], stdout=PIPE, stderr=PIPE)
+            out, err = proc.communicate()
+            if proc.returncode != 0:
+                raise Exception("NETWORK: Failed to deactivate %s (exit code = %s):\n%s" % (iface, proc.returncode, err))
+
+            # Only start network config if ONBOOT=yes
+            if config.get('ONBOOT') == 'yes':
+                proc = Popen(['ifup', iface], stdout=PIPE, stderr=PIPE)
+                out, err = proc.communicate()
+                if proc.returncode != 0:
+                    raise Exception("NETWORK: Failed to activate %s (exit code = %s):\n%s" % (iface, proc.returncode, err))
+                ready = (iface, config)
+
+        if ready is None:
+            return
+
+        iface, config = ready
+        address = config.get('BOOTPROTO') == 'dhcp' or bool(config.get('IPADDR'))
+        if not Network.waitInterfaceReady(iface, address, timeout):
+            raise Exception("NETWORK: %s is not ready after %d seconds" % (iface, timeout))
+    # __restartInterfaces()
+    __restartInterfaces = staticmethod(__restartInterfaces)
+
+    def applyNetworkChanges(nics=None, timeout=READY_TIMEOUT):
+        """
+        Restart only the interfaces whose ifcfg files changed since they were
+        brought up. A NIC and its bridge are restarted one after another,
+        other NICs concurrently. Only NICs with link, or whose bridge has
+        link, are restarted.
+
+        @type  nics: list
+        @param nics: NICs to apply the changes of (along with their bridges),
+                     None for all of them
+
+        @type  timeout: int
+        @param timeout: seconds to wait for each NIC to be ready again
+
+        @rtype: list
+        @returns: the interfaces restarted
+        """
+        groups = {}
+        for iface in Network.getChangedInterfaces():
+            nic = iface
+            if iface.startswith("br"):
+                nic = iface[2:]
+            if nics is not None and nic not in nics:
+                continue
+            groups.setdefault(nic, []).append(iface)
+
+        activeNics = Network.getLinkedInterfaces(False)
+        groups = [sorted(ifaces, key=lambda i: i.startswith("br"))
+                      for (nic, ifaces) in sorted(groups.iteritems())
+                          if nic in activeNics or "br%s" % nic in activeNics]
+        if not groups:
+            return []
+
+        def restart(ifaces):
+            try:
+                Network.__restartInterfaces(ifaces, timeout)
+            except Exception as e:
+                return e
+
+            with APPLIED_CONFIGS_LOCK:
+                for iface in ifaces:
+                    APPLIED_CONFIGS.pop(iface, None)
+            return None
+
+        pool = ThreadPool(min(RESTART_THREADS, len(groups)))
+        try:
+            errors = pool.map(restart, groups, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        errors = [e for e in errors if e is not None]
+        if errors:
+            raise Exception("\n".join(str(e) for e in errors))
+
+        return [iface for ifaces in groups for iface in ifaces]
+    # applyNetworkChanges()
+    applyNetworkChanges = staticmethod(applyNetworkChanges)
+
     def restartNetworkService(mountDir=None, nic=None):
         """
         Restart network service using sysmtectl (systemd)
@@ -430,30 +599,8 @@ class Network:
             if proc.returncode != 0:
                 raise Exception("NETWORK: Failed to enable network service (exit code = %s):\n%s" % (proc.returncode, err))
         elif nic:
-            nics = [nic]
-            bridge = "br%s" % nic
-            ifcfgFilePattern = "/etc/sysconfig/network-scripts/ifcfg-%s"
-            activeNics = Network.getLinkedInterfaces(False)
-            # only restart nic if it has an active link
-            if nic in activeNics or bridge in activeNics:
-                ifcfgFile = ifcfgFilePattern % bridge
-                if os.path.exists(ifcfgFile):
-                    nics.append(bridge)
-
-                for iface in nics:
-                    proc = Popen(['ifdown', iface], stdout=PIPE, stderr=PIPE)
-                    out, err = proc.communicate()
-                    if proc.returncode != 0:
-                        raise Exception("NETWORK: Failed to deactivate %s (exit code = %s):\n%s" % (iface, proc.returncode, err))
-
-                    # Only start network config if ONBOOT=yes
-                    ifcfgFile = ifcfgFilePattern % iface
-                    onboot = "ONBOOT=yes"
-                    if onboot in open(ifcfgFile).read():
-                        proc = Popen(['ifup', iface], stdout=PIPE, stderr=PIPE)
-                        out, err = proc.communicate()
-                        if proc.returncode != 0:
-                            raise Exception("NETWORK: Failed to activate %s (exit code = %s):\n%s" % (iface, proc.returncode, err))
+            # only restart what changed for the nic and its bridge
+            Network.applyNetworkChanges([nic])
         else:
             # manual mode
             # restart network service
@@ -484,12 +631,13 @@ class Network:
         """
         bridge = "br%s" % nic
         nics = [nic, bridge]
-        ifcfgFilePattern = "/etc/sysconfig/network-scripts/ifcfg-%s"
         for iface in nics:
-            ifcfgFile = ifcfgFilePattern % iface
+            ifcfgFile = IFCFG_FILE % iface
             if mountDir:
                 ifcfgFile = mountDir + ifcfgFile
             if os.path.isfile(ifcfgFile):
+                if not mountDir:
+                    Network.rememberConfigFile(iface)
                 searchExp = "ONBOOT=yes"
                 replaceExp = "ONBOOT=no"
                 for line in fileinput.input(ifcfgFile, inplace=1):
@@ -2,25 +2,38 @@
 # IMPORTS
 #
 from copy import deepcopy
+from blivet import sysfs
+from blivet.devicelibs import superblock
+from diskinventory import inventory, read_disk_start, read_msdos_table, MBR_SIGNATURE
 
 import lvminfo
 import os
 import raidinfo
 import re
+import tempfile
 import time
 
+from multiprocessing.pool import ThreadPool
+
 
 #
 # CONSTANTS AND DEFINITIONS
 #
-__all__ = [ "get_hierarchy_physical" ]
+__all__ = [ "get_hierarchy_physical", "refresh_hierarchy_physical" ]
 
 BLOCK_SIZE = 1024
+DEV_DIR = '/dev'
 NOTMOUNT = ("swap", "lvm", "raid", "unknown", "prep", "extended")
 EXTENDED_PARTS = ('5', 'f', '85')
 MPATH_FIND_DM = 'dmsetup info -c --noheadings -o minor /dev/mapper/%s 2>/dev/null'
 SYS_DM_PATH = '/sys/block/dm-%s/slaves/'
-GET_DISK_ID = "udevadm info --query=symlink --name %s | grep -o 'disk/by-id/[[:alnum:][:punct:]]*'"
+
+# filesystems whose free space is read from their superblocks; the others
+# do not record there what df leaves out
+SUPERBLOCK_FS = ("ext2", "ext3", "ext4")
+
+# number of partitions of a disk whose free space is found at a time
+FREE_SPACE_THREADS = 4
 
 
 #
@@ -54,45 +67,6 @@ def check_device(disk):
     return True
 # check_device()
 
-def detect_partition_table_type(name, default = None):
-    """
-    Detects and returns the partition table type of the disk with the passed
-    name. If the detection fails, returns the passed default value. Currently,
-    the only supported partition type is 'msdos'.
-
-    @type  device: basestring
-    @param device: passded disk name (e.g. 'sda', 'sdb', ...)
-
-    @type  default: arbitrary
-    @param default: default value to be returned
-
-    @rtype: basestring or None
-    @returns: detected partition table type, or default
-    """
-    # try to read the 511/512 bytes of a disk
-    try:
-        # read the MBR signature, bytes 511 and 512
-        stream = open('/dev/%s' % name, 'r')
-        stream.seek(510)
-        data = stream.read(2)
-        stream.close()
-
-    # impossible to read the disk: return default
-    except IOError:
-        return default
-
-    # permissions issues: return default
-    except OSError:
-        return default
-
-    # MS-DOS partition table signature (0xAA55): return it
-    if ord(data[0]) == 0x55 and ord(data[1]) == 0xAA:
-        return 'msdos'
-
-    # unknown partition: return the default value
-    return default
-# detect_partition_table_type()
-
 def detect_multipath_scheme():
     """
     Detects an return the multipath scheme of the system.
@@ -133,31 +107,6 @@ def detect_multipath_scheme():
     return topology
 # detect_multipath_scheme()
 
-def get_disk_id(diskName, default = None):
-    """
-    Return the unique identifier of the disk
-
-    @type  diskName: basestring
-    @param diskName: disk name, ex: 'sda'
-
-    @type  default: arbitrary
-    @param default: default value to be returned
-
-    @rtype:   string
-    @returns: disk id, ex: /dev/disk/by-id/.
-    """
-    # get id by udevadm
-    command = os.popen(GET_DISK_ID % diskName)
-    id = command.readline()
-
-    # command did not return in disk/by-id format: return default
-    if "disk/by-id" not in id:
-        return default
-
-    # remove break lines and return
-    return '/dev/' + id.replace("\n","")
-# get_disk_id()
-
 def get_disk_size(disk, default = None):
     """
     Returns the size of the passed disk. If it cannot be determined,
@@ -210,7 +159,8 @@ def get_multipath_info(name, multipaths):
     return None, []
 # get_multipath_info()
 
-def new_disk(disks, name, size, type, sectorSize, master, slaves, id):
+def new_disk(disks, name, size, type, sectorSize, master, slaves, id,
+             accessible=None):
     # invalid list of disks: fail
     if disks is None:
         return False
@@ -229,7 +179,9 @@ def new_disk(disks, name, size, type, sectorSize, master, slaves, id):
     disk['mpath_master'] = master
     disk['mpath_slaves'] = slaves
     disk['id'] =  id
-    disk['accessible'] = check_device(name)
+    if accessible is None:
+        accessible = check_device(name)
+    disk['accessible'] = accessible
 
     # append it to the list of disks
     disks.append(disk)
@@ -268,6 +220,7 @@ def add_parts(disk, partConf):
         parts.extend(part['childParts'])
         spaces.extend(part['emptySpaces'])
 
+    found = []
     for part in parts:
         if 'mpath' in part['name']:
             # The device-mapper names on MCP6.1 prefix the partition number
@@ -281,17 +234,35 @@ def add_parts(disk, partConf):
 
             # get partition type
             ptype = get_ptype(part['name'], fstype)
-
-            # get free space in partition
-            free = get_part_free_space(part['name'], fstype, partConf['sectorSize'])
         except:
             # we are here possibly because of an usb floppy from hell. Just ignore it
             continue
 
-        if ptype == 'E':
-            size = 1
-        else:
-            size = part['size']
+        found.append((part, fstype, ptype))
+
+    # get free space in the partitions, several of them at a time
+    def free_space(args):
+        (part, fstype, ptype) = args
+        try:
+            return get_part_free_space(part['name'], fstype,
+                                       partConf['sectorSize'])
+        except:
+            # same as above, the partition cannot be read
+            return None
+
+    frees = []
+    if found:
+        pool = ThreadPool(min(FREE_SPACE_THREADS, len(found)))
+        try:
+            frees = pool.map(free_space, found, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    for ((part, fstype, ptype), free) in zip(found, frees):
+        if free is None:
+            continue
+
         new_part(disk, part, free, fstype, ptype)
 
     for space in spaces:
@@ -321,15 +292,11 @@ def get_partition_lines():
 def is_removable(name):
     # Verify whether our disk is removable
     # If it is, skip it
-    path = os.path.join('/sys/block', name)
-    try:
-        f = open(os.path.join(path, 'removable'))
-        line = f.readline()
-        f.close()
-    except:
+    removable = sysfs.get_attr('/class/block/%s' % name, 'removable')
+    if removable is None:
         return False
 
-    if int(line.strip()):
+    if int(removable):
         return True
 
     return False
@@ -349,24 +316,103 @@ def get_ptype(name, fstype):
 # get_ptype()
 
 def get_part_free_space(name, fstype, sectorSize):
-    if fstype not in NOTMOUNT:
-        # mount the partition at /tmp/mnt
-        cmdLine = "mount -t %s /dev/%s /tmp/mnt 2>/dev/null" % (fstype, name)
-        os.system(cmdLine)
+    """
+    Returns the free space of the filesystem on a partition
 
-        # Use 'df' to retrieve the used space
-        cmdLine = "df --block-size %d /tmp/mnt" % sectorSize
-        pipe = os.popen(cmdLine)
-        partData = pipe.read()
-        free = int(partData.strip().split()[-3])
-        pipe.close()
-        os.system("umount /tmp/mnt 2>/dev/null")
-    else:
-        free = -1
+    The space is read from the filesystem superblock when its type is known,
+    otherwise the partition is mounted read-only and measured with df.
+
+    @type  name: basestring
+    @param name: partition name (sda1, dasda2, etc)
+
+    @type  fstype: basestring
+    @param fstype: filesystem type
+
+    @type  sectorSize: int
+    @param sectorSize: sector size of the disk in bytes
 
-    return free
+    @rtype: int
+    @returns: free space in sectors, -1 for partitions that hold no
+              filesystem or cannot be mounted
+    """
+    if fstype in NOTMOUNT:
+        return -1
+
+    free = estimate_free_space(name, fstype)
+    if free is None:
+        return get_mounted_free_space(name, fstype, sectorSize)
+
+    # df rounds up as well
+    return (free + sectorSize - 1) / sectorSize
 # get_part_free_space()
 
+def estimate_free_space(name, fstype):
+    """
+    Reads the space available to users of a filesystem from its superblock,
+    without mounting it
+
+    @type  name: basestring
+    @param name: partition name (sda1, dasda2, etc)
+
+    @type  fstype: basestring
+    @param fstype: filesystem type
+
+    @rtype: int or None
+    @returns: free space in bytes, or None if it cannot be read this way
+    """
+    if fstype not in SUPERBLOCK_FS:
+        return None
+
+    sb = superblock.read_superblock(os.path.join(DEV_DIR, name), fstype)
+    if sb is None or sb.free_blocks is None or sb.reserved_blocks is None:
+        return None
+
+    # df leaves out the blocks reserved for root
+    return max(0, sb.free_blocks - sb.reserved_blocks) * sb.block_size
+# estimate_free_space()
+
+def get_mounted_free_space(name, fstype, sectorSize):
+    """
+    Mounts a partition read-only on a temporary directory and returns its
+    free space as reported by df
+
+    @type  name: basestring
+    @param name: partition name (sda1, dasda2, etc)
+
+    @type  fstype: basestring
+    @param fstype: filesystem type
+
+    @type  sectorSize: int
+    @param sectorSize: sector size of the disk in bytes
+
+    @rtype: int
+    @returns: free space in sectors, -1 if the partition cannot be mounted
+    """
+    mountPoint = tempfile.mkdtemp(prefix='discinfo-')
+    try:
+        cmdLine = "mount -o ro -t %s %s %s 2>/dev/null" % \
+                  (fstype, os.path.join(DEV_DIR, name), mountPoint)
+        if os.system(cmdLine) != 0:
+            # df would measure the filesystem of the empty directory
+            return -1
+
+        try:
+            # Use 'df' to retrieve the used space
+            cmdLine = "df --block-size %d %s" % (sectorSize, mountPoint)
+            pipe = os.popen(cmdLine)
+            partData = pipe.read()
+            pipe.close()
+        finally:
+            os.system("umount %s 2>/dev/null" % mountPoint)
+    finally:
+        try:
+            os.rmdir(mountPoint)
+        except OSError:
+            pass
+
+    return int(partData.strip().split()[-3])
+# get_mounted_free_space()
+
 def get_fstype(part):
     # first let's see if this is either a PReP or a LVM
     if part['id'].lower() == '8e':
@@ -452,21 +498,58 @@ def isNumber(c):
 # isNumber()
 
 def get_hierarchy_physical(use_multipath=False):
-    # create a temp dir to mount the partitions in order to determine their free space
-    try:
-        os.mkdir("/tmp/mnt")
-    except OSError:
-        os.system("umount /tmp/mnt 2>/dev/null")
-
     # parse lines
     entries = get_partition_lines()
 
     # detect the multipath topology for this machine
     multipaths = detect_multipath_scheme()
 
-    # build disk hierarchy from the entries
-    disks = []
+    # build disk hierarchy from the entries, probing the disks concurrently
+    # and reusing the entries of the disks that did not change
+    topology = tuple(sorted((master, tuple(sorted(slaves)))
+                                for (master, slaves) in multipaths.items()))
+    sysfs.sysfs_cache_load()
+    try:
+        names = get_physical_disk_names(entries)
+        disks = inventory.probe(names,
+            lambda snapshot: build_physical_disk(snapshot, multipaths),
+            context=topology)
+    finally:
+        sysfs.sysfs_cache_invalidate()
+
+    # now let's sort the partitions in our list based upon their actual position on the disks
+    for d in disks:
+        if len(d['parts']) > 0:
+            d['parts'].sort(lambda x, y: x['start'] - y['start'])
+
+    return disks
+# get_hierarchy_physical()
+
+def refresh_hierarchy_physical(name=None):
+    """
+    Makes the next get_hierarchy_physical probe a disk, or all of them,
+    again instead of reusing what was found before
+
+    @type  name: basestring
+    @param name: disk name (sda, dasda, etc), None for all disks
+
+    @rtype: None
+    @returns: nothing
+    """
+    inventory.refresh(name)
+# refresh_hierarchy_physical()
+
+def get_physical_disk_names(entries):
+    """
+    Returns the names of the disks to build the hierarchy from
 
+    @type  entries: list
+    @param entries: /proc/partitions lines as returned by get_partition_lines
+
+    @rtype: list
+    @returns: names of the non removable disks
+    """
+    names = []
     for e in entries:
         name = e[3]
 
@@ -477,51 +560,70 @@ def get_hierarchy_physical(use_multipath=False):
             if is_removable(name):
                 continue
 
-            # detect the partition table type of this disk
-            type = detect_partition_table_type(name)
+            names.append(name)
 
-            # get multipath info for the device
-            master, slaves = get_multipath_info(name, multipaths)
+    return names
+# get_physical_disk_names()
 
-            # get disk id
-            id = get_disk_id(name)
+def build_physical_disk(snapshot, multipaths):
+    """
+    Builds the hierarchy entry of a disk
 
-            # FIXME: sfdisk is always returning 512 bytes as the
-            # sector size for a disk.  Even on 4k disks, it's
-            # returning 512 bytes.  It's a bug!  To workaround that,
-            # we always use sector size from get_sector_size() which
-            # reads value from /sys/block/<dev>/queue/physical_block_size.
-            sector_size = get_sector_size(name)
+    @type  snapshot: DiskSnapshot
+    @param snapshot: sysfs attributes and label sectors of the disk
 
-            # non-msdos partition table: cannot read partitions, add empty disk
-            if type != 'msdos':
-                size = get_disk_size(name) / sector_size
-                new_disk(disks, name, size, type, sector_size, master, slaves, id)
-                empty = {'start': 1, 'size': size - 1}
-                new_part(disks[-1], empty, size, '', '')
-                continue
+    @type  multipaths: dict
+    @param multipaths: multipath topology to be used
 
-            # msdos but could not read partitions: ignore disk
-            partConf = parseParts(name)
+    @rtype: dict or None
+    @returns: the disk hierarchy entry, or None if the disk must be left out
+    """
+    disks = []
+    name = snapshot.name
+
+    # detect the partition table type of this disk
+    type = None
+    if snapshot.start and snapshot.start[510:512] == MBR_SIGNATURE:
+        type = 'msdos'
+
+    # get multipath info for the device
+    master, slaves = get_multipath_info(name, multipaths)
+
+    # FIXME: sfdisk is always returning 512 bytes as the
+    # sector size for a disk.  Even on 4k disks, it's
+    # returning 512 bytes.  It's a bug!  To workaround that,
+    # we always use the sector size from
+    # /sys/block/<dev>/queue/logical_block_size.
+    sector_size = snapshot.sectorSize
+
+    # non-msdos partition table: cannot read partitions, add empty disk
+    if type != 'msdos':
+        if snapshot.size is not None:
+            size = snapshot.size / sector_size
+        else:
+            size = get_disk_size(name) / sector_size
+        new_disk(disks, name, size, type, sector_size, master, slaves,
+                 snapshot.id, snapshot.accessible)
+        empty = {'start': 1, 'size': size - 1}
+        new_part(disks[-1], empty, size, '', '')
+        return disks[-1]
 
-            if not isinstance(partConf, dict):
-                continue
+    # msdos but could not read partitions: ignore disk
+    partConf = parseParts(name, snapshot)
 
-            # append new disk
-            new_disk(disks, name, partConf['diskSize'], type, sector_size,
-                     master, slaves, id)
-            disk = disks[-1]
+    if not isinstance(partConf, dict):
+        return None
 
-            # append disk partitions
-            add_parts(disk, partConf)
+    # append new disk
+    new_disk(disks, name, partConf['diskSize'], type, sector_size,
+             master, slaves, snapshot.id, snapshot.accessible)
+    disk = disks[-1]
 
-    # now let's sort the partitions in our list based upon their actual position on the disks
-    for d in disks:
-        if len(d['parts']) > 0:
-            d['parts'].sort(lambda x, y: x['start'] - y['start'])
+    # append disk partitions
+    add_parts(disk, partConf)
 
-    return disks
-# get_hierarchy_physical()
+    return disk
+# build_physical_disk()
 
 def get_hierarchy_lvm(physical):
     """
@@ -630,9 +732,7 @@ def get_sector_size(disk, default = 512):
     @returns: sector size in bytes
     """
     # read the sector size from sysfs
-    stream = open('/sys/block/%s/queue/logical_block_size' % disk, 'r')
-    data = stream.read().strip()
-    stream.close()
+    data = sysfs.get_attr('/class/block/%s' % disk, 'queue/logical_block_size')
 
     # convert it to int and return
     try:
@@ -643,9 +743,7 @@ def get_sector_size(disk, default = 512):
         return default
 # get_sector_size()
 
-def parseParts(disk_name):
-
-    disk = '/dev/%s' % disk_name
+def parseParts(disk_name, snapshot=None):
 
     partConf = {}
     partConf['headers'] = []
@@ -654,81 +752,36 @@ def parseParts(disk_name):
     partConf['extendedParts'] = []
     partConf['allParts'] = []
 
-    # Dump partitions
-    pipe = os.popen('sfdisk -dx %s 2>/dev/null' % disk)
-    dump = pipe.read().strip()
-    if pipe.close() != None:
-        return 'Error running sfdisk command'
-
-    # Determine disk size in sectors
-    # First, determine block size
-    pipe = os.popen('sfdisk -l -uB %s 2>/dev/null' % disk)
-    output = pipe.readlines()
-    pipe.close()
-    blockSize = 0
-    for line in output:
-        if line.startswith('Units') and line.find('blocks of ') > -1:
-            try:
-                blockSize = int(line.split('blocks of ')[1].split()[0])
-            except:
-                return 'Error determining disk block size'
-            break
-    if blockSize == 0:
-        return 'Could not determine disk block size'
     # Determine sector size
-    sectorSize = get_sector_size(disk_name)
+    if snapshot is not None:
+        sectorSize = snapshot.sectorSize
+    else:
+        sectorSize = get_sector_size(disk_name)
     if sectorSize == 0:
         return 'Could not determine disk sector size'
     partConf['sectorSize'] = sectorSize
-    # Now, do the math
-    pipe = os.popen('sfdisk -s %s' % disk)
-    output = pipe.read().strip()
-    pipe.close()
-    try:
-        diskBlocks = int(output)
-        partConf['diskSize'] = int((diskBlocks * blockSize) / sectorSize)
-    except:
+
+    # Determine disk size in sectors
+    if snapshot is not None:
+        diskBytes = snapshot.size
+    else:
+        diskBytes = get_disk_size(disk_name)
+    if diskBytes is None:
         return 'Error determining disk size'
+    partConf['diskSize'] = int(diskBytes / sectorSize)
 
-    # Add each partition to the list
-    dump = dump.split('\n')
-    saveHeader = True
-    i = 0
-    while i < len(dump):
-        line = dump[i]
-        i = i + 1
-        # not a partition line: save as header or discard
-        if not line.startswith('/dev/'):
-            if saveHeader:
-                partConf['headers'].append(line)
-            continue
-        saveHeader = False
+    # Read the partition table
+    if snapshot is not None:
+        entries = snapshot.parts
+    else:
+        start = read_disk_start(disk_name, sectorSize)
+        entries = read_msdos_table(disk_name, start, sectorSize)
+    if entries is None:
+        return 'Error reading the partition table'
 
-        try:
-            fields = line.split()
-            name = line.split()[0].strip('/dev/').strip(':')
-            start = int(line.split('start=')[1].split(',')[0].strip())
-            size = int(line.split('size=')[1].split(',')[0].strip())
-            id = line.split('Id=')[1].split(',')[0].strip()
-            number = int(re.search('(\d+)$', name).group(1))
-        except:
-            return 'Error retrieving values from sfdisk dump'
-
-        end = start + size - 1
-        part = { 'name': name, 'start': start, 'end': end, 'size': size,
-                'id': id, 'nr': number}
-
-        # partition is logical
-        if part['nr'] > 4:
-            # we need to store the next logical partition info
-            nextLine = dump[i]
-            i = i + 3
-            try:
-                part['nextStart'] = int(nextLine.split('start=')[1].split(',')[0].strip())
-                part['nextSize'] = int(nextLine.split('size=')[1].split(',')[0].strip())
-                part['nextId'] = nextLine.split('Id=')[1].split(',')[0].strip()
-            except:
-                return 'Error retrieving values from sfdisk dump'
+    # Add each partition to the list
+    for part in entries:
+        id = part['id']
 
         # Add to appropriate list. At this moment we are possibly
         # adding to the primary list a partition that is inside an extended
@@ -0,0 +1,440 @@
+#
+# IMPORTS
+#
+from blivet import sysfs
+from blivet.devicelibs import superblock
+from copy import deepcopy
+from multiprocessing.pool import ThreadPool
+
+import hashlib
+import os
+import struct
+import threading
+
+
+#
+# CONSTANTS AND DEFINITIONS
+#
+__all__ = [ "inventory", "read_disk_start", "read_msdos_table" ]
+
+# the MBR, the GPT header and 128 GPT entries of 128 bytes with 512 byte
+# sectors; reading them all at once covers any label the disks may carry
+PROBE_SECTORS = 34
+
+# bytes 511 and 512 of an MBR or EBR
+MBR_SIGNATURE = '\x55\xaa'
+MBR_ENTRIES_OFFSET = 446
+MBR_ENTRY_SIZE = 16
+
+EXTENDED_TYPES = (0x5, 0xf, 0x85)
+
+# at most this many logical partitions are followed in an EBR chain
+MAX_LOGICAL_PARTS = 128
+
+DEV_DIR = '/dev'
+DISK_BY_ID = '/dev/disk/by-id'
+PROBE_THREADS = 8
+
+
+#
+# CODE
+#
+class DiskSnapshot(object):
+    """
+    What is known about a disk before building its hierarchy entry
+    """
+    __slots__ = ['name', 'dev', 'size', 'sectorSize', 'id', 'start',
+                 'accessible', 'parts', 'contents']
+
+    def key(self):
+        """
+        Identifies the disk across probes
+
+        @rtype: tuple
+        @returns: disk name, device number and disk/by-id link
+        """
+        return (self.name, self.dev, self.id)
+    # key()
+
+    def digest(self):
+        """
+        Changes whenever the disk is resized, its label or any EBR is
+        rewritten or the superblock of any of its partitions changes
+
+        @rtype: tuple
+        @returns: size, sector size and checksum of the disk contents
+        """
+        return (self.size, self.sectorSize, self.contents)
+    # digest()
+# DiskSnapshot()
+
+
+def get_disk_ids():
+    """
+    Maps the disks to their /dev/disk/by-id links, reading the links once
+
+    @rtype: dict
+    @returns: device name to the first of its links, ex:
+              {'sda': '/dev/disk/by-id/scsi-36005...'}
+    """
+    ids = {}
+    try:
+        links = sorted(os.listdir(DISK_BY_ID))
+    except OSError:
+        return ids
+
+    for link in links:
+        path = os.path.join(DISK_BY_ID, link)
+        try:
+            name = os.path.basename(os.readlink(path))
+        except OSError:
+            continue
+
+        ids.setdefault(name, path)
+
+    return ids
+# get_disk_ids()
+
+
+def read_disk_start(name, sectorSize):
+    """
+    Reads the sectors that hold the partition table of a disk
+
+    @type  name: basestring
+    @param name: disk name (sda, dasda, etc)
+
+    @type  sectorSize: int
+    @param sectorSize: logical sector size in bytes
+
+    @rtype: str or None
+    @returns: the first PROBE_SECTORS sectors, or None if the disk cannot be
+              read (ie: Buffer I/O errors)
+    """
+    try:
+        fd = os.open(os.path.join(DEV_DIR, name), os.O_RDONLY)
+    except OSError:
+        return None
+
+    try:
+        return os.read(fd, PROBE_SECTORS * sectorSize)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+# read_disk_start()
+
+
+def snapshot_disk(name, ids):
+    """
+    Collects the sysfs attributes and the label sectors of a disk
+
+    @type  name: basestring
+    @param name: disk name (sda, dasda, etc)
+
+    @type  ids: dict
+    @param ids: disk ids as returned by L{get_disk_ids}
+
+    @rtype: DiskSnapshot
+    @returns: the snapshot of the disk
+    """
+    path = '/class/block/%s' % name
+
+    snapshot = DiskSnapshot()
+    snapshot.name = name
+    snapshot.dev = sysfs.get_attr(path, 'dev')
+    snapshot.id = ids.get(name)
+
+    try:
+        snapshot.sectorSize = int(sysfs.get_attr(path,
+                                                 'queue/logical_block_size'))
+    except (TypeError, ValueError):
+        snapshot.sectorSize = 512
+
+    # sysfs always counts 512 byte sectors
+    try:
+        snapshot.size = int(sysfs.get_attr(path, 'size')) * 512
+    except (TypeError, ValueError):
+        snapshot.size = None
+
+    snapshot.start = read_disk_start(name, snapshot.sectorSize)
+    snapshot.accessible = bool(snapshot.start)
+    snapshot.parts = read_msdos_table(name, snapshot.start,
+                                      snapshot.sectorSize)
+    snapshot.contents = checksum_disk(name, snapshot.start, snapshot.parts,
+                                      snapshot.sectorSize)
+
+    return snapshot
+# snapshot_disk()
+
+
+def checksum_disk(name, start, parts, sectorSize):
+    """
+    Checksums what the hierarchy entry of a disk is built from: the label
+    sectors, the EBR chain and the superblock of each partition
+
+    @type  name: basestring
+    @param name: disk name (sda, dasda, etc)
+
+    @type  start: str or None
+    @param start: the first sectors of the disk, as read by L{read_disk_start}
+
+    @type  parts: list or None
+    @param parts: partitions as returned by L{read_msdos_table}
+
+    @type  sectorSize: int
+    @param sectorSize: logical sector size in bytes
+
+    @rtype: basestring
+    @returns: sha1 hex digest
+    """
+    checksum = hashlib.sha1(start or '')
+
+    # the logical partitions carry the EBR links they were read from
+    checksum.update(repr(parts))
+    if not parts:
+        return checksum.hexdigest()
+
+    try:
+        fd = os.open(os.path.join(DEV_DIR, name), os.O_RDONLY)
+    except OSError:
+        return checksum.hexdigest()
+
+    try:
+        for part in parts:
+            if part['size'] == 0 or int(part['id'], 16) in EXTENDED_TYPES:
+                continue
+
+            # filesystem type and free space come from here
+            try:
+                os.lseek(fd, part['start'] * sectorSize, os.SEEK_SET)
+                checksum.update(os.read(fd, superblock.PROBE_SIZE))
+            except OSError:
+                checksum.update('unreadable')
+    finally:
+        os.close(fd)
+
+    return checksum.hexdigest()
+# checksum_disk()
+
+
+def _entries(sector):
+    """
+    Decodes the four partition entries of an MBR or EBR
+
+    @rtype: list
+    @returns: (type, start, size) tuples, in sectors relative to the table
+    """
+    entries = []
+    for i in range(4):
+        offset = MBR_ENTRIES_OFFSET + i * MBR_ENTRY_SIZE
+        (ptype, start, size) = struct.unpack_from('<4xB3xII', sector, offset)
+        entries.append((ptype, start, size))
+
+    return entries
+# _entries()
+
+
+def _new_part(name, nr, ptype, start, size):
+    return {'name': '%s%d' % (name, nr), 'start': start,
+            'end': start + size - 1, 'size': size, 'id': '%x' % ptype,
+            'nr': nr}
+# _new_part()
+
+
+def read_msdos_table(name, start, sectorSize):
+    """
+    Reads an msdos partition table, following the chain of logical
+    partitions in the extended one
+
+    @type  name: basestring
+    @param name: disk name (sda, dasda, etc)
+
+    @type  start: str
+    @param start: the first sectors of the disk, as read by L{read_disk_start}
+
+    @type  sectorSize: int
+    @param sectorSize: logical sector size in bytes
+
+    @rtype: list or None
+    @returns: one dict per partition table entry with the keys sfdisk -dx
+              output used to provide (name, start, end, size, id, nr, and
+              nextStart, nextSize and nextId for logical partitions), or
+              None if the table cannot be read
+    """
+    if start is None or start[510:512] != MBR_SIGNATURE:
+        return None
+
+    parts = []
+    extended = None
+    for (i, (ptype, pstart, psize)) in enumerate(_entries(start)):
+        parts.append(_new_part(name, i + 1, ptype, pstart, psize))
+        if ptype in EXTENDED_TYPES and extended is None:
+            extended = pstart
+
+    if extended is None:
+        return parts
+
+    try:
+        fd = os.open(os.path.join(DEV_DIR, name), os.O_RDONLY)
+    except OSError:
+        return None
+
+    try:
+        ebr = extended
+        seen = set()
+        nr = 5
+        while ebr not in seen and len(seen) < MAX_LOGICAL_PARTS:
+            seen.add(ebr)
+            os.lseek(fd, ebr * sectorSize, os.SEEK_SET)
+            sector = os.read(fd, 512)
+            if len(sector) < 512 or sector[510:512] != MBR_SIGNATURE:
+                break
+
+            entries = _entries(sector)
+            (ptype, pstart, psize) = entries[0]
+            (nextType, nextStart, nextSize) = entries[1]
+
+            if ptype != 0:
+                part = _new_part(name, nr, ptype, ebr + pstart, psize)
+                part['nextStart'] = extended + nextStart if nextType else 0
+                part['nextSize'] = nextSize
+                part['nextId'] = '%x' % nextType
+                parts.append(part)
+                nr += 1
+
+            # the links are relative to the start of the extended partition
+            if nextType not in EXTENDED_TYPES or nextStart == 0:
+                break
+
+            ebr = extended + nextStart
+
+    except OSError:
+        return None
+
+    finally:
+        os.close(fd)
+
+    return parts
+# read_msdos_table()
+
+
+class DiskInventory(object):
+    """
+    Builds the physical disks hierarchy, reusing what is known about disks
+    that did not change since they were last probed
+
+    A disk is probed again when its name, device number or id changes, when
+    its size, the sectors holding its label or EBRs or the superblocks of its
+    partitions change, when the context of the probe changes, when it is
+    refreshed and when the whole inventory is refreshed.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__lock = threading.Lock()
+
+        # disk key -> (generation, (context, digest), hierarchy entry or None)
+        self.__disks = {}
+        self.__generation = 0
+    # __init__()
+
+    def generation(self):
+        """
+        Returns the current generation, bumped by each full refresh
+
+        @rtype: int
+        @returns: generation
+        """
+        return self.__generation
+    # generation()
+
+    def refresh(self, name=None):
+        """
+        Forgets a disk, or all of them, so that they are probed again
+
+        @type  name: basestring
+        @param name: disk name, None for all disks
+
+        @rtype:   None
+        @returns: Nothing
+        """
+        with self.__lock:
+            if name is None:
+                self.__generation += 1
+                self.__disks.clear()
+                return
+
+            for key in self.__disks.keys():
+                if key[0] == name:
+                    del self.__disks[key]
+    # refresh()
+
+    def probe(self, names, build, threads=PROBE_THREADS, context=None):
+        """
+        Returns the hierarchy entries for the passed disks
+
+        @type  names: list
+        @param names: disk names
+
+        @type  build: callable
+        @param build: called as build(snapshot) in a worker thread for the
+                      disks not known yet, returns the disk hierarchy entry
+                      or None to leave the disk out
+
+        @type  threads: int
+        @param threads: number of disks probed at a time
+
+        @type  context: hashable
+        @param context: anything else build depends on (ie: the multipath
+                        topology); entries built in another context are
+                        built again
+
+        @rtype: list
+        @returns: copies of the hierarchy entries, in the order of names
+        """
+        if not names:
+            return []
+
+        ids = get_disk_ids()
+        pool = ThreadPool(max(1, min(threads, len(names))))
+        try:
+            snapshots = pool.map(lambda n: snapshot_disk(n, ids), names,
+                                 chunksize=1)
+
+            with self.__lock:
+                generation = self.__generation
+                known = dict(self.__disks)
+
+            results = {}
+            missing = []
+            for snapshot in snapshots:
+                entry = known.get(snapshot.key())
+                if entry is not None and entry[0] == generation and \
+                   entry[1] == (context, snapshot.digest()):
+                    results[snapshot.name] = entry[2]
+                else:
+                    missing.append(snapshot)
+
+            built = pool.map(build, missing, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        with self.__lock:
+            for (snapshot, disk) in zip(missing, built):
+                results[snapshot.name] = disk
+                if generation == self.__generation:
+                    self.__disks[snapshot.key()] = (generation,
+                                                    (context,
+                                                     snapshot.digest()),
+                                                    disk)
+
+        return [deepcopy(results[name]) for name in names
+                    if results[name] is not None]
+    # probe()
+# DiskInventory()
+
+# the inventory shared by everything that builds the physical hierarchy
+inventory = DiskInventory()
@@ -7,6 +7,7 @@ from discinfo import get_hierarchy_lvm
 from discinfo import get_hierarchy_physical
 from discinfo import get_hierarchy_raid
 from discinfo import get_sector_size
+from discinfo import refresh_hierarchy_physical
 import manage_conventional as conventional
 import manage_lvm as lvm
 import manage_multipath as multipath
@@ -1111,6 +1112,10 @@ class Partitioner(object):
             self.__logger.critical("Stacktrace:" + str(traceback.format_exc()))
             raise ZKVMError("PARTITIONER", "ERROR", "ERROR")
 
+        finally:
+            # the disks changed: do not reuse what was found about them
+            refresh_hierarchy_physical()
+
         self.__logger.info('Process done')
     # __run()
 
@@ -0,0 +1,295 @@
+#!/usr/bin/python
+
+#
+# Points the network inventory at a sysfs and udev database tree made up in
+# a temporary directory, and checks what it and the Network getters report.
+#
+# Run as: cd testcase/network && python test4netinventory.py
+#
+
+#
+# IMPORTS
+#
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "../../src/")        #path for modules.network
+from modules.network import netinventory
+from modules.network import network
+from modules.network.netinventory import NetInventory, parse_znetconf
+from modules.network.network import Network
+
+#
+# CONSTANTS
+#
+ZNETCONF_OUT = """Scanning for network devices...
+Device IDs                 Type    Card Type      CHPID Drv.
+------------------------------------------------------------
+0.0.f500,0.0.f501,0.0.f502 1731/01 OSA (QDIO)        01 qeth
+0.0.f503,0.0.f504,0.0.f505 1731/01 OSA (QDIO)        02 qeth
+0.0.7000,0.0.7001,0.0.7002 1731/05 HiperSockets      05 qeth
+"""
+
+
+#
+# CODE
+#
+class FakeEthtool(object):
+    """
+    Answers the IPv4 address ioctl from a dict
+    """
+    def __init__(self):
+        self.addresses = {}
+
+    def get_ipaddr(self, name):
+        if name not in self.addresses:
+            raise IOError(19, 'No such device')
+        return self.addresses[name]
+# FakeEthtool()
+
+
+class FakeNetlink(object):
+    """
+    Stands in for the socket module, handing the inventory one end of a
+    socket pair to listen on; the test sends the rtnetlink messages
+    """
+    AF_NETLINK = 16
+    SOCK_RAW = socket.SOCK_RAW
+    NETLINK_ROUTE = 0
+    error = socket.error
+
+    def __init__(self):
+        (self.ours, self.theirs) = socket.socketpair()
+
+    def socket(self, family, type, proto):
+        return FakeNetlinkSocket(self.theirs)
+
+    def notify(self):
+        self.ours.send('RTM_NEWLINK')
+# FakeNetlink()
+
+
+class FakeNetlinkSocket(object):
+    def __init__(self, sock):
+        self.sock = sock
+
+    def bind(self, address):
+        pass
+
+    def setblocking(self, flag):
+        self.sock.setblocking(flag)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, size):
+        return self.sock.recv(size)
+# FakeNetlinkSocket()
+
+
+class FakePopen(object):
+    """
+    Runs znetconf -u, printing ZNETCONF_OUT
+    """
+    calls = 0
+
+    def __init__(self, argv, stdout=None, stderr=None):
+        FakePopen.calls += 1
+        self.returncode = 0
+
+    def communicate(self):
+        return (ZNETCONF_OUT, '')
+# FakePopen()
+
+
+class NetInventoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.ethtool = FakeEthtool()
+        self.netlink = FakeNetlink()
+        self.inventory = NetInventory()
+        FakePopen.calls = 0
+
+        self.patch(netinventory, 'SYS_CLASS_NET',
+                   os.path.join(self.root, 'class/net'))
+        self.patch(netinventory, 'SYS_VIRTUAL_NET',
+                   os.path.join(self.root, 'devices/virtual/net'))
+        self.patch(netinventory, 'UDEV_DATA',
+                   os.path.join(self.root, 'udev/data'))
+        self.patch(netinventory, 'ethtool', self.ethtool)
+        self.patch(netinventory, 'socket', self.netlink)
+        self.patch(netinventory, 'Popen', FakePopen)
+        self.patch(network, 'inventory', self.inventory)
+        self.patch(Network, 'getCmdLineNIC', staticmethod(lambda: 'eth1'))
+
+        for path in ('class/net', 'devices/virtual/net', 'udev/data',
+                     'drivers/qeth'):
+            os.makedirs(os.path.join(self.root, path))
+
+        self.addInterface('lo', 1, '00:00:00:00:00:00', link=True,
+                          address='127.0.0.1', virtual=True)
+        self.addInterface('eth0', 2, '02:00:00:00:00:01', link=True,
+                          address='192.168.0.10',
+                          predictable='enccw0.0.f500')
+        self.addInterface('eth1', 3, '02:00:00:00:00:02', link=True,
+                          predictable='enccw0.0.f503')
+        self.addInterface('eth2', 4, '02:00:00:00:00:03', link=False,
+                          address='0.0.0.0')
+        self.addInterface('br0', 10, '02:00:00:00:00:01', link=True,
+                          address='192.168.0.11', virtual=True)
+    # setUp()
+
+    def patch(self, obj, name, value):
+        saved = obj.__dict__[name]
+        setattr(obj, name, value)
+        self.addCleanup(setattr, obj, name, saved)
+    # patch()
+
+    def write(self, path, contents):
+        with open(os.path.join(self.root, path), 'w') as fd:
+            fd.write(contents)
+    # write()
+
+    def addInterface(self, name, index, mac, link, address=None,
+                     virtual=False, predictable=None):
+        directory = os.path.join('class/net', name)
+        os.mkdir(os.path.join(self.root, directory))
+        self.write(os.path.join(directory, 'ifindex'), '%d\n' % index)
+        self.write(os.path.join(directory, 'address'), '%s\n' % mac)
+        if link is not None:
+            self.write(os.path.join(directory, 'carrier'),
+                       '%d\n' % int(link))
+
+        if virtual:
+            os.mkdir(os.path.join(self.root, 'devices/virtual/net', name))
+        else:
+            os.mkdir(os.path.join(self.root, directory, 'device'))
+            os.symlink(os.path.join(self.root, 'drivers/qeth'),
+                       os.path.join(self.root, directory, 'device/driver'))
+
+        if predictable:
+            self.write('udev/data/n%d' % index,
+                       'I:1234\nE:ID_NET_NAME_PATH=%s\n'
+                       'E:ID_NET_DRIVER=qeth\nG:systemd\n' % predictable)
+
+        if address:
+            self.ethtool.addresses[name] = address
+    # addInterface()
+
+    def testParseZnetconf(self):
+        self.assertEqual(parse_znetconf(ZNETCONF_OUT),
+                         {'0.0.f500,0.0.f501,0.0.f502': 'OSA(QDIO)',
+                          '0.0.f503,0.0.f504,0.0.f505': 'OSA(QDIO)'})
+        self.assertEqual(parse_znetconf('Scanning for network devices...\n'
+                                        'No unconfigured network devices\n'),
+                         {})
+    # testParseZnetconf()
+
+    def testInterfaces(self):
+        interfaces = self.inventory.interfaces()
+        self.assertEqual([i.name for i in interfaces],
+                         ['lo', 'eth0', 'eth1', 'eth2', 'br0'])
+
+        eth0 = interfaces[1]
+        self.assertEqual(eth0.index, '2')
+        self.assertEqual(eth0.mac, '02:00:00:00:00:01')
+        self.assertEqual(eth0.driver, 'qeth')
+        self.assertTrue(eth0.link)
+        self.assertFalse(eth0.virtual)
+        self.assertEqual(eth0.address, '192.168.0.10')
+        self.assertEqual(eth0.udevName(), 'enccw0.0.f500')
+
+        # no address, no udev data, no link
+        eth2 = self.inventory.interface('eth2')
+        self.assertEqual(eth2.address, None)
+        self.assertEqual(eth2.predictableName, None)
+        self.assertEqual(eth2.udevName(), 'eth2')
+        self.assertFalse(eth2.link)
+
+        self.assertTrue(interfaces[0].virtual)
+        self.assertEqual(interfaces[0].driver, None)
+        self.assertEqual(self.inventory.interface('eth9'), None)
+
+        # callers get copies
+        eth0.name = 'changed'
+        self.assertEqual(self.inventory.interface('eth0').mac,
+                         '02:00:00:00:00:01')
+    # testInterfaces()
+
+    def testRefresh(self):
+        self.assertEqual(len(self.inventory.interfaces()), 5)
+        self.assertEqual(len(self.inventory.unconfigured()), 2)
+
+        # nothing is read again until the kernel or a caller says so
+        self.addInterface('eth3', 5, '02:00:00:00:00:04', link=True)
+        self.ethtool.addresses['eth1'] = '192.168.0.12'
+        self.assertEqual(len(self.inventory.interfaces()), 5)
+        self.assertEqual(self.inventory.interface('eth1').address, None)
+        self.inventory.unconfigured()
+        self.assertEqual(FakePopen.calls, 1)
+
+        self.netlink.notify()
+        self.assertEqual(len(self.inventory.interfaces()), 6)
+        self.assertEqual(self.inventory.interface('eth1').address,
+                         '192.168.0.12')
+        self.inventory.unconfigured()
+        self.assertEqual(FakePopen.calls, 2)
+
+        shutil.rmtree(os.path.join(self.root, 'class/net/eth3'))
+        self.assertEqual(len(self.inventory.interfaces()), 6)
+        self.inventory.refresh()
+        self.assertEqual(len(self.inventory.interfaces()), 5)
+        self.inventory.unconfigured()
+        self.assertEqual(FakePopen.calls, 3)
+    # testRefresh()
+
+    def testNoNetlink(self):
+        def unavailable(family, type, proto):
+            raise socket.error(97, 'Address family not supported')
+        self.netlink.socket = unavailable
+
+        # with no telling when they change, interfaces are always read
+        self.assertEqual(len(self.inventory.interfaces()), 5)
+        self.addInterface('eth3', 5, '02:00:00:00:00:04', link=True)
+        self.assertEqual(len(self.inventory.interfaces()), 6)
+    # testNoNetlink()
+
+    def testNetworkGetters(self):
+        self.assertEqual(Network.getVirtualNic(), ['lo', 'br0'])
+
+        # eth1 was named in the boot command line and keeps its name
+        self.assertEqual(Network.getUdevPredictableName('eth0'),
+                         'enccw0.0.f500')
+        self.assertEqual(Network.getUdevPredictableName('eth1'), 'eth1')
+        self.assertEqual(Network.getUdevPredictableName('eth9'), 'eth9')
+
+        self.assertEqual(Network.getLinkedInterfaces(),
+                         ['lo', 'enccw0.0.f500', 'eth1', 'br0'])
+        self.assertEqual(Network.getLinkedInterfaces(False),
+                         ['lo', 'eth0', 'eth1', 'br0'])
+
+        self.assertEqual(Network.getAvailableInterfaces(),
+                         {'enccw0.0.f500': '02:00:00:00:00:01',
+                          'eth1': '02:00:00:00:00:02',
+                          'eth2': '02:00:00:00:00:03'})
+        self.assertEqual(sorted(Network.getAvailableInterfaces(False)),
+                         ['eth0', 'eth1', 'eth2'])
+
+        self.assertEqual(Network.getActiveInterfaces(), ['enccw0.0.f500'])
+        self.assertEqual(Network.getActiveInterfaces(False), ['eth0'])
+
+        self.assertEqual(Network.getUnactiveInterfaces(),
+                         parse_znetconf(ZNETCONF_OUT))
+    # testNetworkGetters()
+# NetInventoryTestCase()
+
+
+if __name__ == "__main__":
+    unittest.main()
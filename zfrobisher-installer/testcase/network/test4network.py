@@ -0,0 +1,288 @@
+#!/usr/bin/python
+
+#
+# Rewrites ifcfg files in a temporary directory and checks which interfaces
+# Network.applyNetworkChanges restarts, with ifup/ifdown and the network
+# inventory replaced by stand-ins.
+#
+# Run as: cd testcase/network && python test4network.py
+#
+
+#
+# IMPORTS
+#
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, "../../src/")        #path for modules.network
+from modules.network import network
+from modules.network.netinventory import NetInterface
+from modules.network.network import Network
+
+#
+# CONSTANTS
+#
+NIC_CONFIG = {'DEVICE': 'eth0', 'ONBOOT': 'yes', 'BOOTPROTO': 'none',
+              'BRIDGE': 'breth0'}
+BRIDGE_CONFIG = {'DEVICE': 'breth0', 'TYPE': 'Bridge', 'ONBOOT': 'yes',
+                 'BOOTPROTO': 'static', 'IPADDR': '192.168.0.10'}
+
+
+#
+# CODE
+#
+class FakeInventory(object):
+    """
+    Interfaces whose link and address come and go with ifdown and ifup
+    """
+    def __init__(self, names):
+        self.lock = threading.Lock()
+        self.interfaces_ = []
+        for name in names:
+            iface = NetInterface()
+            iface.name = name
+            iface.virtual = name.startswith('br')
+            iface.predictableName = None
+            iface.link = True
+            iface.address = '192.168.0.1' if iface.virtual else None
+            self.interfaces_.append(iface)
+
+        # interfaces that do not come back after ifup
+        self.broken = set()
+
+    def interfaces(self):
+        with self.lock:
+            return list(self.interfaces_)
+
+    def interface(self, name):
+        for iface in self.interfaces():
+            if iface.name == name:
+                return iface
+        return None
+
+    def down(self, name):
+        iface = self.interface(name)
+        iface.link = False
+        iface.address = None
+
+    def up(self, name):
+        if name in self.broken:
+            return
+        iface = self.interface(name)
+        iface.link = True
+        if iface.virtual:
+            iface.address = '192.168.0.1'
+# FakeInventory()
+
+
+class FakeCommands(object):
+    """
+    Stands in for Popen, running ifdown and ifup against the inventory
+    """
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.lock = threading.Lock()
+        self.calls = []
+        self.failing = set()
+
+    def __call__(self, argv, stdout=None, stderr=None):
+        with self.lock:
+            self.calls.append(tuple(argv))
+        return FakeProcess(self, argv)
+
+    def run(self, argv):
+        (command, name) = argv
+        if name in self.failing:
+            return 1
+        if command == 'ifdown':
+            self.inventory.down(name)
+        elif command == 'ifup':
+            self.inventory.up(name)
+        return 0
+
+    def of(self, name):
+        return [c[0] for c in self.calls if c[1] == name]
+# FakeCommands()
+
+
+class FakeProcess(object):
+    def __init__(self, commands, argv):
+        self.commands = commands
+        self.argv = argv
+        self.returncode = None
+
+    def communicate(self):
+        self.returncode = self.commands.run(self.argv)
+        return ('', 'failed' if self.returncode else '')
+# FakeProcess()
+
+
+class NetworkChangesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        self.inventory = FakeInventory(['eth0', 'eth1', 'eth2', 'breth0'])
+        self.inventory.down('eth2')
+        self.commands = FakeCommands(self.inventory)
+
+        self.patch(network, 'IFCFG_FILE', os.path.join(self.dir, 'ifcfg-%s'))
+        self.patch(network, 'APPLIED_CONFIGS', {})
+        self.patch(network, 'READY_POLL_INTERVAL', 0.01)
+        self.patch(network, 'inventory', self.inventory)
+        self.patch(network, 'Popen', self.commands)
+
+        # what the interfaces were brought up with
+        for config in (NIC_CONFIG, BRIDGE_CONFIG, self.config('eth1'),
+                       self.config('eth2')):
+            self.write(config)
+    # setUp()
+
+    def patch(self, obj, name, value):
+        saved = obj.__dict__[name]
+        setattr(obj, name, value)
+        self.addCleanup(setattr, obj, name, saved)
+    # patch()
+
+    def config(self, name, **changes):
+        config = {'DEVICE': name, 'ONBOOT': 'yes', 'BOOTPROTO': 'none'}
+        config.update(changes)
+        return config
+    # config()
+
+    def write(self, config):
+        with open(network.IFCFG_FILE % config['DEVICE'], 'w') as fd:
+            for item in config.iteritems():
+                fd.write('%s=%s\n' % item)
+    # write()
+
+    def testRemember(self):
+        self.assertEqual(Network.getChangedInterfaces(), [])
+
+        Network.writeConfigFile(self.config('eth1', MTU='9000'))
+        Network.writeConfigFile(self.config('eth1', MTU='1500'))
+        self.assertEqual(network.APPLIED_CONFIGS,
+                         {'eth1': self.config('eth1')})
+        self.assertEqual(Network.getChangedInterfaces(), ['eth1'])
+
+        # written back the way it was brought up
+        Network.writeConfigFile(self.config('eth1'))
+        self.assertEqual(Network.getChangedInterfaces(), [])
+
+        # no file before
+        Network.writeConfigFile(self.config('eth3'))
+        self.assertEqual(network.APPLIED_CONFIGS['eth3'], None)
+        self.assertEqual(Network.getChangedInterfaces(), ['eth3'])
+
+        # writing the installed system is not remembered
+        os.makedirs(self.dir + self.dir)
+        Network.writeConfigFile(self.config('eth2'), mountDir=self.dir)
+        self.assertFalse('eth2' in network.APPLIED_CONFIGS)
+    # testRemember()
+
+    def testDisableNIC(self):
+        Network.disableNIC(None, 'eth0')
+        self.assertEqual(Network.readConfigFile('eth0')['ONBOOT'], 'no')
+        self.assertEqual(Network.readConfigFile('breth0')['ONBOOT'], 'no')
+        self.assertEqual(network.APPLIED_CONFIGS['eth0'], NIC_CONFIG)
+        self.assertEqual(Network.getChangedInterfaces(), ['breth0', 'eth0'])
+
+        # both go down, and stay down
+        self.assertEqual(Network.applyNetworkChanges(), ['eth0', 'breth0'])
+        self.assertEqual(self.commands.calls, [('ifdown', 'eth0'),
+                                               ('ifdown', 'breth0')])
+    # testDisableNIC()
+
+    def testGroups(self):
+        Network.writeConfigFile(dict(NIC_CONFIG, MTU='1500'))
+        Network.writeConfigFile(dict(BRIDGE_CONFIG, IPADDR='192.168.0.11'))
+        Network.writeConfigFile(self.config('eth1', MTU='9000'))
+        Network.writeConfigFile(self.config('eth2', MTU='9000'))
+
+        # eth2 has no link and is left for later
+        self.assertEqual(Network.applyNetworkChanges(),
+                         ['eth0', 'breth0', 'eth1'])
+        self.assertEqual(self.commands.of('eth0') + self.commands.of('breth0'),
+                         ['ifdown', 'ifup', 'ifdown', 'ifup'])
+        index = self.commands.calls.index
+        self.assertTrue(index(('ifup', 'eth0')) < index(('ifdown', 'breth0')))
+        self.assertEqual(self.commands.of('eth1'), ['ifdown', 'ifup'])
+        self.assertEqual(self.commands.of('eth2'), [])
+
+        self.assertEqual(Network.getChangedInterfaces(), ['eth2'])
+        self.assertEqual(network.APPLIED_CONFIGS.keys(), ['eth2'])
+    # testGroups()
+
+    def testSelectedNICs(self):
+        Network.writeConfigFile(self.config('eth1', MTU='9000'))
+        Network.writeConfigFile(dict(BRIDGE_CONFIG, IPADDR='192.168.0.11'))
+
+        self.assertEqual(Network.applyNetworkChanges(['eth0']), ['breth0'])
+        self.assertEqual(self.commands.calls, [('ifdown', 'breth0'),
+                                               ('ifup', 'breth0')])
+        self.assertEqual(Network.getChangedInterfaces(), ['eth1'])
+
+        # restartNetworkService restarts only what changed for its nic
+        self.patch(os.path, 'isfile', lambda path: True)
+        Network.restartNetworkService(nic='eth1')
+        self.assertEqual(self.commands.of('eth1'), ['ifdown', 'ifup'])
+        self.assertEqual(Network.getChangedInterfaces(), [])
+    # testSelectedNICs()
+
+    def testDeletedBridge(self):
+        Network.writeConfigFile(dict(NIC_CONFIG, BRIDGE=''))
+        Network.deleteBrConfigFile('eth0')
+        self.assertFalse(os.path.exists(network.IFCFG_FILE % 'breth0'))
+        self.assertEqual(network.APPLIED_CONFIGS['breth0'], BRIDGE_CONFIG)
+        self.assertEqual(Network.getChangedInterfaces(), ['breth0', 'eth0'])
+
+        # the bridge is not there to restart, but its change is applied
+        self.assertEqual(Network.applyNetworkChanges(), ['eth0', 'breth0'])
+        self.assertEqual(self.commands.calls, [('ifdown', 'eth0'),
+                                               ('ifup', 'eth0')])
+        self.assertEqual(network.APPLIED_CONFIGS, {})
+    # testDeletedBridge()
+
+    def testReadyTimeout(self):
+        self.inventory.broken.add('breth0')
+        Network.writeConfigFile(dict(BRIDGE_CONFIG, IPADDR='192.168.0.11'))
+        Network.writeConfigFile(self.config('eth1', MTU='9000'))
+
+        try:
+            Network.applyNetworkChanges(timeout=0.2)
+            self.fail('bridge without link not detected')
+        except Exception, e:
+            self.assertTrue('breth0 is not ready after' in str(e))
+
+        # the other NIC was not held up, and the bridge is tried again
+        self.assertEqual(Network.getChangedInterfaces(), ['breth0'])
+
+        self.inventory.broken.clear()
+        self.inventory.up('breth0')
+        self.commands.failing.add('breth0')
+        try:
+            Network.applyNetworkChanges()
+            self.fail('ifdown failure not detected')
+        except Exception, e:
+            self.assertTrue('Failed to deactivate breth0' in str(e))
+        self.assertEqual(Network.getChangedInterfaces(), ['breth0'])
+    # testReadyTimeout()
+
+    def testWaitReady(self):
+        self.assertTrue(Network.waitInterfaceReady('eth0', timeout=0))
+        self.assertFalse(Network.waitInterfaceReady('eth0', address=True,
+                                                    timeout=0.05))
+        self.assertTrue(Network.waitInterfaceReady('breth0', address=True,
+                                                   timeout=0))
+        self.assertFalse(Network.waitInterfaceReady('eth9', timeout=0))
+    # testWaitReady()
+# NetworkChangesTestCase()
+
+
+if __name__ == "__main__":
+    unittest.main()
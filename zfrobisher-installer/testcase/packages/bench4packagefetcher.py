@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+#
+# Downloads a stand-in package repository served over HTTP from this process
+# the way installPackages used to (one connection per package, checksums
+# computed afterwards by a program) and with PackageFetcher.
+#
+# Only the downloads are measured, not the whole installation: yum installs
+# the packages in a single rpm transaction once all of them are fetched,
+# which takes the same time either way.
+#
+# Run as: cd testcase/packages && python bench4packagefetcher.py
+#
+
+#
+# IMPORTS
+#
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, "../../src/model/")     #path for packagefetcher module
+from packagefetcher import PackageFetcher, FetchItem
+
+#
+# CONSTANTS
+#
+PACKAGES = 200
+PACKAGE_SIZE = 512 * 1024
+
+# time the server takes to answer a request and to accept a connection,
+# standing in for a repository that is not on the local machine
+REQUEST_LATENCY = 0.01
+CONNECT_LATENCY = 0.02
+
+
+#
+# CODE
+#
+class RepoHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        time.sleep(CONNECT_LATENCY)
+        SimpleHTTPRequestHandler.setup(self)
+
+    def send_head(self):
+        time.sleep(REQUEST_LATENCY)
+        return SimpleHTTPRequestHandler.send_head(self)
+
+    def log_message(self, format, *args):
+        pass
+# RepoHandler()
+
+
+class RepoServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+# RepoServer()
+
+
+def createRepo(directory):
+    items = []
+    for i in range(PACKAGES):
+        name = 'package-%03d-1.0-1.s390x.rpm' % i
+        data = os.urandom(PACKAGE_SIZE)
+        with open(os.path.join(directory, name), 'wb') as fd:
+            fd.write(data)
+        items.append((name, hashlib.sha256(data).hexdigest()))
+
+    return items
+# createRepo()
+
+
+def serialFetch(url, packages, target):
+    for (name, csum) in packages:
+        path = os.path.join(target, name)
+        with open(path, 'wb') as fd:
+            fd.write(urllib2.urlopen(url + name).read())
+
+        out = subprocess.Popen(['sha256sum', path],
+                               stdout=subprocess.PIPE).communicate()[0]
+        assert out.split()[0] == csum
+# serialFetch()
+
+
+def fetcherFetch(url, packages, target, threads):
+    items = [FetchItem(url + name, os.path.join(target, name), 'sha256', csum,
+                       PACKAGE_SIZE) for (name, csum) in packages]
+
+    PackageFetcher(threads).fetchAll(items)
+# fetcherFetch()
+
+
+def timed(label, func, *args):
+    start = time.time()
+    result = func(*args)
+    print("%-36s %8.3fs" % (label, time.time() - start))
+    return result
+# timed()
+
+
+def main():
+    repo = tempfile.mkdtemp()
+    target = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        packages = createRepo(repo)
+
+        os.chdir(repo)
+        server = RepoServer(('127.0.0.1', 0), RepoHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:%d/' % server.server_address[1]
+
+        print("%d packages of %d KiB" % (PACKAGES, PACKAGE_SIZE / 1024))
+        timed("serial, sha256sum", serialFetch, url, packages, target)
+        for threads in (1, 4, 8):
+            shutil.rmtree(target)
+            os.mkdir(target)
+            timed("PackageFetcher, %d threads" % threads, fetcherFetch,
+                  url, packages, target, threads)
+
+        server.shutdown()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(repo)
+        shutil.rmtree(target)
+# main()
+
+
+if __name__ == "__main__":
+    main()
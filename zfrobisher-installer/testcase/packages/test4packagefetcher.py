@@ -0,0 +1,297 @@
+#!/usr/bin/python
+
+#
+# Downloads packages with PackageFetcher from a stand-in repository served
+# over HTTP from this process.
+#
+# Run as: cd testcase/packages && python test4packagefetcher.py
+#
+
+#
+# IMPORTS
+#
+import hashlib
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urlparse
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, "../../src/model/")     #path for packagefetcher module
+from packagefetcher import PackageFetcher, FetchItem, FetchError
+import packagefetcher
+
+#
+# CONSTANTS
+#
+PACKAGE_SIZE = 64 * 1024
+
+
+#
+# CODE
+#
+class RepoHandler(BaseHTTPRequestHandler):
+    """
+    Serves the packages of the server, misbehaving the way it is told to
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+        self.served = 0
+
+    def do_GET(self):
+        # proxies are sent the whole URL
+        parts = urlparse.urlsplit(self.path)
+        name = parts.path.lstrip('/')
+        with self.server.lock:
+            self.server.requests.append(name)
+            if parts.netloc:
+                self.server.proxied.append(name)
+
+        # the connection was kept open, but the server forgot about it
+        if self.served and self.server.keepAlive is not None and \
+           self.served >= self.server.keepAlive:
+            self.close_connection = 1
+            return
+        self.served += 1
+
+        if name in self.server.redirects:
+            self.send_response(302)
+            self.send_header('Location', self.server.redirects[name])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if name not in self.server.packages:
+            self.send_error(404)
+            return
+
+        time.sleep(self.server.delays.get(name, 0))
+        data = self.server.packages[name]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+
+        if name in self.server.resets:
+            # half the package, then a connection reset once the client
+            # waits for the rest
+            self.wfile.write(data[:len(data) / 2])
+            self.wfile.flush()
+            time.sleep(0.2)
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                       struct.pack('ii', 1, 0))
+            self.connection.close()
+            self.close_connection = 1
+            return
+
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+# RepoHandler()
+
+
+class RepoServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RepoHandler)
+        self.lock = threading.Lock()
+        self.packages = {}
+        self.delays = {}
+        self.resets = set()
+        self.redirects = {}
+        self.keepAlive = None
+        self.connections = 0
+        self.requests = []
+        self.proxied = []
+
+    def url(self, name):
+        return 'http://127.0.0.1:%d/%s' % (self.server_address[1], name)
+# RepoServer()
+
+
+class PackageFetcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RepoServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.target)
+    # setUp()
+
+    def addPackages(self, count):
+        items = []
+        for i in range(count):
+            name = 'package-%02d-1.0-1.s390x.rpm' % i
+            data = os.urandom(PACKAGE_SIZE)
+            self.server.packages[name] = data
+            items.append(FetchItem(self.server.url(name),
+                                   os.path.join(self.target, 'rpms', name),
+                                   'sha256', hashlib.sha256(data).hexdigest(),
+                                   len(data), name))
+        return items
+    # addPackages()
+
+    def assertFetched(self, item):
+        with open(item.path, 'rb') as fd:
+            self.assertEqual(fd.read(), self.server.packages[item.data])
+        self.assertFalse(os.path.exists(item.path + '.part'))
+    # assertFetched()
+
+    def testInOrder(self):
+        items = self.addPackages(8)
+        self.server.delays[items[0].data] = 0.5
+
+        fetched = []
+        for item in PackageFetcher(threads=4).fetch(items):
+            if not fetched:
+                # the first one took longest, the others were not held up
+                self.assertTrue(all(os.path.exists(i.path)
+                                    for i in items[1:4]))
+            fetched.append(item)
+            self.assertFetched(item)
+
+        self.assertEqual(fetched, items)
+
+        # each worker kept its connection
+        self.assertEqual(self.server.connections, 4)
+    # testInOrder()
+
+    def testMismatch(self):
+        items = self.addPackages(4)
+        items[1].csum = hashlib.sha256('other').hexdigest()
+        items[3].size = PACKAGE_SIZE + 1
+
+        fetched = []
+        fetcher = PackageFetcher(threads=2)
+        try:
+            for item in fetcher.fetch(items):
+                fetched.append(item)
+            self.fail('checksum mismatch not detected')
+        except FetchError, e:
+            self.assertTrue('checksum mismatch' in str(e))
+
+        # only the files before the bad one are handed back
+        self.assertEqual(fetched, items[:1])
+        self.assertFalse(os.path.exists(items[1].path))
+        self.assertFalse(os.path.exists(items[1].path + '.part'))
+
+        try:
+            fetcher.fetchAll(items[3:])
+            self.fail('size mismatch not detected')
+        except FetchError, e:
+            self.assertTrue('expected %d' % (PACKAGE_SIZE + 1) in str(e))
+        self.assertFalse(os.path.exists(items[3].path))
+        self.assertFalse(os.path.exists(items[3].path + '.part'))
+    # testMismatch()
+
+    def testKeepAliveDropped(self):
+        items = self.addPackages(4)
+        self.server.keepAlive = 1
+
+        # every second request finds its connection closed and is retried
+        self.assertEqual(PackageFetcher(threads=1).fetchAll(items), items)
+        for item in items:
+            self.assertFetched(item)
+
+        self.assertEqual(self.server.connections, 4)
+        self.assertEqual(len(self.server.requests), 4 + 3)
+    # testKeepAliveDropped()
+
+    def testRetriesFail(self):
+        items = self.addPackages(2)
+        self.server.resets.add(items[1].data)
+
+        fetched = []
+        try:
+            for item in PackageFetcher(threads=2).fetch(items):
+                fetched.append(item)
+            self.fail('connection reset not detected')
+        except FetchError:
+            pass
+
+        self.assertEqual(fetched, items[:1])
+        self.assertEqual(self.server.requests.count(items[1].data),
+                         packagefetcher.RETRIES)
+        self.assertFalse(os.path.exists(items[1].path))
+        self.assertFalse(os.path.exists(items[1].path + '.part'))
+    # testRetriesFail()
+
+    def testRedirects(self):
+        items = self.addPackages(2)
+
+        # moved to another path, relative and absolute
+        self.server.redirects['old/first.rpm'] = '/mirror/first.rpm'
+        self.server.redirects['mirror/first.rpm'] = '../' + items[0].data
+        self.server.redirects['old/second.rpm'] = items[1].url
+        items[0].url = self.server.url('old/first.rpm')
+        items[1].url = self.server.url('old/second.rpm')
+
+        self.assertEqual(PackageFetcher(threads=1).fetchAll(items), items)
+        for item in items:
+            self.assertFetched(item)
+        self.assertEqual(self.server.connections, 1)
+
+        # redirected in a loop
+        self.server.redirects[items[0].data] = '/old/first.rpm'
+        try:
+            PackageFetcher().fetchAll(items[:1])
+            self.fail('redirect loop not detected')
+        except FetchError, e:
+            self.assertTrue('redirects' in str(e))
+        self.assertFalse(os.path.exists(items[0].path + '.part'))
+    # testRedirects()
+
+    def testProxy(self):
+        items = self.addPackages(2)
+        proxy = self.server.url('')
+
+        # the server stands in for the proxy as well
+        for item in items:
+            item.url = item.url.replace('127.0.0.1', 'repo.example.com')
+            item.proxies = {'http': proxy}
+
+        self.assertEqual(PackageFetcher(threads=2).fetchAll(items), items)
+        for item in items:
+            self.assertFetched(item)
+        self.assertEqual(sorted(self.server.proxied),
+                         sorted(item.data for item in items))
+
+        # from the environment, unless the host is left out
+        os.environ['http_proxy'] = proxy
+        self.addCleanup(os.environ.pop, 'http_proxy')
+        self.assertEqual(packagefetcher.proxyFor(items[0].url), proxy)
+        os.environ['no_proxy'] = 'repo.example.com'
+        self.addCleanup(os.environ.pop, 'no_proxy')
+        self.assertEqual(packagefetcher.proxyFor(items[0].url), None)
+        self.assertEqual(packagefetcher.proxyFor(items[0].url, {}), None)
+    # testProxy()
+
+    def testMissing(self):
+        item = FetchItem(self.server.url('missing.rpm'),
+                         os.path.join(self.target, 'missing.rpm'))
+        self.assertRaises(FetchError, PackageFetcher().fetchAll, [item])
+        self.assertEqual(os.listdir(self.target), [])
+    # testMissing()
+# PackageFetcherTestCase()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+#
+# Finds the free space of partitions: ext images made up in a temporary
+# directory are read through their superblocks, the other filesystems go
+# through mount and df, which are replaced by stand-ins.
+#
+# Run as: cd testcase/partitioning && python test4discinfo.py
+#
+
+#
+# IMPORTS
+#
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "../../src/modules/partitioner/")   #path for discinfo
+import discinfo
+
+#
+# CONSTANTS
+#
+DF_OUT = """Filesystem     512B-blocks   Used Available Use% Mounted on
+/dev/sdz2           409600  10240    399360   3% /tmp/discinfo-x
+"""
+
+
+#
+# CODE
+#
+def ext4_image(free, reserved, logBlockSize=2):
+    """
+    Makes up the start of an ext4 filesystem with free and reserved blocks
+    """
+    buf = bytearray(4096)
+    sb = 1024
+    buf[sb + 4:sb + 8] = struct.pack("<I", 0x10000)            # blocks_count_lo
+    buf[sb + 8:sb + 16] = struct.pack("<II", reserved, free)
+    buf[sb + 24:sb + 28] = struct.pack("<I", logBlockSize)
+    buf[sb + 0x38:sb + 0x3C] = struct.pack("<HH", 0xEF53, 1)
+    buf[sb + 0x5C:sb + 0x68] = struct.pack("<III", 0x4, 0x2c2, 0x1)
+    return str(buf)
+# ext4_image()
+
+
+class FakeShell(object):
+    """
+    Stands in for os.system and os.popen, running mount, df and umount
+    """
+    def __init__(self):
+        self.commands = []
+        self.mountStatus = 0
+
+    def system(self, cmdLine):
+        self.commands.append(cmdLine.split()[0])
+        if cmdLine.startswith('mount'):
+            return self.mountStatus
+        return 0
+
+    def popen(self, cmdLine):
+        self.commands.append(cmdLine.split()[0])
+        return FakePipe(DF_OUT)
+# FakeShell()
+
+
+class FakePipe(object):
+    def __init__(self, out):
+        self.out = out
+
+    def read(self):
+        return self.out
+
+    def close(self):
+        return None
+# FakePipe()
+
+
+class FreeSpaceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        self.shell = FakeShell()
+        self.patch(discinfo, 'DEV_DIR', self.dir)
+        self.patch(os, 'system', self.shell.system)
+        self.patch(os, 'popen', self.shell.popen)
+    # setUp()
+
+    def patch(self, obj, name, value):
+        saved = obj.__dict__[name]
+        setattr(obj, name, value)
+        self.addCleanup(setattr, obj, name, saved)
+    # patch()
+
+    def write(self, name, data):
+        with open(os.path.join(self.dir, name), 'wb') as fd:
+            fd.write(data)
+    # write()
+
+    def testSuperblock(self):
+        self.write('sdz1', ext4_image(free=1000, reserved=50))
+
+        # df leaves out the blocks reserved for root
+        self.assertEqual(discinfo.estimate_free_space('sdz1', 'ext4'),
+                         950 * 4096)
+        self.assertEqual(discinfo.get_part_free_space('sdz1', 'ext4', 512),
+                         950 * 8)
+
+        # rounded up to whole sectors, as df does
+        self.write('sdz1', ext4_image(free=3, reserved=0, logBlockSize=0))
+        self.assertEqual(discinfo.get_part_free_space('sdz1', 'ext3', 2048),
+                         2)
+
+        # more reserved than free
+        self.write('sdz1', ext4_image(free=10, reserved=50))
+        self.assertEqual(discinfo.get_part_free_space('sdz1', 'ext2', 512), 0)
+
+        self.assertEqual(self.shell.commands, [])
+    # testSuperblock()
+
+    def testMounted(self):
+        # not an ext superblock, or no superblock read at all
+        self.write('sdz1', '\0' * 4096)
+        self.assertEqual(discinfo.estimate_free_space('sdz1', 'ext4'), None)
+        self.assertEqual(discinfo.estimate_free_space('sdz2', 'xfs'), None)
+
+        self.assertEqual(discinfo.get_part_free_space('sdz2', 'xfs', 512),
+                         399360)
+        self.assertEqual(self.shell.commands, ['mount', 'df', 'umount'])
+
+        del self.shell.commands[:]
+        self.assertEqual(discinfo.get_part_free_space('sdz1', 'ext4', 512),
+                         399360)
+        self.assertEqual(self.shell.commands, ['mount', 'df', 'umount'])
+
+        # the mount point is not left behind
+        self.assertEqual([n for n in os.listdir(tempfile.gettempdir())
+                              if n.startswith('discinfo-')], [])
+    # testMounted()
+
+    def testMountFails(self):
+        self.shell.mountStatus = 32 << 8
+
+        # nothing is measured, and nothing unmounted
+        self.assertEqual(discinfo.get_part_free_space('sdz2', 'btrfs', 512),
+                         -1)
+        self.assertEqual(self.shell.commands, ['mount'])
+
+        self.assertEqual(discinfo.get_part_free_space('sdz3', 'swap', 512),
+                         -1)
+        self.assertEqual(self.shell.commands, ['mount'])
+    # testMountFails()
+# FreeSpaceTestCase()
+
+
+if __name__ == "__main__":
+    unittest.main()
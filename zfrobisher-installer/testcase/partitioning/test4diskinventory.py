@@ -0,0 +1,216 @@
+#!/usr/bin/python
+
+#
+# Reads msdos partition tables from a disk image and probes it through the
+# disk inventory, checking when the cached hierarchy entry is reused.
+#
+# Run as: cd testcase/partitioning && python test4diskinventory.py
+#
+
+#
+# IMPORTS
+#
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, "../../src/modules/partitioner/")   #path for diskinventory
+import diskinventory
+from diskinventory import DiskInventory, read_disk_start, read_msdos_table
+
+#
+# CONSTANTS
+#
+SECTOR_SIZE = 512
+DISK_SECTORS = 65536
+DISK_NAME = 'sdz'
+
+# sdz1 primary, sdz2 extended holding the logical sdz5 and sdz6
+PRIMARY = (0x83, 2048, 8192)
+EXTENDED = (0x5, 10240, 40960)
+LOGICAL = [(0x83, 2048, 4096), (0x82, 2048, 4096)]
+EBR_OFFSETS = [0, 8192, 16384]
+
+
+#
+# CODE
+#
+def entry(ptype, start, size):
+    return struct.pack('<4xB3xII', ptype, start, size)
+# entry()
+
+
+def table(entries):
+    sector = bytearray(SECTOR_SIZE)
+    for (i, e) in enumerate(entries):
+        offset = diskinventory.MBR_ENTRIES_OFFSET + \
+                 i * diskinventory.MBR_ENTRY_SIZE
+        sector[offset:offset + 16] = entry(*e)
+    sector[510:512] = diskinventory.MBR_SIGNATURE
+    return str(sector)
+# table()
+
+
+class FakeSysfs(object):
+    """
+    Answers the sysfs attributes snapshot_disk reads
+    """
+    def __init__(self):
+        self.attrs = {'dev': '8:400',
+                      'queue/logical_block_size': str(SECTOR_SIZE),
+                      'size': str(DISK_SECTORS)}
+
+    def get_attr(self, path, attr):
+        return self.attrs.get(attr)
+# FakeSysfs()
+
+
+class DiskInventoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, DISK_NAME)
+
+        with open(self.path, 'wb') as fd:
+            fd.truncate(DISK_SECTORS * SECTOR_SIZE)
+        self.write(0, table([PRIMARY, EXTENDED]))
+        self.writeEBRs(LOGICAL)
+
+        self.saved = (diskinventory.DEV_DIR, diskinventory.DISK_BY_ID,
+                      diskinventory.sysfs)
+        diskinventory.DEV_DIR = self.dir
+        diskinventory.DISK_BY_ID = os.path.join(self.dir, 'by-id')
+        diskinventory.sysfs = FakeSysfs()
+
+        self.built = []
+    # setUp()
+
+    def tearDown(self):
+        (diskinventory.DEV_DIR, diskinventory.DISK_BY_ID,
+         diskinventory.sysfs) = self.saved
+    # tearDown()
+
+    def write(self, sector, data):
+        with open(self.path, 'r+b') as fd:
+            fd.seek(sector * SECTOR_SIZE)
+            fd.write(data)
+    # write()
+
+    def writeEBRs(self, logical):
+        for (i, part) in enumerate(logical):
+            entries = [part]
+            if i + 1 < len(logical):
+                entries.append((0x5, EBR_OFFSETS[i + 1], 8192))
+            self.write(EXTENDED[1] + EBR_OFFSETS[i], table(entries))
+    # writeEBRs()
+
+    def build(self, snapshot):
+        self.built.append(snapshot.name)
+        return {'name': snapshot.name, 'parts': snapshot.parts}
+    # build()
+
+    def probe(self, inventory, context=None):
+        del self.built[:]
+        return inventory.probe([DISK_NAME], self.build, context=context)
+    # probe()
+
+    def testReadTable(self):
+        start = read_disk_start(DISK_NAME, SECTOR_SIZE)
+        self.assertEqual(len(start),
+                         diskinventory.PROBE_SECTORS * SECTOR_SIZE)
+
+        parts = read_msdos_table(DISK_NAME, start, SECTOR_SIZE)
+        self.assertEqual([p['name'] for p in parts],
+                         ['sdz1', 'sdz2', 'sdz3', 'sdz4', 'sdz5', 'sdz6'])
+        self.assertEqual([p['id'] for p in parts],
+                         ['83', '5', '0', '0', '83', '82'])
+        self.assertEqual(parts[0]['start'], 2048)
+        self.assertEqual(parts[0]['end'], 10239)
+        self.assertEqual(parts[1]['size'], 40960)
+
+        # logical partitions start relative to their EBR, and link to the
+        # next EBR relative to the extended partition
+        self.assertEqual(parts[4]['start'], 10240 + 2048)
+        self.assertEqual(parts[4]['size'], 4096)
+        self.assertEqual(parts[4]['nextStart'], 10240 + 8192)
+        self.assertEqual(parts[4]['nextId'], '5')
+        self.assertEqual(parts[5]['start'], 10240 + 8192 + 2048)
+        self.assertEqual(parts[5]['nextStart'], 0)
+        self.assertEqual(parts[5]['nextId'], '0')
+    # testReadTable()
+
+    def testReadBadTables(self):
+        self.assertEqual(read_msdos_table(DISK_NAME, None, SECTOR_SIZE), None)
+        self.assertEqual(read_msdos_table(DISK_NAME, '\0' * SECTOR_SIZE,
+                                          SECTOR_SIZE), None)
+
+        # an EBR linking back to itself ends the chain
+        self.write(EXTENDED[1], table([LOGICAL[0], (0x5, 0, 8192)]))
+        start = read_disk_start(DISK_NAME, SECTOR_SIZE)
+        parts = read_msdos_table(DISK_NAME, start, SECTOR_SIZE)
+        self.assertEqual([p['name'] for p in parts][4:], ['sdz5'])
+    # testReadBadTables()
+
+    def testProbe(self):
+        inventory = DiskInventory()
+        disks = self.probe(inventory)
+        self.assertEqual(self.built, [DISK_NAME])
+        self.assertEqual(len(disks[0]['parts']), 6)
+
+        # unchanged: the entry is reused, and callers get their own copy
+        disks[0]['parts'].pop()
+        disks = self.probe(inventory)
+        self.assertEqual(self.built, [])
+        self.assertEqual(len(disks[0]['parts']), 6)
+
+        # the superblock of a logical partition is rewritten
+        self.write(10240 + 8192 + 2048 + 2, '\x53\xef')
+        self.probe(inventory)
+        self.assertEqual(self.built, [DISK_NAME])
+
+        # a logical partition added to the EBR chain
+        self.writeEBRs(LOGICAL + [(0x83, 2048, 4096)])
+        disks = self.probe(inventory)
+        self.assertEqual(self.built, [DISK_NAME])
+        self.assertEqual(len(disks[0]['parts']), 7)
+
+        # something else the entry is built from
+        self.probe(inventory, context=(('mpatha', ('sdz',)),))
+        self.assertEqual(self.built, [DISK_NAME])
+        self.probe(inventory, context=(('mpatha', ('sdz',)),))
+        self.assertEqual(self.built, [])
+    # testProbe()
+
+    def testRefresh(self):
+        inventory = DiskInventory()
+        self.probe(inventory)
+
+        inventory.refresh('sdy')
+        self.probe(inventory)
+        self.assertEqual(self.built, [])
+
+        inventory.refresh(DISK_NAME)
+        self.probe(inventory)
+        self.assertEqual(self.built, [DISK_NAME])
+
+        generation = inventory.generation()
+        inventory.refresh()
+        self.assertEqual(inventory.generation(), generation + 1)
+        self.probe(inventory)
+        self.assertEqual(self.built, [DISK_NAME])
+
+        # disks the build leaves out are not returned, but still cached
+        inventory.refresh()
+        self.assertEqual(inventory.probe([DISK_NAME], lambda s: None), [])
+        self.assertEqual(self.probe(inventory), [])
+        self.assertEqual(self.built, [])
+    # testRefresh()
+# DiskInventoryTestCase()
+
+
+if __name__ == "__main__":
+    unittest.main()